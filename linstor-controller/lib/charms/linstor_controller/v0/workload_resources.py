@@ -0,0 +1,170 @@
+# Copyright 2022 LINBIT HA-Solutions GmbH
+# See LICENSE file for licensing details.
+
+"""Container resources and update strategy of workloads created by Juju.
+
+Pod spec v3 has no field for container resources or the update strategy, so they are patched onto the Deployment or
+DaemonSet after Juju created it. Juju replaces the workload whenever it applies a pod spec, which drops the patch
+again. The charm applying the pod spec can't see that happen, so ensure_workload_resources() must be called
+periodically, e.g. on every update-status, in addition to every change of the pod spec or config.
+
+Shared by the LINSTOR charms, fetch it with:
+
+    charmcraft fetch-lib charms.linstor_controller.v0.workload_resources
+"""
+import logging
+import re
+import typing
+
+import kubernetes
+
+# The unique Charmhub library identifier, never change it
+LIBID = "83db1fc30d894432a4cb541b44ea2028"
+
+# Increment this major API version when introducing breaking changes
+LIBAPI = 0
+
+# Increment this PATCH version before using `charmcraft publish-lib` or reset
+# to 0 if you are raising the major API version
+LIBPATCH = 2
+
+logger = logging.getLogger(__name__)
+
+_FIELD_MANAGER = "charms.linbit.com/v1"
+
+_QUANTITY_RE = re.compile(r"^([0-9]+(?:\.[0-9]+)?)([numkMGTPE]|[KMGTPE]i)?$")
+_QUANTITY_FACTORS = {
+    None: 1,
+    "n": 1e-9,
+    "u": 1e-6,
+    "m": 1e-3,
+    "k": 1e3,
+    "M": 1e6,
+    "G": 1e9,
+    "T": 1e12,
+    "P": 1e15,
+    "E": 1e18,
+    "Ki": 2**10,
+    "Mi": 2**20,
+    "Gi": 2**30,
+    "Ti": 2**40,
+    "Pi": 2**50,
+    "Ei": 2**60,
+}
+
+
+def parse_quantity(name: str, value: str) -> float:
+    match = _QUANTITY_RE.match(value)
+    if not match:
+        raise ValueError(f"{name}: '{value}' is not a valid Kubernetes quantity")
+    return float(match.group(1)) * _QUANTITY_FACTORS[match.group(2)]
+
+
+def container_resources(config: typing.Mapping) -> dict:
+    """Build the resource requirements of the main container from the charm config.
+
+    Reads the cpu-request, cpu-limit, memory-request, memory-limit and guaranteed-qos options. Raises ValueError if the
+    configuration would be rejected by Kubernetes.
+    """
+    requests = {}
+    limits = {}
+    for resource in ("cpu", "memory"):
+        request = config[f"{resource}-request"]
+        limit = config[f"{resource}-limit"]
+        request_value = parse_quantity(f"{resource}-request", request) if request else None
+        limit_value = parse_quantity(f"{resource}-limit", limit) if limit else None
+
+        if config["guaranteed-qos"]:
+            # Guaranteed QoS requires requests == limits for every resource
+            if not request:
+                raise ValueError(f"guaranteed-qos requires {resource}-request to be set")
+            if limit and limit_value != request_value:
+                raise ValueError(f"guaranteed-qos requires {resource}-limit to be empty or equal to the request")
+            limit = request
+        elif request and limit and request_value > limit_value:
+            raise ValueError(f"{resource}-request must not be greater than {resource}-limit")
+
+        if request:
+            requests[resource] = request
+        if limit:
+            limits[resource] = limit
+
+    result = {}
+    if limits:
+        result["limits"] = limits
+    if requests:
+        result["requests"] = requests
+    return result
+
+
+def same_resources(a: dict, b: dict) -> bool:
+    """Compare resource requirements by value, as Kubernetes normalizes quantities, i.e. "1000m" becomes "1"."""
+    def normalize(resources):
+        return {
+            kind: {k: parse_quantity(k, str(v)) for k, v in (resources.get(kind) or {}).items()}
+            for kind in ("limits", "requests")
+        }
+
+    return normalize(a) == normalize(b)
+
+
+def ensure_workload_resources(
+    apps_v1: kubernetes.client.AppsV1Api,
+    kind: str,
+    name: str,
+    namespace: str,
+    container_name: typing.Optional[str],
+    resources: dict,
+    strategy: typing.Optional[str] = None,
+) -> bool:
+    """Patch the resources of a container and the update strategy onto a Deployment or DaemonSet, if they differ.
+
+    If container_name is None, the resources are applied to every container and init container of the pod. A pod is
+    only in the Guaranteed QoS class if all of its containers are. The strategy is only supported for Deployments.
+    Returns False if Juju did not create the workload or the container yet, True once the workload is up to date.
+    """
+    if kind == "Deployment":
+        read, patch_workload = apps_v1.read_namespaced_deployment, apps_v1.patch_namespaced_deployment
+    elif kind == "DaemonSet":
+        read, patch_workload = apps_v1.read_namespaced_daemon_set, apps_v1.patch_namespaced_daemon_set
+    else:
+        raise ValueError(f"unsupported workload kind {kind}")
+
+    try:
+        workload = read(name, namespace)
+    except kubernetes.client.exceptions.ApiException as e:
+        if e.status == 404:
+            return False
+        raise
+
+    pod_spec = workload.spec.template.spec
+    targets = [
+        (field, idx, container)
+        for field, containers in (("containers", pod_spec.containers), ("initContainers", pod_spec.init_containers))
+        for idx, container in enumerate(containers or [])
+        if container_name is None or container.name == container_name
+    ]
+    if not targets:
+        return False
+
+    patch = []
+    for field, idx, container in targets:
+        current = apps_v1.api_client.sanitize_for_serialization(container.resources) or {}
+        if not same_resources(current, resources):
+            logger.info("updating resources of container %s in %s %s: %s", container.name, kind, name, resources)
+            patch.append(
+                {
+                    "op": "add",
+                    "path": f"/spec/template/spec/{field}/{idx}/resources",
+                    "value": resources,
+                }
+            )
+
+    if strategy and (not workload.spec.strategy or workload.spec.strategy.type != strategy):
+        logger.info("switching %s %s to the %s strategy", kind, name, strategy)
+        patch.append({"op": "add", "path": "/spec/strategy", "value": {"type": strategy}})
+
+    if patch:
+        patch_workload(name, namespace, patch, field_manager=_FIELD_MANAGER)
+
+    return True
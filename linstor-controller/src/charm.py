@@ -11,18 +11,106 @@ develop a new k8s charm using the Operator Framework:
 
     https://discourse.charmhub.io/t/4208
 """
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import gzip
+import hashlib
+import itertools
 import json
 import logging
+import lzma
+import pathlib
+import time
+import typing
 
+import kubernetes
+import linstor
 import toml
+import yaml
+from charms.linstor_controller.v0.java_opts import build_java_opts
+from charms.linstor_controller.v0.linstor_props import drbd_option_props, plan_props
+from charms.linstor_controller.v0.pod_spec import apply_pod_spec, forget_pod_spec
+from charms.linstor_controller.v0.reconcile import reconciled, retry_later, run_due_steps, run_step
+from charms.linstor_controller.v0.workload_resources import (
+    container_resources,
+    ensure_workload_resources,
+)
 from oci_image import OCIImageResourceError
-from ops import charm, main, model
+from ops import charm, framework, main, model
 
 logger = logging.getLogger(__name__)
 
 __version__ = "1.0.0"
 
 _API_PORT = 3370
+_HTTPS_API_PORT = 3371
+
+# Alert rules and dashboards shipped with the charm, published on the metrics-endpoint and grafana-dashboard relations.
+_ALERT_RULES_DIR = pathlib.Path(__file__).parent / "prometheus_alert_rules"
+_DASHBOARDS_DIR = pathlib.Path(__file__).parent / "grafana_dashboards"
+
+# Settings of linstor.toml that can be set via the linstor-toml option, with their expected types. The [db]
+# connection settings are managed by the charm.
+_LINSTOR_TOML_SCHEMA = {
+    "http": {"enabled": bool, "listen_addr": str, "port": int},
+    "https": {
+        "enabled": bool,
+        "listen_addr": str,
+        "port": int,
+        "keystore": str,
+        "keystore_password": str,
+        "truststore": str,
+        "truststore_password": str,
+    },
+    "logging": {
+        "level": str,
+        "linstor_level": str,
+        "rest_access_log_path": str,
+        "rest_access_log_mode": str,
+        "rest_access_max_files": int,
+    },
+    "db": {
+        "k8s": {"request_retries": int, "max_rollback_entries": int},
+        "etcd": {"ops_per_transaction": int, "prefix": str},
+    },
+}
+
+# Log levels from the [logging] section that are set through the API instead of linstor.toml, so changing them does
+# not restart the controller. Maps the setting to whether it applies to the libraries used by LINSTOR.
+_RUNTIME_LOG_LEVELS = {"level": True, "linstor_level": False}
+
+# Name of the database requested on the database relation.
+_DATABASE_NAME = "linstor"
+
+_LINSTOR_DATABASE_TOOL = "/usr/share/linstor-server/bin/linstor-database"
+
+# API group of the custom resources storing the LINSTOR database.
+_LINSTOR_CRD_GROUP = "internal.linstor.linbit.com"
+
+# Metadata set by Kubernetes, which can't be restored.
+_SERVER_METADATA = ("uid", "resourceVersion", "generation", "creationTimestamp", "managedFields", "selfLink")
+
+# Migrates the database by streaming an export of the source database through a FIFO into the import of the target.
+# The configurations are mounted from a Secret, as the target configuration contains the database password.
+_MIGRATION_SCRIPT = """set -e
+mkfifo /tmp/linstor-db.json
+{tool} export-db -c /etc/linstor/source /tmp/linstor-db.json &
+export_pid=$!
+{tool} import-db -c /etc/linstor/target /tmp/linstor-db.json
+wait $export_pid
+echo "database migration finished"
+""".format(tool=_LINSTOR_DATABASE_TOOL)
+
+# Records the database backend the controller runs on, on the Secret holding linstor.toml.
+_DATABASE_BACKEND_ANNOTATION = "charms.linbit.com/database-backend"
+
+# Digest of the files in the config Secret, set on the controller pods so they restart when the config changes.
+_CONFIG_DIGEST_ANNOTATION = "charms.linbit.com/config-digest"
+
+# Lists the DRBD option properties set by the charm, so options removed from the config can be removed again.
+_MANAGED_DRBD_OPTIONS_KEY = f"{linstor.sharedconsts.NAMESPC_AUXILIARY}/charm/drbd-options"
 
 _DEFAULTS = {
     "linstor-controller-image": {
@@ -33,30 +121,96 @@ _DEFAULTS = {
 
 
 class LinstorControllerCharm(charm.CharmBase):
+    _stored = framework.StoredState()
+
     def __init__(self, *args):
         super().__init__(*args)
 
+        self._stored.set_default(pending={}, pod_spec_digest=None, database_backend=None, stopped_replicas=None)
+
+        self._apps_v1 = None
+        self._core_v1 = None
+        self._batch_v1 = None
+        self._apiextensions_v1 = None
+        self._custom_objects = None
+
+        self.framework.observe(
+            self.on.linstor_api_relation_joined, self._on_linstor_api_relation_changed
+        )
         self.framework.observe(
             self.on.linstor_api_relation_changed, self._on_linstor_api_relation_changed
         )
+        self.framework.observe(self.on.database_relation_joined, self._on_database_relation_joined)
+        self.framework.observe(self.on.database_relation_changed, self._set_pod_spec)
+        self.framework.observe(self.on.database_relation_broken, self._on_database_relation_broken)
+        self.framework.observe(self.on.migrate_database_action, self._on_migrate_database_action)
+        self.framework.observe(self.on.backup_database_action, self._on_backup_database_action)
+        self.framework.observe(self.on.restore_database_action, self._on_restore_database_action)
+        self.framework.observe(self.on.metrics_endpoint_relation_joined, self._on_monitoring_relation_joined)
+        self.framework.observe(self.on.grafana_dashboard_relation_joined, self._on_monitoring_relation_joined)
 
         self.framework.observe(self.on.install, self._set_pod_spec)
         self.framework.observe(self.on.upgrade_charm, self._set_pod_spec)
         self.framework.observe(self.on.config_changed, self._set_pod_spec)
+        self.framework.observe(self.on.update_status, self._on_update_status)
+        self.framework.observe(self.on.leader_elected, self._on_leader_elected)
 
     def _set_pod_spec(self, event: charm.HookEvent):
         try:
             linstor_controller_image = self.get_image("linstor-controller-image")
         except OCIImageResourceError as e:
             self.unit.status = e.status
-            event.defer()
+            self._retry_later("pod-spec", "images not available")
             return
 
-        linstor_conf = toml.dumps(
-            {
-                "db": {"connection_url": "k8s"},
-            }
-        )
+        try:
+            resources = container_resources(self.config)
+            java_opts = build_java_opts(self.config, resources.get("limits", {}).get("memory"))
+            database = self._database_config()
+            settings = _parse_linstor_toml(self.config["linstor-toml"])
+        except ValueError as e:
+            self.unit.status = model.BlockedStatus(f"invalid config: {e}")
+            return
+
+        if database is None:
+            self.unit.status = model.WaitingStatus("waiting for database credentials")
+            return
+
+        backend = self._database_backend()
+        migration_pending = False
+        if self.unit.is_leader():
+            try:
+                active_backend = self._active_database_backend()
+            except kubernetes.client.exceptions.ApiException as e:
+                self._retry_later("pod-spec", f"could not read the controller config: {e.reason}")
+                return
+
+            if active_backend is not None and active_backend != backend:
+                if active_backend != "k8s":
+                    self.unit.status = model.BlockedStatus(
+                        f"controller uses database backend {active_backend}, configure it again"
+                    )
+                    return
+                # The new database is empty until migrate-database copied the Kubernetes backend into it.
+                backend, database = "k8s", {"connection_url": "k8s"}
+                migration_pending = True
+
+        linstor_conf = toml.dumps(_linstor_toml(database, settings))
+        http_port = settings.get("http", {}).get("port", _API_PORT)
+        container_ports = [{"name": "linstor-api", "containerPort": http_port}]
+        service_ports = [{"name": "linstor-api", "protocol": "TCP", "port": _API_PORT, "targetPort": http_port}]
+        if settings.get("https", {}).get("enabled"):
+            https_port = settings["https"].get("port", _HTTPS_API_PORT)
+            container_ports.append({"name": "linstor-api-tls", "containerPort": https_port})
+            service_ports.append(
+                {"name": "linstor-api-tls", "protocol": "TCP", "port": _HTTPS_API_PORT, "targetPort": https_port}
+            )
+
+        if database["connection_url"] == "k8s":
+            backend_verbs = ["get", "list", "create", "delete", "update", "patch", "watch"]
+        else:
+            # The CRDs are only read, to migrate their content to the configured database.
+            backend_verbs = ["get", "list", "watch"]
 
         linstor_client_conf = f"""[global]
 controllers = {self._linstor_api_url()}
@@ -72,25 +226,17 @@ controllers = {self._linstor_api_url()}
             "K8S_AWAIT_ELECTION_IDENTITY": {
                 "field": {"path": "metadata.name", "api-version": "v1"}
             },
-            "K8S_AWAIT_ELECTION_POD_IP": {
-                "field": {"path": "status.podIP", "api-version": "v1"}
-            },
-            "K8S_AWAIT_ELECTION_NODE_NAME": {
-                "field": {"path": "spec.nodeName", "api-version": "v1"}
-            },
-            "K8S_AWAIT_ELECTION_SERVICE_NAME": "linstor-api",
-            "K8S_AWAIT_ELECTION_SERVICE_NAMESPACE": {
-                "field": {"path": "metadata.namespace", "api-version": "v1"}
-            },
-            "K8S_AWAIT_ELECTION_SERVICE_PORTS_JSON": json.dumps(
-                [{"name": "linstor-api", "port": _API_PORT}]
-            ),
             "K8S_AWAIT_ELECTION_STATUS_ENDPOINT": ":9999",
         }
+        if java_opts:
+            linstor_election_env["JAVA_OPTS"] = java_opts
+
+        config_files = {"linstor.toml": linstor_conf, "linstor-client.conf": linstor_client_conf}
 
         if self.unit.is_leader():
-            self.app.status = model.MaintenanceStatus("Setting pod spec")
-            self.model.pod.set_spec(
+            apply_pod_spec(
+                self,
+                self._stored,
                 spec={
                     "version": 3,
                     "containers": [
@@ -98,23 +244,20 @@ controllers = {self._linstor_api_url()}
                             "name": "linstor-controller",
                             "imageDetails": linstor_controller_image,
                             "args": ["startController"],
-                            "ports": [
-                                {"name": "linstor-api", "containerPort": _API_PORT},
-                            ],
+                            "ports": container_ports,
                             "volumeConfig": [
                                 {
+                                    # linstor.toml contains the database password, so /etc/linstor is a Secret.
                                     "name": "linstor",
                                     "mountPath": "/etc/linstor",
-                                    "files": [
-                                        {
-                                            "path": "linstor.toml",
-                                            "content": linstor_conf,
-                                        },
-                                        {
-                                            "path": "linstor-client.conf",
-                                            "content": linstor_client_conf,
-                                        },
-                                    ],
+                                    "secret": {
+                                        "name": self._config_secret_name(),
+                                        "defaultMode": 0o400,
+                                        "files": [
+                                            {"key": "linstor.toml", "path": "linstor.toml"},
+                                            {"key": "linstor-client.conf", "path": "linstor-client.conf"},
+                                        ],
+                                    },
                                 }
                             ],
                             "envConfig": linstor_election_env,
@@ -130,6 +273,20 @@ controllers = {self._linstor_api_url()}
                                     "successThreshold": 1,
                                     "timeoutSeconds": 1,
                                 },
+                                # Only the elected controller starts the REST API, standby replicas stay unready.
+                                # The linstor-api Service selects ready pods, so after a failover clients are only
+                                # sent to the new controller once it can answer requests.
+                                "readinessProbe": {
+                                    "failureThreshold": self.config["readiness-failure-threshold"],
+                                    "httpGet": {
+                                        "path": "/health",
+                                        "port": http_port,
+                                        "scheme": "HTTP",
+                                    },
+                                    "periodSeconds": self.config["readiness-period"],
+                                    "successThreshold": 1,
+                                    "timeoutSeconds": 1,
+                                },
                             },
                         },
                     ],
@@ -149,18 +306,6 @@ controllers = {self._linstor_api_url()}
                                             "create",
                                         ],
                                     },
-                                    {
-                                        "apiGroups": [""],
-                                        "resources": [
-                                            "endpoints",
-                                            "endpoints/restricted",
-                                        ],
-                                        "verbs": [
-                                            "create",
-                                            "patch",
-                                            "update",
-                                        ],
-                                    },
                                 ],
                             },
                             {
@@ -170,29 +315,13 @@ controllers = {self._linstor_api_url()}
                                     {
                                         "apiGroups": ["apiextensions.k8s.io"],
                                         "resources": ["customresourcedefinitions"],
-                                        "verbs": [
-                                            "get",
-                                            "list",
-                                            "create",
-                                            "delete",
-                                            "update",
-                                            "patch",
-                                            "watch",
-                                        ],
+                                        "verbs": backend_verbs,
                                     },
                                     {
                                         "apiGroups": ["internal.linstor.linbit.com"],
                                         # All these resources are dedicated just to the controller, so allow any
                                         "resources": ["*"],
-                                        "verbs": [
-                                            "get",
-                                            "list",
-                                            "create",
-                                            "delete",
-                                            "update",
-                                            "patch",
-                                            "watch",
-                                        ],
+                                        "verbs": backend_verbs,
                                     },
                                 ],
                             },
@@ -201,37 +330,568 @@ controllers = {self._linstor_api_url()}
                 },
                 k8s_resources={
                     "kubernetesResources": {
+                        "secrets": [
+                            {
+                                "name": self._config_secret_name(),
+                                "type": "Opaque",
+                                "annotations": {_DATABASE_BACKEND_ANNOTATION: backend},
+                                "stringData": config_files,
+                            },
+                        ],
+                        # Changes of the Secret don't change the pod template, so restart the controller through
+                        # an annotation.
+                        "pod": {
+                            "annotations": {
+                                _CONFIG_DIGEST_ANNOTATION: hashlib.sha256(
+                                    json.dumps(config_files, sort_keys=True).encode()
+                                ).hexdigest(),
+                            },
+                        },
                         "services": [
                             {
                                 "name": "linstor-api",
+                                "annotations": {
+                                    "prometheus.io/scrape": "true",
+                                    "prometheus.io/port": str(http_port),
+                                    "prometheus.io/path": "/metrics",
+                                },
                                 "spec": {
                                     "type": "ClusterIP",
                                     "clusterIP": "",
-                                    "ports": [
-                                        {
-                                            "name": "linstor-api",
-                                            "protocol": "TCP",
-                                            "port": _API_PORT,
-                                            "targetPort": _API_PORT,
-                                        },
-                                    ],
+                                    "selector": {"app.kubernetes.io/name": self.app.name},
+                                    "ports": service_ports,
                                 },
                             },
                         ],
                     },
                 },
             )
+            self._stored.database_backend = backend
+            self._ensure_workload_resources()
             self.app.status = model.ActiveStatus()
 
-        self.unit.status = model.ActiveStatus()
+        self._reconciled("pod-spec")
+        if migration_pending:
+            self.unit.status = model.BlockedStatus("run the migrate-database action to use the configured database")
+        else:
+            self.unit.status = model.ActiveStatus()
+
+        self._ensure_drbd_options()
+        self._ensure_log_levels()
+        self._update_monitoring_relations()
+        self._update_linstor_api_endpoints()
+
+    def _on_monitoring_relation_joined(self, _event: charm.RelationJoinedEvent):
+        self._update_monitoring_relations()
+
+    def _update_monitoring_relations(self):
+        """Publish the scrape job, alert rules and dashboards on the metrics-endpoint and grafana-dashboard relations.
+
+        This speaks the prometheus_scrape and grafana_dashboard interfaces. The controller serves its metrics on the
+        API port, so the scrape target is the linstor-api Service, which always points to the active controller.
+        """
+        if not self.unit.is_leader():
+            return
+
+        topology = {
+            "model": self.model.name,
+            "model_uuid": self.model.uuid,
+            "application": self.app.name,
+            "charm_name": self.meta.name,
+        }
+        for relation in self.model.relations["metrics-endpoint"]:
+            relation.data[self.app]["scrape_metadata"] = json.dumps(topology)
+            relation.data[self.app]["scrape_jobs"] = json.dumps(
+                [
+                    {
+                        "metrics_path": "/metrics",
+                        "static_configs": [{"targets": [f"linstor-api.{self.model.name}.svc:{_API_PORT}"]}],
+                    }
+                ]
+            )
+            relation.data[self.app]["alert_rules"] = json.dumps(_alert_rules(_ALERT_RULES_DIR, topology))
+
+        for relation in self.model.relations["grafana-dashboard"]:
+            relation.data[self.app]["dashboards"] = json.dumps(_dashboards(_DASHBOARDS_DIR, topology))
+
+    def _ensure_log_levels(self):
+        """Set the log levels from the [logging] section of linstor-toml through the API.
+
+        The levels are not part of the rendered linstor.toml, so changing them does not restart the controller. They
+        are set again on every update-status, as a restarted controller starts with the default levels.
+        """
+        if not self.unit.is_leader():
+            return
+
+        try:
+            logging_conf = _parse_linstor_toml(self.config["linstor-toml"]).get("logging", {})
+        except ValueError as e:
+            self.unit.status = model.BlockedStatus(f"invalid config: {e}")
+            return
+
+        try:
+            with self._linstor_client() as client:
+                for key, library in _RUNTIME_LOG_LEVELS.items():
+                    level = linstor.LogLevelEnum.check(logging_conf.get(key, "INFO"))
+                    _assert_no_linstor_error(client.controller_set_log_level(level, library=library))
+        except linstor.errors.LinstorNetworkError:
+            self._retry_later("log-levels", "controller not online")
+            return
+        except linstor.errors.LinstorError as e:
+            # Retrying does not help if LINSTOR rejects the level, it needs a config change.
+            logger.warning("failed to set log levels: %s", e)
+            self._reconciled("log-levels")
+            self.unit.status = model.BlockedStatus(f"invalid log levels: {e}")
+            return
+
+        self._reconciled("log-levels")
+
+    def _ensure_drbd_options(self):
+        """Apply the configured DRBD options as controller properties, only sending properties that changed"""
+        if not self.unit.is_leader():
+            return
+
+        try:
+            desired = _parse_drbd_options(self.config["drbd-options"])
+        except ValueError as e:
+            self.unit.status = model.BlockedStatus(f"invalid config: {e}")
+            return
+
+        try:
+            with self._linstor_client() as client:
+                current = client.controller_props()[0].properties
+                to_set, to_delete = plan_props(desired, current, _MANAGED_DRBD_OPTIONS_KEY)
+                if not to_set and not to_delete:
+                    logger.debug("DRBD options up to date")
+                else:
+                    logger.info("updating DRBD options: set %s, delete %s", to_set, to_delete)
+                    for key, value in to_set.items():
+                        _assert_no_linstor_error(client.controller_set_prop(key, value))
+                    for key in to_delete:
+                        _assert_no_linstor_error(client.controller_del_prop(key))
+        except linstor.errors.LinstorNetworkError:
+            self._retry_later("drbd-options", "controller not online")
+            return
+        except linstor.errors.LinstorError as e:
+            # Retrying does not help if LINSTOR rejects an option, it needs a config change.
+            logger.warning("failed to update DRBD options: %s", e)
+            self._reconciled("drbd-options")
+            self.unit.status = model.BlockedStatus(f"invalid drbd-options: {e}")
+            return
+
+        self._reconciled("drbd-options")
 
-    def _on_linstor_api_relation_changed(self, event: charm.RelationChangedEvent):
+    def _database_config(self) -> typing.Optional[dict]:
+        """Return the [db] section of linstor.toml.
+
+        A related database takes precedence over the database-url option. Without either, the Kubernetes backend is
+        used. Returns None while the related database has not sent credentials yet.
+        """
+        relation = self.model.get_relation("database")
+        if relation is not None:
+            data = relation.data[relation.app] if relation.app else {}
+            if not all(data.get(key) for key in ("endpoints", "username", "password")):
+                return None
+
+            host = data["endpoints"].split(",")[0]
+            return {
+                "connection_url": f"jdbc:postgresql://{host}/{_DATABASE_NAME}",
+                "user": data["username"],
+                "password": data["password"],
+            }
+
+        url = self.config["database-url"]
+        if not url:
+            return {"connection_url": "k8s"}
+
+        if not url.startswith(("jdbc:", "etcd://")):
+            raise ValueError("database-url must be a JDBC URL (jdbc:...) or an etcd URL (etcd://...)")
+
+        database = {"connection_url": url}
+        if self.config["database-user"]:
+            database["user"] = self.config["database-user"]
+        if self.config["database-password"]:
+            database["password"] = self.config["database-password"]
+        return database
+
+    def _database_backend(self) -> str:
+        """Name the configured database backend: the database relation, the database-url or "k8s"."""
+        if self.model.get_relation("database") is not None:
+            return "database-relation"
+        return self.config["database-url"] or "k8s"
+
+    def _active_database_backend(self) -> typing.Optional[str]:
+        """Return the database backend the controller was started with, None if no pod spec was set yet.
+
+        The backend is kept in stored state and as annotation on the config Secret, from where a new leader reads it.
+        """
+        if self._stored.database_backend is None:
+            try:
+                secret = self.core_v1.read_namespaced_secret(self._config_secret_name(), self.model.name)
+            except kubernetes.client.exceptions.ApiException as e:
+                if e.status == 404:
+                    return None
+                raise
+            self._stored.database_backend = (secret.metadata.annotations or {}).get(_DATABASE_BACKEND_ANNOTATION)
+        return self._stored.database_backend
+
+    def _config_secret_name(self) -> str:
+        return f"{self.app.name}-config"
+
+    def _on_database_relation_joined(self, event: charm.RelationJoinedEvent):
         if self.unit.is_leader():
-            event.relation.data[self.app]["url"] = self._linstor_api_url()
+            event.relation.data[self.app]["database"] = _DATABASE_NAME
+
+    def _on_database_relation_broken(self, _event: charm.RelationBrokenEvent):
+        if self._stored.database_backend != "database-relation":
+            # The related database was never migrated to, the controller still uses its previous backend.
+            self.unit.status = model.ActiveStatus()
+            return
+
+        # Switching to another backend would start the controller with an empty database. _set_pod_spec keeps the
+        # current spec until the database is related again.
+        self.unit.status = model.BlockedStatus("database relation removed, relate the database again")
+
+    def _on_migrate_database_action(self, event: charm.ActionEvent):
+        if not self.unit.is_leader():
+            event.fail("the database can only be migrated by the leader")
+            return
+
+        try:
+            target = self._database_config()
+        except ValueError as e:
+            event.fail(f"invalid config: {e}")
+            return
+
+        if target is None or target["connection_url"] == "k8s":
+            event.fail("configure a database via the database relation or database-url first")
+            return
+
+        try:
+            active_backend = self._active_database_backend()
+        except kubernetes.client.exceptions.ApiException as e:
+            event.fail(f"could not read the controller config: {e.reason}")
+            return
+
+        if active_backend != "k8s":
+            event.fail("the LINSTOR database is not stored in Kubernetes resources")
+            return
+
+        namespace = self.model.name
+        job_name = f"{self.app.name}-migrate-database"
+        try:
+            # The controller must not change the source database during the export.
+            with self._controller_stopped(event, event.params["timeout"]) as deployment:
+                try:
+                    event.log("migrating the database")
+                    self.core_v1.create_namespaced_secret(
+                        namespace,
+                        {
+                            "metadata": {"name": job_name},
+                            "stringData": {
+                                "source": toml.dumps({"db": {"connection_url": "k8s"}}),
+                                "target": toml.dumps({"db": target}),
+                            },
+                        },
+                    )
+                    self.batch_v1.create_namespaced_job(
+                        namespace, _migration_job(job_name, deployment.spec.template.spec, job_name)
+                    )
+                    _wait_for(
+                        lambda: _job_finished(self.batch_v1.read_namespaced_job_status(job_name, namespace)),
+                        event.params["timeout"],
+                        "migration job to finish",
+                    )
+
+                    job = self.batch_v1.read_namespaced_job_status(job_name, namespace)
+                    log = self._job_log(job_name)
+                finally:
+                    for delete in (
+                        lambda: self.batch_v1.delete_namespaced_job(
+                            job_name, namespace, propagation_policy="Background"
+                        ),
+                        lambda: self.core_v1.delete_namespaced_secret(job_name, namespace),
+                    ):
+                        try:
+                            delete()
+                        except kubernetes.client.exceptions.ApiException as e:
+                            if e.status != 404:
+                                raise
+        except (kubernetes.client.exceptions.ApiException, TimeoutError) as e:
+            event.fail(f"database migration failed: {e}")
+            return
+
+        if not job.status.succeeded:
+            event.fail(f"database migration failed: {log}")
+            return
+
+        # Only now the controller is switched to the configured database.
+        event.log("switching the controller to the migrated database")
+        self._stored.database_backend = self._database_backend()
+        self._set_pod_spec(event)
+        event.set_results({"log": log})
+
+    def _on_backup_database_action(self, event: charm.ActionEvent):
+        if not self._check_k8s_backend(event):
+            return
+
+        directory = pathlib.Path(event.params["path"])
+        archive = directory / f"linstor-{time.strftime('%Y%m%d-%H%M%S')}.jsonl.gz"
+        start = time.monotonic()
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            with contextlib.ExitStack() as stack:
+                if event.params["stop-controller"]:
+                    stack.enter_context(self._controller_stopped(event, event.params["timeout"]))
+                event.log(f"writing backup to {archive}")
+                counts = _backup_linstor_resources(
+                    self.apiextensions_v1, self.custom_objects, archive, event.params["page-size"]
+                )
+        except (kubernetes.client.exceptions.ApiException, TimeoutError, OSError) as e:
+            event.fail(f"backup failed: {e}")
+            return
+
+        event.set_results(_transfer_results(counts, archive.stat().st_size, time.monotonic() - start, path=archive))
+
+    def _on_restore_database_action(self, event: charm.ActionEvent):
+        if not self._check_k8s_backend(event):
+            return
+
+        archive = pathlib.Path(event.params["archive"])
+        if not archive.is_file():
+            event.fail(f"backup archive {archive} does not exist")
+            return
+
+        start = time.monotonic()
+        try:
+            # The controller caches the whole database, so it must not run while the objects are replaced. A partly
+            # restored database must not be used either, so the controller stays stopped if the restore fails.
+            with self._controller_stopped(event, event.params["timeout"], restart_on_error=False):
+                event.log(f"restoring backup from {archive}")
+                counts, pruned = _restore_linstor_resources(
+                    self.apiextensions_v1,
+                    self.custom_objects,
+                    archive,
+                    event.params["batch-size"],
+                    event.params["parallelism"],
+                    event.params["timeout"],
+                    prune=event.params["prune"],
+                )
+        except (kubernetes.client.exceptions.ApiException, TimeoutError, OSError, ValueError) as e:
+            if self._stored.stopped_replicas is None:
+                event.fail(f"restore failed: {e}")
+            else:
+                event.fail(
+                    f"restore failed: {e}. The LINSTOR controller was left stopped, as the database is only partly "
+                    f"restored. Run restore-database again, which starts the controller once it succeeds, or scale "
+                    f"deployment/{self.app.name} back to {self._stored.stopped_replicas} replicas to use the "
+                    f"database as it is."
+                )
+            return
+
+        extra = {"pruned": json.dumps(pruned, sort_keys=True)} if event.params["prune"] else {}
+        event.set_results(_transfer_results(counts, archive.stat().st_size, time.monotonic() - start, **extra))
+
+    def _check_k8s_backend(self, event: charm.ActionEvent) -> bool:
+        if not self.unit.is_leader():
+            event.fail("this action can only run on the leader")
+            return False
+
+        try:
+            active_backend = self._active_database_backend()
+        except kubernetes.client.exceptions.ApiException as e:
+            event.fail(f"could not read the controller config: {e.reason}")
+            return False
+
+        if active_backend != "k8s":
+            event.fail("the LINSTOR database is not stored in Kubernetes resources")
+            return False
+
+        return True
+
+    @contextlib.contextmanager
+    def _controller_stopped(self, event: charm.ActionEvent, timeout: float, restart_on_error: bool = True):
+        """Scale the controller Deployment to zero, yielding the Deployment, and restore the replicas afterwards.
+
+        With restart_on_error=False, the controller stays stopped if the body raises. The replicas are remembered, so
+        a later run starts the controller with them again.
+        """
+        namespace = self.model.name
+        deployment = self.apps_v1.read_namespaced_deployment(self.app.name, namespace)
+        if deployment.spec.replicas:
+            self._stored.stopped_replicas = deployment.spec.replicas
+        replicas = self._stored.stopped_replicas or 1
+
+        restart = True
+        try:
+            event.log("stopping the LINSTOR controller")
+            self.apps_v1.patch_namespaced_deployment_scale(self.app.name, namespace, {"spec": {"replicas": 0}})
+            _wait_for(
+                lambda: not self.core_v1.list_namespaced_pod(
+                    namespace, label_selector=f"app.kubernetes.io/name={self.app.name}"
+                ).items,
+                timeout,
+                "controller pods to stop",
+            )
+            restart = restart_on_error
+            yield deployment
+            restart = True
+        finally:
+            if restart:
+                event.log("starting the LINSTOR controller")
+                self.apps_v1.patch_namespaced_deployment_scale(
+                    self.app.name, namespace, {"spec": {"replicas": replicas}}
+                )
+                self._stored.stopped_replicas = None
+            else:
+                event.log("leaving the LINSTOR controller stopped")
+
+    def _job_log(self, job_name: str) -> str:
+        pods = self.core_v1.list_namespaced_pod(self.model.name, label_selector=f"job-name={job_name}").items
+        if not pods:
+            return ""
+        log = self.core_v1.read_namespaced_pod_log(pods[0].metadata.name, self.model.name, tail_lines=20)
+        return log.strip()
+
+    def _on_linstor_api_relation_changed(self, _event: charm.RelationEvent):
+        self._update_linstor_api_endpoints()
+
+    def _update_linstor_api_endpoints(self):
+        """Publish the LINSTOR API endpoints on all linstor-api relations.
+
+        "url" is the linstor-api Service. "endpoints" lists the Service first, followed by the controller pods with
+        ready pods first, so clients can fall back to a pod directly when the Service is not reachable.
+        """
+        if not self.unit.is_leader():
+            return
+
+        relations = self.model.relations["linstor-api"]
+        if not relations:
+            return
+
+        endpoints = [self._linstor_api_url()]
+        try:
+            port = _parse_linstor_toml(self.config["linstor-toml"]).get("http", {}).get("port", _API_PORT)
+            pods = self.core_v1.list_namespaced_pod(
+                self.model.name, label_selector=f"app.kubernetes.io/name={self.app.name}"
+            ).items
+        except ValueError:
+            # Already reported by _set_pod_spec
+            pods = []
+        except kubernetes.client.exceptions.ApiException as e:
+            # Publish at least the Service, the pods are added again on the next update-status.
+            logger.warning("could not list controller pods: %s", e.reason)
+            pods = []
+
+        for pod in sorted(pods, key=lambda p: not _pod_ready(p)):
+            if pod.status.pod_ip:
+                endpoints.append(f"http://{pod.status.pod_ip}:{port}")
+
+        for relation in relations:
+            relation.data[self.app]["url"] = self._linstor_api_url()
+            relation.data[self.app]["endpoints"] = json.dumps(endpoints)
+
+    def _on_leader_elected(self, _event: charm.LeaderElectedEvent):
+        forget_pod_spec(self._stored)
+        self._update_linstor_api_endpoints()
+
+    def _on_update_status(self, event: charm.UpdateStatusEvent):
+        steps = [
+            ("pod-spec", lambda: self._set_pod_spec(event)),
+            ("workload-resources", self._ensure_workload_resources),
+            ("drbd-options", self._ensure_drbd_options),
+            ("log-levels", self._ensure_log_levels),
+        ]
+
+        ran = run_due_steps(self._stored.pending, steps)
+
+        if "workload-resources" not in ran and "workload-resources" not in self._stored.pending:
+            # The patch is only dropped once Juju applied a new pod spec, after the hook that set it.
+            run_step(self._stored.pending, "workload-resources", self._ensure_workload_resources)
+
+        if "log-levels" not in self._stored.pending and self._stored.pod_spec_digest is not None:
+            run_step(self._stored.pending, "log-levels", self._ensure_log_levels)
+
+        # Controller pods get new addresses when they are restarted, which no hook reports.
+        self._update_linstor_api_endpoints()
+
+    def _ensure_workload_resources(self):
+        """Patch the configured resource requirements and the update strategy onto the controller Deployment.
+
+        Juju pod specs can't express container resources, so they are applied to the Deployment after Juju created it.
+        The Deployment is switched to the Recreate strategy: standby replicas never become ready while the old
+        controller holds the lease, which would stall a rolling update. Juju drops both when it applies a new pod spec,
+        so update-status checks them again.
+        """
+        if not self.unit.is_leader():
+            return
+
+        try:
+            resources = container_resources(self.config)
+        except ValueError:
+            # Already reported by _set_pod_spec
+            return
+
+        if not ensure_workload_resources(
+            self.apps_v1,
+            "Deployment",
+            self.app.name,
+            self.model.name,
+            "linstor-controller",
+            resources,
+            strategy="Recreate",
+        ):
+            self._retry_later("workload-resources", "deployment not created yet")
+            return
+
+        self._reconciled("workload-resources")
+
+    def _retry_later(self, name: str, reason: str):
+        retry_later(self._stored.pending, name, reason)
+
+    def _reconciled(self, name: str):
+        reconciled(self._stored.pending, name)
+
+    @property
+    def apps_v1(self) -> kubernetes.client.AppsV1Api:
+        if self._apps_v1 is None:
+            self._apps_v1 = _apps_v1_api()
+        return self._apps_v1
+
+    @property
+    def core_v1(self) -> kubernetes.client.CoreV1Api:
+        if self._core_v1 is None:
+            self._core_v1 = _core_v1_api()
+        return self._core_v1
+
+    @property
+    def batch_v1(self) -> kubernetes.client.BatchV1Api:
+        if self._batch_v1 is None:
+            self._batch_v1 = _batch_v1_api()
+        return self._batch_v1
+
+    @property
+    def apiextensions_v1(self) -> kubernetes.client.ApiextensionsV1Api:
+        if self._apiextensions_v1 is None:
+            self._apiextensions_v1 = _apiextensions_v1_api()
+        return self._apiextensions_v1
+
+    @property
+    def custom_objects(self) -> kubernetes.client.CustomObjectsApi:
+        if self._custom_objects is None:
+            self._custom_objects = _custom_objects_api()
+        return self._custom_objects
 
     def _linstor_api_url(self):
         return f"http://linstor-api.{self.model.name}.svc:{_API_PORT}"
 
+    def _linstor_client(self) -> linstor.Linstor:
+        return linstor.Linstor(
+            self._linstor_api_url(),
+            timeout=60,
+            agent_info=f"charm-operator/{self.meta.name}/{__version__}",
+        )
+
     def get_image(self, name) -> dict:
         override = self.model.resources.fetch(
             "image-override"
@@ -257,5 +917,383 @@ controllers = {self._linstor_api_url()}
             return {"imagePath": _DEFAULTS[name]["piraeus"]}
 
 
+def _parse_drbd_options(conf_str: str) -> typing.Dict[str, str]:
+    """Parse the DRBD options config into LINSTOR properties.
+
+    The config is a YAML mapping from DRBD configuration section to options, i.e.:
+
+        net:
+          max-buffers: 8000
+        disk:
+          al-extents: 6007
+    """
+    try:
+        conf = yaml.safe_load(conf_str) if conf_str.strip() else None
+    except yaml.YAMLError as e:
+        raise ValueError(f"drbd-options: invalid YAML: {e}")
+    if conf is None:
+        return {}
+    return drbd_option_props("drbd-options", conf)
+
+
+def _alert_rules(rules_dir: pathlib.Path, topology: dict) -> dict:
+    """Load the alert rule groups, restricting the expressions to the metrics of this application"""
+    matchers = ",".join(
+        f'juju_{key}="{topology[key]}"' for key in ("model", "model_uuid", "application")
+    )
+    groups = []
+    for path in sorted(rules_dir.glob("*.rules")):
+        content = path.read_text().replace("%%juju_topology%%", matchers)
+        for group in yaml.safe_load(content)["groups"]:
+            group["name"] = f"{topology['model']}_{topology['application']}_{group['name']}"
+            groups.append(group)
+    return {"groups": groups}
+
+
+def _dashboards(dashboards_dir: pathlib.Path, topology: dict) -> dict:
+    """Load the dashboards in the compressed form expected by the grafana_dashboard interface"""
+    templates = {}
+    for path in sorted(dashboards_dir.glob("*.json")):
+        templates[f"file:{path.name}"] = {
+            "charm": topology["charm_name"],
+            "content": base64.b64encode(lzma.compress(path.read_bytes())).decode(),
+            "juju_topology": topology,
+            "inject_dropdowns": True,
+        }
+    # The consumer only re-reads the dashboards when the uuid changes, so derive it from the content.
+    digest = hashlib.sha256(json.dumps(templates, sort_keys=True).encode()).hexdigest()
+    return {"templates": templates, "uuid": digest}
+
+
+def _parse_linstor_toml(conf_str: str) -> dict:
+    """Parse the linstor-toml option, checking sections, settings and types against the known schema"""
+    try:
+        conf = toml.loads(conf_str)
+    except toml.TomlDecodeError as e:
+        raise ValueError(f"linstor-toml: {e}")
+
+    _check_linstor_toml(conf, _LINSTOR_TOML_SCHEMA, "")
+
+    if not conf.get("http", {}).get("enabled", True):
+        raise ValueError("linstor-toml: http.enabled: the HTTP API is required by the charms")
+
+    for key in _RUNTIME_LOG_LEVELS:
+        level = conf.get("logging", {}).get(key)
+        if level is not None:
+            try:
+                linstor.LogLevelEnum.check(level)
+            except (ValueError, TypeError):
+                # python-linstor fails to format its own error message for unknown levels, raising a TypeError.
+                levels = ", ".join(e.value for e in linstor.LogLevelEnum)
+                raise ValueError(f"linstor-toml: logging.{key}: unknown level '{level}', must be one of: {levels}")
+
+    return conf
+
+
+def _check_linstor_toml(conf: dict, schema: dict, prefix: str):
+    for key, value in conf.items():
+        if key not in schema:
+            raise ValueError(f"linstor-toml: unknown setting '{prefix}{key}'")
+
+        expected = schema[key]
+        if isinstance(expected, dict):
+            if not isinstance(value, dict):
+                raise ValueError(f"linstor-toml: '{prefix}{key}' must be a section")
+            _check_linstor_toml(value, expected, f"{prefix}{key}.")
+        elif not isinstance(value, expected) or isinstance(value, bool) != (expected is bool):
+            raise ValueError(f"linstor-toml: '{prefix}{key}' must be of type {expected.__name__}")
+
+
+def _linstor_toml(database: dict, settings: dict) -> dict:
+    """Merge the database connection and the validated linstor-toml settings into the content of linstor.toml"""
+    conf = {section: dict(values) for section, values in settings.items()}
+    conf["db"] = {**conf.get("db", {}), **database}
+    logging_conf = conf.get("logging", {})
+    for key in _RUNTIME_LOG_LEVELS:
+        logging_conf.pop(key, None)
+    if "logging" in conf and not logging_conf:
+        del conf["logging"]
+    return conf
+
+
+def _assert_no_linstor_error(response: typing.List[linstor.ApiCallResponse]):
+    if not linstor.Linstor.all_api_responses_no_error(response):
+        raise linstor.LinstorError(f"got failure response from Linstor {response}")
+
+
+def _migration_job(name: str, pod_spec: kubernetes.client.V1PodSpec, config_secret: str) -> dict:
+    """Build a Job migrating the LINSTOR database, running with the image and service account of the controller.
+
+    config_secret holds the linstor.toml of the source and the target database under the keys "source" and "target".
+    """
+    controller = next(c for c in pod_spec.containers if c.name == "linstor-controller")
+    return {
+        "apiVersion": "batch/v1",
+        "kind": "Job",
+        "metadata": {"name": name},
+        "spec": {
+            "backoffLimit": 0,
+            "template": {
+                "spec": {
+                    "restartPolicy": "Never",
+                    "serviceAccountName": pod_spec.service_account_name,
+                    "imagePullSecrets": [{"name": s.name} for s in pod_spec.image_pull_secrets or []],
+                    "containers": [
+                        {
+                            "name": "migrate-database",
+                            "image": controller.image,
+                            "command": ["/bin/sh", "-c", _MIGRATION_SCRIPT],
+                            "volumeMounts": [{"name": "config", "mountPath": "/etc/linstor", "readOnly": True}],
+                        }
+                    ],
+                    "volumes": [
+                        {
+                            "name": "config",
+                            "secret": {
+                                "secretName": config_secret,
+                                "defaultMode": 0o400,
+                                "items": [
+                                    {"key": "source", "path": "source/linstor.toml"},
+                                    {"key": "target", "path": "target/linstor.toml"},
+                                ],
+                            },
+                        }
+                    ],
+                },
+            },
+        },
+    }
+
+
+def _backup_linstor_resources(
+    extensions: kubernetes.client.ApiextensionsV1Api,
+    custom_objects: kubernetes.client.CustomObjectsApi,
+    archive: pathlib.Path,
+    page_size: int,
+) -> typing.Dict[str, int]:
+    """Stream the LINSTOR CRDs and all their objects into a gzip compressed archive with one JSON object per line.
+
+    Objects are fetched in pages, so only one page is held in memory at a time. The CRDs come first, so a restore can
+    create them before any object. The archive is written to a temporary name and only renamed when complete, the
+    temporary file is removed if the backup fails.
+    """
+    crds = [
+        crd for crd in extensions.list_custom_resource_definition().items if crd.spec.group == _LINSTOR_CRD_GROUP
+    ]
+    counts = {"customresourcedefinitions": len(crds)}
+    partial = archive.with_name(f"{archive.name}.partial")
+    try:
+        with gzip.open(partial, "wt") as f:
+            for crd in crds:
+                obj = extensions.api_client.sanitize_for_serialization(crd)
+                obj.update(apiVersion="apiextensions.k8s.io/v1", kind="CustomResourceDefinition")
+                f.write(json.dumps(_restorable(obj)) + "\n")
+
+            for crd in crds:
+                version = next(v.name for v in crd.spec.versions if v.storage)
+                plural = crd.spec.names.plural
+                counts[plural] = 0
+                token = None
+                while True:
+                    page = custom_objects.list_cluster_custom_object(
+                        _LINSTOR_CRD_GROUP, version, plural, limit=page_size, _continue=token
+                    )
+                    for obj in page["items"]:
+                        f.write(json.dumps(_restorable(obj)) + "\n")
+                    counts[plural] += len(page["items"])
+                    token = page["metadata"].get("continue")
+                    if not token:
+                        break
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+
+    partial.rename(archive)
+    return counts
+
+
+def _restore_linstor_resources(
+    extensions: kubernetes.client.ApiextensionsV1Api,
+    custom_objects: kubernetes.client.CustomObjectsApi,
+    archive: pathlib.Path,
+    batch_size: int,
+    parallelism: int,
+    timeout: float,
+    prune: bool = False,
+) -> typing.Tuple[typing.Dict[str, int], typing.Dict[str, int]]:
+    """Apply the objects of a backup archive in batches, creating missing objects and replacing existing ones.
+
+    The archive is read in batches of batch_size lines, the objects of a batch are applied by parallelism workers.
+    With prune, objects of the LINSTOR CRDs that are not in the archive are deleted afterwards, the CRDs themselves are
+    kept. Returns the number of restored and of pruned objects per resource type.
+    """
+    plurals = {}
+    counts = {}
+    restored = collections.defaultdict(set)
+    with gzip.open(archive, "rt") as f, concurrent.futures.ThreadPoolExecutor(parallelism) as pool:
+        while True:
+            objs = [json.loads(line) for line in itertools.islice(f, batch_size)]
+            if not objs:
+                break
+
+            futures = []
+            for obj in objs:
+                if obj["kind"] == "CustomResourceDefinition":
+                    _restore_crd(extensions, obj, timeout)
+                    plurals[obj["spec"]["names"]["kind"]] = obj["spec"]["names"]["plural"]
+                    plural = "customresourcedefinitions"
+                elif obj["kind"] in plurals:
+                    plural = plurals[obj["kind"]]
+                    futures.append(pool.submit(_restore_custom_object, custom_objects, plural, obj))
+                    if prune:
+                        restored[plural].add(obj["metadata"]["name"])
+                else:
+                    raise ValueError(f"no CustomResourceDefinition for kind {obj['kind']} in the archive")
+                counts[plural] = counts.get(plural, 0) + 1
+
+            for future in futures:
+                future.result()
+
+        pruned = _prune_linstor_resources(extensions, custom_objects, restored, batch_size, pool) if prune else {}
+
+    return counts, pruned
+
+
+def _prune_linstor_resources(
+    extensions: kubernetes.client.ApiextensionsV1Api,
+    custom_objects: kubernetes.client.CustomObjectsApi,
+    keep: typing.Mapping[str, typing.Set[str]],
+    page_size: int,
+    pool: concurrent.futures.Executor,
+) -> typing.Dict[str, int]:
+    """Delete the objects of the LINSTOR CRDs whose names are not in keep, listing them page by page"""
+    counts = {}
+    for crd in extensions.list_custom_resource_definition().items:
+        if crd.spec.group != _LINSTOR_CRD_GROUP:
+            continue
+
+        version = next(v.name for v in crd.spec.versions if v.storage)
+        plural = crd.spec.names.plural
+        counts[plural] = 0
+        token = None
+        while True:
+            page = custom_objects.list_cluster_custom_object(
+                _LINSTOR_CRD_GROUP, version, plural, limit=page_size, _continue=token
+            )
+            names = [obj["metadata"]["name"] for obj in page["items"]]
+            futures = [
+                pool.submit(_delete_custom_object, custom_objects, version, plural, name)
+                for name in names
+                if name not in keep.get(plural, ())
+            ]
+            for future in futures:
+                future.result()
+            counts[plural] += len(futures)
+            token = page["metadata"].get("continue")
+            if not token:
+                break
+
+    return counts
+
+
+def _delete_custom_object(custom_objects: kubernetes.client.CustomObjectsApi, version: str, plural: str, name: str):
+    try:
+        custom_objects.delete_cluster_custom_object(_LINSTOR_CRD_GROUP, version, plural, name)
+    except kubernetes.client.exceptions.ApiException as e:
+        if e.status != 404:
+            raise
+
+
+def _restore_crd(extensions: kubernetes.client.ApiextensionsV1Api, obj: dict, timeout: float):
+    try:
+        extensions.create_custom_resource_definition(obj)
+    except kubernetes.client.exceptions.ApiException as e:
+        if e.status != 409:
+            raise
+        return
+
+    def established():
+        status = extensions.read_custom_resource_definition(obj["metadata"]["name"]).status
+        return any(c.type == "Established" and c.status == "True" for c in (status and status.conditions) or [])
+
+    _wait_for(established, timeout, f"CustomResourceDefinition {obj['metadata']['name']}")
+
+
+def _restore_custom_object(custom_objects: kubernetes.client.CustomObjectsApi, plural: str, obj: dict):
+    group, version = obj["apiVersion"].split("/")
+    name = obj["metadata"]["name"]
+    try:
+        custom_objects.create_cluster_custom_object(group, version, plural, obj)
+    except kubernetes.client.exceptions.ApiException as e:
+        if e.status != 409:
+            raise
+        existing = custom_objects.get_cluster_custom_object(group, version, plural, name)
+        obj = {**obj, "metadata": {**obj["metadata"], "resourceVersion": existing["metadata"]["resourceVersion"]}}
+        custom_objects.replace_cluster_custom_object(group, version, plural, name, obj)
+
+
+def _restorable(obj: dict) -> dict:
+    """Strip status and server-set metadata from an object, so it can be created again"""
+    obj = {key: value for key, value in obj.items() if key != "status"}
+    obj["metadata"] = {key: value for key, value in obj["metadata"].items() if key not in _SERVER_METADATA}
+    return obj
+
+
+def _transfer_results(counts: typing.Dict[str, int], size: int, duration: float, **extra) -> dict:
+    objects = sum(counts.values())
+    results = {
+        "objects": objects,
+        "bytes": size,
+        "duration": f"{duration:.1f}s",
+        "objects-per-second": f"{objects / max(duration, 0.001):.1f}",
+        "mib-per-second": f"{size / 2 ** 20 / max(duration, 0.001):.2f}",
+        "counts": json.dumps(counts, sort_keys=True),
+    }
+    results.update((key, str(value)) for key, value in extra.items())
+    return results
+
+
+def _pod_ready(pod: kubernetes.client.V1Pod) -> bool:
+    conditions = (pod.status and pod.status.conditions) or []
+    return any(c.type == "Ready" and c.status == "True" for c in conditions)
+
+
+def _job_finished(job: kubernetes.client.V1Job) -> bool:
+    return bool(job.status.succeeded or job.status.failed)
+
+
+def _wait_for(condition: typing.Callable[[], bool], timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"timed out waiting for {what}")
+        time.sleep(2)
+
+
+def _apps_v1_api() -> kubernetes.client.AppsV1Api:
+    kubernetes.config.load_incluster_config()
+    return kubernetes.client.AppsV1Api()
+
+
+def _core_v1_api() -> kubernetes.client.CoreV1Api:
+    kubernetes.config.load_incluster_config()
+    return kubernetes.client.CoreV1Api()
+
+
+def _batch_v1_api() -> kubernetes.client.BatchV1Api:
+    kubernetes.config.load_incluster_config()
+    return kubernetes.client.BatchV1Api()
+
+
+def _apiextensions_v1_api() -> kubernetes.client.ApiextensionsV1Api:
+    kubernetes.config.load_incluster_config()
+    return kubernetes.client.ApiextensionsV1Api()
+
+
+def _custom_objects_api() -> kubernetes.client.CustomObjectsApi:
+    kubernetes.config.load_incluster_config()
+    return kubernetes.client.CustomObjectsApi()
+
+
 if __name__ == "__main__":
     main.main(LinstorControllerCharm)
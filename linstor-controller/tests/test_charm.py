@@ -3,9 +3,29 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
+import base64
+import gzip
+import json
+import lzma
+import os
+import tempfile
 import unittest
+from unittest import mock
 
-from charm import LinstorControllerCharm
+import kubernetes
+import linstor
+import toml
+from charm import (
+    _parse_drbd_options,
+    _parse_linstor_toml,
+    LinstorControllerCharm,
+)
+from charms.linstor_controller.v0.java_opts import build_java_opts
+from charms.linstor_controller.v0.linstor_props import plan_props
+from charms.linstor_controller.v0.pod_spec import spec_digest
+from charms.linstor_controller.v0.reconcile import run_due_steps
+from charms.linstor_controller.v0.workload_resources import container_resources, same_resources
+from ops import model
 from ops.testing import Harness
 
 
@@ -13,4 +33,811 @@ class TestCharm(unittest.TestCase):
     def setUp(self):
         self.harness = Harness(LinstorControllerCharm)
         self.addCleanup(self.harness.cleanup)
+        self.harness.add_resource("image-override", "{}")
+        self.harness.add_resource("pull-secret", "")
         self.harness.begin()
+        self.apps_v1 = mock.Mock()
+        self.apps_v1.read_namespaced_deployment.return_value = kubernetes.client.V1Deployment(
+            spec=kubernetes.client.V1DeploymentSpec(
+                selector=kubernetes.client.V1LabelSelector(),
+                strategy=kubernetes.client.V1DeploymentStrategy(type="Recreate"),
+                template=kubernetes.client.V1PodTemplateSpec(
+                    spec=kubernetes.client.V1PodSpec(
+                        containers=[kubernetes.client.V1Container(name="linstor-controller")]
+                    ),
+                ),
+            ),
+        )
+        self.apps_v1.api_client = kubernetes.client.ApiClient()
+        self.harness.charm._apps_v1 = self.apps_v1
+        self.core_v1 = mock.Mock()
+        self.core_v1.read_namespaced_secret.side_effect = kubernetes.client.exceptions.ApiException(404)
+        self.harness.charm._core_v1 = self.core_v1
+        self.linstor = mock.MagicMock()
+        self.linstor.__enter__.return_value = self.linstor
+        self.linstor.controller_props.return_value = [mock.Mock(properties={})]
+        self.linstor.controller_set_prop.return_value = []
+        self.linstor.controller_del_prop.return_value = []
+        self.linstor.controller_set_log_level.return_value = []
+        self.harness.charm._linstor_client = lambda: self.linstor
+
+    def linstor_toml(self) -> dict:
+        _, k8s_resources = self.harness.get_pod_spec()
+        secret = k8s_resources["kubernetesResources"]["secrets"][0]
+        return toml.loads(secret["stringData"]["linstor.toml"])
+
+    def test_skips_unchanged_pod_spec(self):
+        self.harness.set_leader(True)
+
+        with mock.patch.object(
+            self.harness.charm.model.pod, "set_spec", wraps=self.harness.charm.model.pod.set_spec
+        ) as set_spec:
+            self.harness.charm.on.config_changed.emit()
+            self.harness.charm.on.config_changed.emit()
+            set_spec.assert_called_once()
+
+            self.harness.update_config({"java-heap-size": "1g"})
+            self.assertEqual(2, set_spec.call_count)
+
+    def test_java_opts(self):
+        self.harness.set_leader(True)
+        self.harness.update_config({"java-heap-size": "1g", "java-gc": "G1", "memory-limit": "2Gi"})
+
+        spec, _ = self.harness.get_pod_spec()
+        self.assertEqual(
+            "-Xms1g -Xmx1g -XX:+UseG1GC",
+            spec["containers"][0]["envConfig"]["JAVA_OPTS"],
+        )
+        self.apps_v1.patch_namespaced_deployment.assert_called_once_with(
+            "linstor-controller",
+            self.harness.model.name,
+            [
+                {
+                    "op": "add",
+                    "path": "/spec/template/spec/containers/0/resources",
+                    "value": {"limits": {"memory": "2Gi"}},
+                }
+            ],
+            field_manager="charms.linbit.com/v1",
+        )
+
+    def test_failover(self):
+        self.harness.set_leader(True)
+        self.apps_v1.read_namespaced_deployment.return_value.spec.strategy = None
+        self.harness.update_config({"readiness-period": 1})
+
+        spec, k8s_resources = self.harness.get_pod_spec()
+        container = spec["containers"][0]
+        self.assertEqual(1, container["kubernetes"]["readinessProbe"]["periodSeconds"])
+        self.assertEqual(3370, container["kubernetes"]["readinessProbe"]["httpGet"]["port"])
+        self.assertNotIn("K8S_AWAIT_ELECTION_SERVICE_NAME", container["envConfig"])
+        service = k8s_resources["kubernetesResources"]["services"][0]
+        self.assertEqual({"app.kubernetes.io/name": "linstor-controller"}, service["spec"]["selector"])
+        self.apps_v1.patch_namespaced_deployment.assert_called_once_with(
+            "linstor-controller",
+            self.harness.model.name,
+            [{"op": "add", "path": "/spec/strategy", "value": {"type": "Recreate"}}],
+            field_manager="charms.linbit.com/v1",
+        )
+
+    def test_update_status_restores_workload_patch(self):
+        self.harness.set_leader(True)
+        self.harness.update_config({"memory-limit": "2Gi"})
+        self.apps_v1.patch_namespaced_deployment.assert_called_once()
+
+        # Juju rewrites the Deployment once it applied the new pod spec, dropping the patch.
+        self.apps_v1.patch_namespaced_deployment.reset_mock()
+        deployment = self.apps_v1.read_namespaced_deployment.return_value
+        deployment.spec.strategy = None
+        deployment.spec.template.spec.containers[0].resources = None
+        self.harness.charm.on.update_status.emit()
+
+        self.apps_v1.patch_namespaced_deployment.assert_called_once_with(
+            "linstor-controller",
+            self.harness.model.name,
+            [
+                {
+                    "op": "add",
+                    "path": "/spec/template/spec/containers/0/resources",
+                    "value": {"limits": {"memory": "2Gi"}},
+                },
+                {"op": "add", "path": "/spec/strategy", "value": {"type": "Recreate"}},
+            ],
+            field_manager="charms.linbit.com/v1",
+        )
+
+    def test_invalid_resources_block(self):
+        self.harness.set_leader(True)
+        self.harness.update_config({"cpu-request": "2", "cpu-limit": "1"})
+
+        self.assertIsInstance(self.harness.charm.unit.status, model.BlockedStatus)
+        self.assertIsNone(self.harness.get_pod_spec())
+        self.apps_v1.patch_namespaced_deployment.assert_not_called()
+
+    def test_drbd_options_only_send_changes(self):
+        self.linstor.controller_props.return_value = [
+            mock.Mock(
+                properties={
+                    "DrbdOptions/Net/max-buffers": "8000",
+                    "DrbdOptions/Net/protocol": "A",
+                    "DrbdOptions/Disk/al-extents": "6007",
+                    "DrbdOptions/Net/verify-alg": "md5",
+                    "Aux/charm/drbd-options": "DrbdOptions/Disk/al-extents DrbdOptions/Net/max-buffers",
+                }
+            )
+        ]
+        self.harness.set_leader(True)
+        self.harness.update_config({"drbd-options": "net:\n  max-buffers: 8000\n  protocol: C\n"})
+
+        self.assertEqual(
+            [
+                mock.call("DrbdOptions/Net/protocol", "C"),
+                mock.call("Aux/charm/drbd-options", "DrbdOptions/Net/max-buffers DrbdOptions/Net/protocol"),
+            ],
+            self.linstor.controller_set_prop.call_args_list,
+        )
+        # verify-alg was not set by the charm, so it is left alone
+        self.linstor.controller_del_prop.assert_called_once_with("DrbdOptions/Disk/al-extents")
+
+    def test_invalid_drbd_options_block(self):
+        self.harness.set_leader(True)
+        self.harness.update_config({"drbd-options": "network:\n  max-buffers: 8000\n"})
+
+        self.assertIsInstance(self.harness.charm.unit.status, model.BlockedStatus)
+        self.linstor.controller_set_prop.assert_not_called()
+
+    def test_rejected_drbd_options_block(self):
+        self.linstor.controller_props.return_value = [mock.Mock(properties={})]
+        self.linstor.controller_set_prop.side_effect = linstor.LinstorError("invalid value for max-buffers")
+        self.harness.set_leader(True)
+        self.harness.update_config({"drbd-options": "net:\n  max-buffers: lots\n"})
+
+        self.assertEqual(
+            model.BlockedStatus("invalid drbd-options: Error: invalid value for max-buffers"),
+            self.harness.charm.unit.status,
+        )
+        self.assertNotIn("drbd-options", self.harness.charm._stored.pending)
+
+    def test_drbd_options_retry_while_offline(self):
+        self.linstor.controller_props.side_effect = linstor.errors.LinstorNetworkError("connection refused")
+        self.harness.set_leader(True)
+        self.harness.update_config({"drbd-options": "net:\n  max-buffers: 8000\n"})
+
+        self.assertIsInstance(self.harness.charm.unit.status, model.ActiveStatus)
+        self.assertIn("drbd-options", self.harness.charm._stored.pending)
+
+    def test_database_url(self):
+        self.harness.set_leader(True)
+        self.harness.update_config(
+            {
+                "database-url": "jdbc:postgresql://db.example.com/linstor",
+                "database-user": "linstor",
+                "database-password": "s3cr3t",
+            }
+        )
+
+        # A new deployment starts on the configured database right away.
+        spec, k8s_resources = self.harness.get_pod_spec()
+        self.assertEqual(
+            {
+                "db": {
+                    "connection_url": "jdbc:postgresql://db.example.com/linstor",
+                    "user": "linstor",
+                    "password": "s3cr3t",
+                }
+            },
+            self.linstor_toml(),
+        )
+        self.assertNotIn("s3cr3t", json.dumps(spec))
+        self.assertEqual(
+            {"name": "linstor-controller-config", "defaultMode": 0o400, "files": mock.ANY},
+            spec["containers"][0]["volumeConfig"][0]["secret"],
+        )
+        secret = k8s_resources["kubernetesResources"]["secrets"][0]
+        self.assertEqual(
+            {"charms.linbit.com/database-backend": "jdbc:postgresql://db.example.com/linstor"}, secret["annotations"]
+        )
+        backend_rules = spec["serviceAccount"]["roles"][1]["rules"]
+        self.assertEqual([["get", "list", "watch"]] * 2, [rule["verbs"] for rule in backend_rules])
+
+    def test_database_change_waits_for_migration(self):
+        self.harness.set_leader(True)
+        self.harness.charm.on.config_changed.emit()
+        self.harness.update_config({"database-url": "etcd://etcd.example.com:2379"})
+
+        # The controller keeps the Kubernetes backend until the database was migrated.
+        spec, _ = self.harness.get_pod_spec()
+        self.assertEqual({"db": {"connection_url": "k8s"}}, self.linstor_toml())
+        backend_rules = spec["serviceAccount"]["roles"][1]["rules"]
+        self.assertIn("create", backend_rules[0]["verbs"])
+        self.assertEqual(
+            model.BlockedStatus("run the migrate-database action to use the configured database"),
+            self.harness.charm.unit.status,
+        )
+
+    def test_database_backend_is_kept(self):
+        self.harness.set_leader(True)
+        self.core_v1.read_namespaced_secret.side_effect = None
+        self.core_v1.read_namespaced_secret.return_value.metadata.annotations = {
+            "charms.linbit.com/database-backend": "database-relation"
+        }
+        rel_id = self.harness.add_relation("database", "postgresql")
+        self.harness.update_relation_data(
+            rel_id, "postgresql", {"endpoints": "pg-0:5432", "username": "u", "password": "p"}
+        )
+        spec = self.harness.get_pod_spec()
+        self.assertEqual("jdbc:postgresql://pg-0:5432/linstor", self.linstor_toml()["db"]["connection_url"])
+
+        # Without the relation, the controller must not fall back to the stale Kubernetes backend.
+        self.harness.remove_relation(rel_id)
+        self.assertIsInstance(self.harness.charm.unit.status, model.BlockedStatus)
+        self.harness.charm.on.config_changed.emit()
+        self.assertEqual(
+            model.BlockedStatus("controller uses database backend database-relation, configure it again"),
+            self.harness.charm.unit.status,
+        )
+        self.assertEqual(spec, self.harness.get_pod_spec())
+
+    def test_database_relation_takes_precedence(self):
+        self.harness.set_leader(True)
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"database-url": "etcd://etcd.example.com:2379"})
+        rel_id = self.harness.add_relation("database", "postgresql")
+        self.harness.add_relation_unit(rel_id, "postgresql/0")
+        self.assertEqual({"database": "linstor"}, self.harness.get_relation_data(rel_id, self.harness.charm.app.name))
+
+        self.harness.charm.on.config_changed.emit()
+        self.assertIsInstance(self.harness.charm.unit.status, model.WaitingStatus)
+        self.assertIsNone(self.harness.get_pod_spec())
+
+        self.harness.update_relation_data(
+            rel_id, "postgresql", {"endpoints": "pg-0:5432,pg-1:5432", "username": "u", "password": "p"}
+        )
+        self.assertEqual(
+            {"db": {"connection_url": "jdbc:postgresql://pg-0:5432/linstor", "user": "u", "password": "p"}},
+            self.linstor_toml(),
+        )
+
+    def test_invalid_database_url_blocks(self):
+        self.harness.set_leader(True)
+        self.harness.update_config({"database-url": "postgresql://db.example.com/linstor"})
+
+        self.assertIsInstance(self.harness.charm.unit.status, model.BlockedStatus)
+        self.assertIsNone(self.harness.get_pod_spec())
+
+    def test_linstor_toml(self):
+        self.harness.set_leader(True)
+        self.harness.update_config(
+            {
+                "linstor-toml": '[http]\nport = 3380\n'
+                '[logging]\nlinstor_level = "DEBUG"\nrest_access_log_mode = "NO_LOG"\n',
+            }
+        )
+
+        spec, k8s_resources = self.harness.get_pod_spec()
+        container = spec["containers"][0]
+        self.assertEqual(
+            {"db": {"connection_url": "k8s"}, "http": {"port": 3380}, "logging": {"rest_access_log_mode": "NO_LOG"}},
+            self.linstor_toml(),
+        )
+        self.assertEqual([{"name": "linstor-api", "containerPort": 3380}], container["ports"])
+        service = k8s_resources["kubernetesResources"]["services"][0]
+        self.assertEqual(3380, service["spec"]["ports"][0]["targetPort"])
+        self.assertEqual("3380", service["annotations"]["prometheus.io/port"])
+        self.assertEqual(
+            [
+                mock.call(linstor.LogLevelEnum.INFO, library=True),
+                mock.call(linstor.LogLevelEnum.DEBUG, library=False),
+            ],
+            self.linstor.controller_set_log_level.call_args_list,
+        )
+
+        # Changing only the log level keeps the pod spec, so the controller is not restarted.
+        self.harness.update_config(
+            {"linstor-toml": '[http]\nport = 3380\n[logging]\nrest_access_log_mode = "NO_LOG"\n'}
+        )
+        self.assertEqual((spec, k8s_resources), self.harness.get_pod_spec())
+        self.linstor.controller_set_log_level.assert_called_with(linstor.LogLevelEnum.INFO, library=False)
+
+    def test_invalid_linstor_toml_blocks(self):
+        self.harness.set_leader(True)
+        self.harness.update_config({"linstor-toml": "[http]\nport = '3380'\n"})
+
+        self.assertIsInstance(self.harness.charm.unit.status, model.BlockedStatus)
+        self.assertIsNone(self.harness.get_pod_spec())
+
+    def test_linstor_api_endpoints(self):
+        self.harness.set_leader(True)
+        core_v1 = self.core_v1
+        core_v1.list_namespaced_pod.return_value.items = [
+            kubernetes.client.V1Pod(status=kubernetes.client.V1PodStatus(pod_ip="10.0.0.1")),
+            kubernetes.client.V1Pod(
+                status=kubernetes.client.V1PodStatus(
+                    pod_ip="10.0.0.2",
+                    conditions=[kubernetes.client.V1PodCondition(type="Ready", status="True")],
+                ),
+            ),
+            kubernetes.client.V1Pod(status=kubernetes.client.V1PodStatus()),
+        ]
+
+        rel_id = self.harness.add_relation("linstor-api", "linstor-satellite")
+        self.harness.add_relation_unit(rel_id, "linstor-satellite/0")
+
+        data = self.harness.get_relation_data(rel_id, self.harness.charm.app.name)
+        service = f"http://linstor-api.{self.harness.model.name}.svc:3370"
+        self.assertEqual(service, data["url"])
+        self.assertEqual(
+            [service, "http://10.0.0.2:3370", "http://10.0.0.1:3370"],
+            json.loads(data["endpoints"]),
+        )
+
+    def test_monitoring_relations(self):
+        self.harness.set_leader(True)
+        metrics_id = self.harness.add_relation("metrics-endpoint", "prometheus")
+        dashboard_id = self.harness.add_relation("grafana-dashboard", "grafana")
+        self.harness.add_relation_unit(metrics_id, "prometheus/0")
+        self.harness.add_relation_unit(dashboard_id, "grafana/0")
+
+        data = self.harness.get_relation_data(metrics_id, self.harness.charm.app.name)
+        self.assertEqual(
+            [
+                {
+                    "metrics_path": "/metrics",
+                    "static_configs": [{"targets": [f"linstor-api.{self.harness.model.name}.svc:3370"]}],
+                }
+            ],
+            json.loads(data["scrape_jobs"]),
+        )
+        rules = json.loads(data["alert_rules"])["groups"][0]["rules"]
+        self.assertIn('juju_application="linstor-controller"', rules[0]["expr"])
+        self.assertNotIn("%%juju_topology%%", data["alert_rules"])
+
+        data = self.harness.get_relation_data(dashboard_id, self.harness.charm.app.name)
+        template = json.loads(data["dashboards"])["templates"]["file:linstor-controller.json"]
+        dashboard = json.loads(lzma.decompress(base64.b64decode(template["content"])))
+        self.assertEqual("LINSTOR Controller", dashboard["title"])
+
+    def test_migrate_database(self):
+        self.harness.set_leader(True)
+        self.harness.charm.on.config_changed.emit()
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"database-url": "jdbc:h2:/var/lib/linstor/linstordb"})
+        self.apps_v1.read_namespaced_deployment.return_value.spec.replicas = 1
+        core_v1 = self.core_v1
+        core_v1.list_namespaced_pod.return_value.items = []
+        batch_v1 = mock.Mock()
+        batch_v1.read_namespaced_job_status.return_value.status.succeeded = 1
+        self.harness.charm._batch_v1 = batch_v1
+        event = mock.Mock(params={"timeout": 10})
+
+        self.harness.charm._on_migrate_database_action(event)
+
+        event.fail.assert_not_called()
+        self.assertEqual(
+            [
+                mock.call("linstor-controller", self.harness.model.name, {"spec": {"replicas": 0}}),
+                mock.call("linstor-controller", self.harness.model.name, {"spec": {"replicas": 1}}),
+            ],
+            self.apps_v1.patch_namespaced_deployment_scale.call_args_list,
+        )
+        secret = core_v1.create_namespaced_secret.call_args[0][1]
+        self.assertEqual({"db": {"connection_url": "k8s"}}, toml.loads(secret["stringData"]["source"]))
+        target = toml.loads(secret["stringData"]["target"])
+        self.assertEqual({"db": {"connection_url": "jdbc:h2:/var/lib/linstor/linstordb"}}, target)
+        job = batch_v1.create_namespaced_job.call_args[0][1]
+        volume = job["spec"]["template"]["spec"]["volumes"][0]
+        self.assertEqual("linstor-controller-migrate-database", volume["secret"]["secretName"])
+        batch_v1.delete_namespaced_job.assert_called_once()
+        core_v1.delete_namespaced_secret.assert_called_once()
+
+        # The controller is switched to the new database only after the migration.
+        self.assertEqual({"db": {"connection_url": "jdbc:h2:/var/lib/linstor/linstordb"}}, self.linstor_toml())
+        self.assertIsInstance(self.harness.charm.unit.status, model.ActiveStatus)
+
+    def test_backup_and_restore_database(self):
+        self.harness.set_leader(True)
+        self.harness.charm.on.config_changed.emit()
+        self.apps_v1.read_namespaced_deployment.return_value.spec.replicas = 1
+        core_v1 = self.core_v1
+        core_v1.list_namespaced_pod.return_value.items = []
+        extensions = mock.Mock(api_client=kubernetes.client.ApiClient())
+        extensions.list_custom_resource_definition.return_value.items = [
+            kubernetes.client.V1CustomResourceDefinition(
+                metadata=kubernetes.client.V1ObjectMeta(name="nodes.internal.linstor.linbit.com", uid="1"),
+                spec=kubernetes.client.V1CustomResourceDefinitionSpec(
+                    group="internal.linstor.linbit.com",
+                    names=kubernetes.client.V1CustomResourceDefinitionNames(kind="Nodes", plural="nodes"),
+                    scope="Cluster",
+                    versions=[
+                        kubernetes.client.V1CustomResourceDefinitionVersion(name="v1", served=True, storage=True),
+                    ],
+                ),
+            ),
+        ]
+        custom_objects = mock.Mock()
+        nodes = [
+            {
+                "apiVersion": "internal.linstor.linbit.com/v1",
+                "kind": "Nodes",
+                "metadata": {"name": name, "resourceVersion": "1", "uid": name},
+                "spec": {"node_name": name},
+            }
+            for name in ("node-a", "node-b")
+        ]
+        custom_objects.list_cluster_custom_object.side_effect = [
+            {"items": nodes[:1], "metadata": {"continue": "next"}},
+            {"items": nodes[1:], "metadata": {}},
+        ]
+        self.harness.charm._apiextensions_v1 = extensions
+        self.harness.charm._custom_objects = custom_objects
+
+        with tempfile.TemporaryDirectory() as tmp:
+            event = mock.Mock(params={"path": tmp, "page-size": 1, "stop-controller": False, "timeout": 10})
+            self.harness.charm._on_backup_database_action(event)
+
+            event.fail.assert_not_called()
+            results = event.set_results.call_args[0][0]
+            self.assertEqual(3, results["objects"])
+            self.assertEqual({"customresourcedefinitions": 1, "nodes": 2}, json.loads(results["counts"]))
+            self.assertEqual("next", custom_objects.list_cluster_custom_object.call_args[1]["_continue"])
+            self.apps_v1.patch_namespaced_deployment_scale.assert_not_called()
+
+            extensions.create_custom_resource_definition.side_effect = kubernetes.client.exceptions.ApiException(409)
+            custom_objects.create_cluster_custom_object.side_effect = [
+                None,
+                kubernetes.client.exceptions.ApiException(409),
+            ]
+            custom_objects.get_cluster_custom_object.return_value = {"metadata": {"resourceVersion": "5"}}
+            event = mock.Mock(
+                params={"archive": results["path"], "batch-size": 2, "parallelism": 1, "timeout": 10, "prune": False}
+            )
+            self.harness.charm._on_restore_database_action(event)
+
+        event.fail.assert_not_called()
+        self.assertEqual(3, event.set_results.call_args[0][0]["objects"])
+        created = custom_objects.create_cluster_custom_object.call_args_list[0][0][3]
+        self.assertEqual({"name": "node-a"}, created["metadata"])
+        replaced = custom_objects.replace_cluster_custom_object.call_args[0][4]
+        self.assertEqual({"name": "node-b", "resourceVersion": "5"}, replaced["metadata"])
+        self.assertEqual(
+            [
+                mock.call("linstor-controller", self.harness.model.name, {"spec": {"replicas": 0}}),
+                mock.call("linstor-controller", self.harness.model.name, {"spec": {"replicas": 1}}),
+            ],
+            self.apps_v1.patch_namespaced_deployment_scale.call_args_list,
+        )
+
+    def test_restore_database_prune(self):
+        self.harness.set_leader(True)
+        self.harness.charm.on.config_changed.emit()
+        self.apps_v1.read_namespaced_deployment.return_value.spec.replicas = 1
+        self.core_v1.list_namespaced_pod.return_value.items = []
+        extensions = mock.Mock()
+        extensions.create_custom_resource_definition.side_effect = kubernetes.client.exceptions.ApiException(409)
+        extensions.list_custom_resource_definition.return_value.items = [
+            kubernetes.client.V1CustomResourceDefinition(
+                metadata=kubernetes.client.V1ObjectMeta(name=name),
+                spec=kubernetes.client.V1CustomResourceDefinitionSpec(
+                    group=group,
+                    names=kubernetes.client.V1CustomResourceDefinitionNames(kind=kind, plural=plural),
+                    scope="Cluster",
+                    versions=[
+                        kubernetes.client.V1CustomResourceDefinitionVersion(name="v1", served=True, storage=True),
+                    ],
+                ),
+            )
+            for name, group, kind, plural in [
+                ("nodes.internal.linstor.linbit.com", "internal.linstor.linbit.com", "Nodes", "nodes"),
+                ("volumes.internal.linstor.linbit.com", "internal.linstor.linbit.com", "Volumes", "volumes"),
+                ("widgets.example.com", "example.com", "Widget", "widgets"),
+            ]
+        ]
+        custom_objects = mock.Mock()
+        custom_objects.list_cluster_custom_object.side_effect = [
+            {"items": [{"metadata": {"name": "node-a"}}], "metadata": {"continue": "next"}},
+            {"items": [{"metadata": {"name": "node-c"}}], "metadata": {}},
+            {"items": [{"metadata": {"name": "volume-a"}}], "metadata": {}},
+        ]
+        custom_objects.delete_cluster_custom_object.side_effect = [
+            None,
+            kubernetes.client.exceptions.ApiException(404),
+        ]
+        self.harness.charm._apiextensions_v1 = extensions
+        self.harness.charm._custom_objects = custom_objects
+
+        lines = [
+            {
+                "apiVersion": "apiextensions.k8s.io/v1",
+                "kind": "CustomResourceDefinition",
+                "metadata": {"name": "nodes.internal.linstor.linbit.com"},
+                "spec": {"names": {"kind": "Nodes", "plural": "nodes"}},
+            },
+            {"apiVersion": "internal.linstor.linbit.com/v1", "kind": "Nodes", "metadata": {"name": "node-a"}},
+        ]
+        with tempfile.NamedTemporaryFile("wb", suffix=".jsonl.gz") as archive:
+            archive.write(gzip.compress("".join(json.dumps(line) + "\n" for line in lines).encode()))
+            archive.flush()
+            event = mock.Mock(params={"archive": archive.name, "batch-size": 1, "parallelism": 1, "timeout": 10})
+
+            event.params["prune"] = False
+            self.harness.charm._on_restore_database_action(event)
+            event.fail.assert_not_called()
+            self.assertNotIn("pruned", event.set_results.call_args[0][0])
+            custom_objects.list_cluster_custom_object.assert_not_called()
+
+            event.params["prune"] = True
+            self.harness.charm._on_restore_database_action(event)
+
+        event.fail.assert_not_called()
+        self.assertEqual({"nodes": 1, "volumes": 1}, json.loads(event.set_results.call_args[0][0]["pruned"]))
+        self.assertEqual("next", custom_objects.list_cluster_custom_object.call_args_list[1][1]["_continue"])
+        # Only objects missing from the archive are deleted, objects of other CRDs are left alone.
+        self.assertEqual(
+            [
+                mock.call("internal.linstor.linbit.com", "v1", "nodes", "node-c"),
+                mock.call("internal.linstor.linbit.com", "v1", "volumes", "volume-a"),
+            ],
+            custom_objects.delete_cluster_custom_object.call_args_list,
+        )
+
+    def test_restore_failure_keeps_controller_stopped(self):
+        self.harness.set_leader(True)
+        self.harness.charm.on.config_changed.emit()
+        self.apps_v1.read_namespaced_deployment.return_value.spec.replicas = 1
+        self.core_v1.list_namespaced_pod.return_value.items = []
+        self.harness.charm._apiextensions_v1 = mock.Mock()
+        self.harness.charm._custom_objects = mock.Mock()
+
+        with tempfile.NamedTemporaryFile("wb", suffix=".jsonl.gz") as archive:
+            archive.write(gzip.compress(b"not json\n"))
+            archive.flush()
+            event = mock.Mock(
+                params={"archive": archive.name, "batch-size": 2, "parallelism": 1, "timeout": 10, "prune": False}
+            )
+            self.harness.charm._on_restore_database_action(event)
+
+        self.apps_v1.patch_namespaced_deployment_scale.assert_called_once_with(
+            "linstor-controller", self.harness.model.name, {"spec": {"replicas": 0}}
+        )
+        message = event.fail.call_args[0][0]
+        self.assertIn("left stopped", message)
+        self.assertIn("deployment/linstor-controller back to 1 replicas", message)
+
+        # Running the restore again starts the controller with the original replicas.
+        self.apps_v1.read_namespaced_deployment.return_value.spec.replicas = 0
+        with tempfile.NamedTemporaryFile("wb", suffix=".jsonl.gz") as archive:
+            archive.write(gzip.compress(b""))
+            archive.flush()
+            event = mock.Mock(
+                params={"archive": archive.name, "batch-size": 2, "parallelism": 1, "timeout": 10, "prune": False}
+            )
+            self.harness.charm._on_restore_database_action(event)
+
+        event.fail.assert_not_called()
+        self.apps_v1.patch_namespaced_deployment_scale.assert_called_with(
+            "linstor-controller", self.harness.model.name, {"spec": {"replicas": 1}}
+        )
+
+    def test_backup_failure_removes_partial_archive(self):
+        self.harness.set_leader(True)
+        self.harness.charm.on.config_changed.emit()
+        extensions = mock.Mock(api_client=kubernetes.client.ApiClient())
+        extensions.list_custom_resource_definition.return_value.items = [
+            kubernetes.client.V1CustomResourceDefinition(
+                metadata=kubernetes.client.V1ObjectMeta(name="nodes.internal.linstor.linbit.com"),
+                spec=kubernetes.client.V1CustomResourceDefinitionSpec(
+                    group="internal.linstor.linbit.com",
+                    names=kubernetes.client.V1CustomResourceDefinitionNames(kind="Nodes", plural="nodes"),
+                    scope="Cluster",
+                    versions=[
+                        kubernetes.client.V1CustomResourceDefinitionVersion(name="v1", served=True, storage=True),
+                    ],
+                ),
+            ),
+        ]
+        custom_objects = mock.Mock()
+        custom_objects.list_cluster_custom_object.side_effect = kubernetes.client.exceptions.ApiException(500)
+        self.harness.charm._apiextensions_v1 = extensions
+        self.harness.charm._custom_objects = custom_objects
+
+        with tempfile.TemporaryDirectory() as tmp:
+            event = mock.Mock(params={"path": tmp, "page-size": 1, "stop-controller": False, "timeout": 10})
+            self.harness.charm._on_backup_database_action(event)
+
+            event.fail.assert_called_once()
+            self.assertEqual([], os.listdir(tmp))
+
+
+class TestCharmHelpers(unittest.TestCase):
+    def test_parse_drbd_options(self):
+        self.assertEqual({}, _parse_drbd_options(""))
+        self.assertEqual(
+            {
+                "DrbdOptions/Net/max-buffers": "8000",
+                "DrbdOptions/Net/allow-two-primaries": "no",
+                "DrbdOptions/PeerDevice/c-max-rate": "4G",
+                "DrbdOptions/Resource/quorum": "majority",
+            },
+            _parse_drbd_options(
+                "net: {max-buffers: 8000, allow-two-primaries: no}\n"
+                "peer-device: {c-max-rate: 4G}\n"
+                "resource: {quorum: majority}\n"
+            ),
+        )
+
+        for conf in ["- net", "net: [", "net: 1", "net: {max-buffers: [1, 2]}", "handlers: {}"]:
+            with self.subTest(conf=conf):
+                with self.assertRaises(ValueError):
+                    _parse_drbd_options(conf)
+
+    def test_parse_linstor_toml(self):
+        self.assertEqual({}, _parse_linstor_toml(""))
+        self.assertEqual(
+            {"db": {"k8s": {"request_retries": 5}}, "logging": {"level": "warning"}},
+            _parse_linstor_toml('[db.k8s]\nrequest_retries = 5\n[logging]\nlevel = "warning"\n'),
+        )
+        for invalid in [
+            "[http",
+            "[web]\nport = 3370\n",
+            "[http]\nthreads = 8\n",
+            "http = 3370\n",
+            "[https]\nenabled = 1\n",
+            "[http]\nport = true\n",
+            "[http]\nenabled = false\n",
+            "[db]\nconnection_url = 'k8s'\n",
+            "[logging]\nlinstor_level = 'VERBOSE'\n",
+        ]:
+            with self.subTest(invalid=invalid):
+                self.assertRaises(ValueError, _parse_linstor_toml, invalid)
+
+
+class TestWorkloadResources(unittest.TestCase):
+    def testcontainer_resources(self):
+        base = {
+            "cpu-request": "",
+            "cpu-limit": "",
+            "memory-request": "",
+            "memory-limit": "",
+            "guaranteed-qos": False,
+        }
+        testcases = [
+            {"conf": {}, "expected": {}},
+            {
+                "conf": {"cpu-request": "500m", "memory-request": "1Gi", "memory-limit": "2Gi"},
+                "expected": {
+                    "limits": {"memory": "2Gi"},
+                    "requests": {"cpu": "500m", "memory": "1Gi"},
+                },
+            },
+            {
+                "conf": {"cpu-request": "2", "memory-request": "4Gi", "guaranteed-qos": True},
+                "expected": {
+                    "limits": {"cpu": "2", "memory": "4Gi"},
+                    "requests": {"cpu": "2", "memory": "4Gi"},
+                },
+            },
+            {"conf": {"cpu-request": "two"}, "error": "not a valid Kubernetes quantity"},
+            {"conf": {"memory-request": "2Gi", "memory-limit": "1Gi"}, "error": "must not be greater"},
+            {"conf": {"guaranteed-qos": True, "cpu-request": "1"}, "error": "requires memory-request"},
+            {
+                "conf": {"guaranteed-qos": True, "cpu-request": "1", "cpu-limit": "2", "memory-request": "1Gi"},
+                "error": "cpu-limit to be empty or equal",
+            },
+        ]
+
+        for test in testcases:
+            with self.subTest(conf=test["conf"]):
+                conf = {**base, **test["conf"]}
+                if "error" in test:
+                    with self.assertRaisesRegex(ValueError, test["error"]):
+                        container_resources(conf)
+                else:
+                    self.assertEqual(test["expected"], container_resources(conf))
+
+    def testsame_resources(self):
+        self.assertTrue(
+            same_resources({"limits": {"cpu": "1"}}, {"limits": {"cpu": "1000m"}})
+        )
+        self.assertTrue(same_resources({}, {"limits": {}}))
+        self.assertFalse(
+            same_resources({"requests": {"memory": "1Gi"}}, {"requests": {"memory": "1G"}})
+        )
+
+
+class TestReconcile(unittest.TestCase):
+    @mock.patch("charms.linstor_controller.v0.reconcile.time.time", return_value=1000.0)
+    def test_run_due_steps(self, _time):
+        pending = {
+            "failing": {"attempts": 2, "not-before": 900.0},
+            "later": {"attempts": 1, "not-before": 1100.0},
+            "due": {"attempts": 1, "not-before": 1000.0},
+        }
+        due = mock.Mock()
+        later = mock.Mock()
+
+        ran = run_due_steps(
+            pending,
+            [("failing", mock.Mock(side_effect=RuntimeError("boom"))), ("later", later), ("due", due)],
+        )
+
+        self.assertEqual({"failing", "due"}, ran)
+        due.assert_called_once_with()
+        later.assert_not_called()
+        # A step that raised is scheduled again, with a longer delay
+        self.assertEqual(3, pending["failing"]["attempts"])
+        self.assertTrue(1060 <= pending["failing"]["not-before"] <= 1120)
+
+
+class TestPodSpec(unittest.TestCase):
+    def test_spec_digest_ignores_key_order(self):
+        self.assertEqual(
+            spec_digest({"a": 1, "b": [{"c": 2, "d": 3}]}, None),
+            spec_digest({"b": [{"d": 3, "c": 2}], "a": 1}, None),
+        )
+        self.assertNotEqual(
+            spec_digest({"a": 1}, None),
+            spec_digest({"a": 1}, {"kubernetesResources": {}}),
+        )
+
+
+class TestJavaOpts(unittest.TestCase):
+    def test_build_java_opts(self):
+        base = {
+            "java-heap-size": "",
+            "java-gc": "",
+            "java-thread-stack-size": "",
+            "java-opts": "",
+        }
+        self.assertEqual("", build_java_opts(base, None))
+        self.assertEqual(
+            "-Xms2g -Xmx2g -XX:+UseG1GC -Xss512k -XX:+AlwaysPreTouch",
+            build_java_opts(
+                {
+                    "java-heap-size": "2g",
+                    "java-gc": "G1",
+                    "java-thread-stack-size": "512k",
+                    "java-opts": "-XX:+AlwaysPreTouch",
+                },
+                "4Gi",
+            ),
+        )
+        with self.assertRaisesRegex(ValueError, "smaller than the memory limit"):
+            build_java_opts({**base, "java-heap-size": "4g"}, "4Gi")
+        with self.assertRaisesRegex(ValueError, "unknown garbage collector"):
+            build_java_opts({**base, "java-gc": "CMS"}, None)
+        with self.assertRaisesRegex(ValueError, "not a valid size"):
+            build_java_opts({**base, "java-thread-stack-size": "1MB"}, None)
+
+
+class TestLinstorProps(unittest.TestCase):
+    def test_plan_props(self):
+        managed = "Aux/charm/drbd-options"
+        current = {
+            "DrbdOptions/Net/max-buffers": "8000",
+            "DrbdOptions/Net/sndbuf-size": "0",
+            "DrbdOptions/Net/protocol": "C",
+            managed: "DrbdOptions/Net/max-buffers DrbdOptions/Net/sndbuf-size",
+        }
+
+        self.assertEqual(
+            (
+                {"DrbdOptions/Net/max-buffers": "36864", managed: "DrbdOptions/Net/max-buffers"},
+                ["DrbdOptions/Net/sndbuf-size"],
+            ),
+            plan_props({"DrbdOptions/Net/max-buffers": "36864"}, current, managed),
+        )
+        self.assertEqual(
+            ({}, []),
+            plan_props(
+                {"DrbdOptions/Net/max-buffers": "8000", "DrbdOptions/Net/sndbuf-size": "0"}, current, managed
+            ),
+        )
+
+    def test_plan_props_removes_managed_key(self):
+        to_set, to_delete = plan_props(
+            {},
+            {"DrbdOptions/Net/max-buffers": "8000", "Aux/charm/drbd-options": "DrbdOptions/Net/max-buffers"},
+            "Aux/charm/drbd-options",
+        )
+        self.assertEqual({}, to_set)
+        self.assertEqual(["DrbdOptions/Net/max-buffers", "Aux/charm/drbd-options"], to_delete)
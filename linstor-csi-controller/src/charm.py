@@ -11,9 +11,18 @@ develop a new k8s charm using the Operator Framework:
 
     https://discourse.charmhub.io/t/4208
 """
+import base64
+import hashlib
 import json
 import logging
+import lzma
+import pathlib
+import re
+import typing
 
+import yaml
+from charms.linstor_controller.v0.pod_spec import apply_pod_spec, forget_pod_spec
+from charms.linstor_controller.v0.reconcile import reconciled, retry_later, run_due_steps
 from oci_image import OCIImageResourceError
 from ops import charm, framework, main, model
 
@@ -21,11 +30,190 @@ logger = logging.getLogger(__name__)
 
 __version__ = "1.0.0"
 
+_DASHBOARDS_DIR = pathlib.Path(__file__).parent / "grafana_dashboards"
+
+# Sidecars serving Prometheus metrics on --http-endpoint. linstor-csi-plugin has no metrics listener, the sidecars
+# measure all CSI calls they make to it.
+_METRICS_SIDECARS = ("csi-attacher", "csi-provisioner", "csi-resizer", "csi-snapshotter")
+
+# Used by the liveness probe of linstor-csi-plugin.
+_HEALTH_PORT = 9808
+
+_GO_DURATION_RE = re.compile(r"^([0-9]+(\.[0-9]+)?(ns|us|µs|ms|s|m|h))+$")
+
+
+def _duration(value) -> str:
+    if not isinstance(value, str) or not _GO_DURATION_RE.match(value):
+        raise ValueError(f"expected a duration like '30s' or '1m', got '{value}'")
+    return value
+
+
+def _positive_int(value) -> int:
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError(f"expected a positive integer, got '{value}'")
+    return value
+
+
+def _positive_number(value) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        raise ValueError(f"expected a positive number, got '{value}'")
+    return value
+
+
+# Settings of the CSI sidecars that can be tuned, with their validation. All sidecars accept the same settings.
+_SIDECAR_SETTINGS = {
+    "timeout": _duration,
+    "worker-threads": _positive_int,
+    "kube-api-qps": _positive_number,
+    "kube-api-burst": _positive_int,
+    "retry-interval-start": _duration,
+    "retry-interval-max": _duration,
+}
+
+# csi-resizer names the worker flag differently.
+_SIDECAR_FLAGS = {("csi-resizer", "worker-threads"): "workers"}
+
+_SIDECAR_PRESETS = {
+    "default": {
+        "csi-attacher": {"timeout": "1m"},
+        "csi-provisioner": {"timeout": "1m"},
+        "csi-resizer": {"timeout": "1m"},
+        "csi-snapshotter": {"timeout": "1m"},
+    },
+    # For creating many volumes at once: the default client rate limit of 5 requests per second to the Kubernetes API
+    # and the few workers of some sidecars are the first bottlenecks. Longer timeouts avoid cancelling and retrying
+    # LINSTOR requests that are merely slow under load, a shorter maximum retry interval avoids long idle backoffs.
+    "high-throughput": {
+        "csi-attacher": {
+            "timeout": "2m",
+            "worker-threads": 50,
+            "kube-api-qps": 50,
+            "kube-api-burst": 100,
+            "retry-interval-max": "30s",
+        },
+        "csi-provisioner": {
+            "timeout": "2m",
+            "worker-threads": 100,
+            "kube-api-qps": 50,
+            "kube-api-burst": 100,
+            "retry-interval-max": "30s",
+        },
+        "csi-resizer": {
+            "timeout": "2m",
+            "worker-threads": 20,
+            "kube-api-qps": 20,
+            "kube-api-burst": 40,
+            "retry-interval-max": "30s",
+        },
+        "csi-snapshotter": {
+            "timeout": "2m",
+            "worker-threads": 20,
+            "kube-api-qps": 20,
+            "kube-api-burst": 40,
+            "retry-interval-max": "30s",
+        },
+    },
+}
+
+_FIELD_MANAGER = "charms.linbit.com/v1"
+
+_K8S_NAME_RE = re.compile(r"^[a-z0-9]([-a-z0-9.]*[a-z0-9])?$")
+_DRBD_OPTION_RE = re.compile(r"^[A-Za-z]+/[A-Za-z0-9-]+$")
+
+
+def _string(value) -> str:
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"expected a non-empty string, got '{value}'")
+    return value
+
+
+def _word_list(value) -> str:
+    if isinstance(value, str):
+        value = value.split()
+    if not isinstance(value, list) or not value or not all(isinstance(v, str) and v.strip() for v in value):
+        raise ValueError(f"expected a list like 'drbd storage', got '{value}'")
+    return " ".join(value)
+
+
+def _boolean(value) -> str:
+    if not isinstance(value, bool):
+        raise ValueError(f"expected true or false, got '{value}'")
+    return "true" if value else "false"
+
+
+def _volume_binding_mode(value) -> str:
+    if value not in ("Immediate", "WaitForFirstConsumer"):
+        raise ValueError(f"expected 'Immediate' or 'WaitForFirstConsumer', got '{value}'")
+    return value
+
+
+def _drbd_options(value) -> typing.Dict[str, str]:
+    if not isinstance(value, dict):
+        raise ValueError("expected a mapping of DRBD options like 'Net/protocol' to values")
+    result = {}
+    for key, val in value.items():
+        if not isinstance(key, str) or not _DRBD_OPTION_RE.match(key):
+            raise ValueError(f"expected DRBD options like 'Net/protocol', got '{key}'")
+        if isinstance(val, bool):
+            # YAML reads unquoted yes/no as booleans, DRBD expects the words.
+            val = "yes" if val else "no"
+        if not isinstance(val, (str, int, float)):
+            raise ValueError(f"{key}: expected a plain value, got '{val}'")
+        result[key] = str(val)
+    return result
+
+
+# Settings of charm managed StorageClasses, with their validation and the StorageClass parameter they are rendered to.
+_STORAGE_CLASS_SETTINGS = {
+    "placement-count": (_positive_int, "linstor.csi.linbit.com/placementCount"),
+    "storage-pool": (_string, "linstor.csi.linbit.com/storagePool"),
+    "layer-list": (_word_list, "linstor.csi.linbit.com/layerList"),
+    "allow-remote-volume-access": (_boolean, "linstor.csi.linbit.com/allowRemoteVolumeAccess"),
+    "replicas-on-same": (_word_list, "linstor.csi.linbit.com/replicasOnSame"),
+    "replicas-on-different": (_word_list, "linstor.csi.linbit.com/replicasOnDifferent"),
+    "volume-binding-mode": (_volume_binding_mode, None),
+    "fs-type": (_string, "csi.storage.k8s.io/fstype"),
+    "fs-opts": (_string, "linstor.csi.linbit.com/fsOpts"),
+    "mount-opts": (_string, "linstor.csi.linbit.com/mountOpts"),
+    "drbd-options": (_drbd_options, None),
+}
+
+_STORAGE_CLASS_PRESETS = {
+    "default": {
+        "volume-binding-mode": "WaitForFirstConsumer",
+    },
+    # A single replica on the node of the first consumer: writes complete on the local disk without a replication
+    # round trip. The volume is not replicated, so only use it for data that can be rebuilt.
+    "low-latency-local": {
+        "placement-count": 1,
+        "allow-remote-volume-access": False,
+        "volume-binding-mode": "WaitForFirstConsumer",
+        "mount-opts": "noatime",
+    },
+    # Two replicas, with larger DRBD buffers and activity log, so sustained sequential writes are not throttled by the
+    # default limits tuned for small, latency sensitive writes.
+    "replicated-throughput": {
+        "placement-count": 2,
+        "layer-list": "drbd storage",
+        "volume-binding-mode": "WaitForFirstConsumer",
+        "mount-opts": "noatime",
+        "drbd-options": {
+            "Net/max-buffers": "8000",
+            "Net/max-epoch-size": "8000",
+            "Disk/al-extents": "6007",
+        },
+    },
+}
+
 _DEFAULTS = {
     "linstor-csi-image": {
         "piraeus": "quay.io/piraeusdatastore/piraeus-csi:v0.19.0",
         "linbit": "drbd.io/linstor-csi:v0.19.0",
     },
+    "kubectl-image": {
+        "piraeus": "docker.io/bitnami/kubectl:latest",
+        "linbit": "docker.io/bitnami/kubectl:latest",
+    },
     "csi-attacher-image": {
         "piraeus": "k8s.gcr.io/sig-storage/csi-attacher:v3.4.0",
         "linbit": "k8s.gcr.io/sig-storage/csi-attacher:v3.4.0",
@@ -55,7 +243,7 @@ class LinstorCSIControllerCharm(charm.CharmBase):
     def __init__(self, *args):
         super().__init__(*args)
 
-        self._stored.set_default(linstor_url=None)
+        self._stored.set_default(linstor_url=None, pending={}, pod_spec_digest=None)
 
         self.framework.observe(
             self.on.linstor_relation_changed, self._on_linstor_relation_changed
@@ -64,16 +252,21 @@ class LinstorCSIControllerCharm(charm.CharmBase):
             self.on.linstor_relation_broken, self._on_linstor_relation_broken
         )
 
+        self.framework.observe(self.on.metrics_endpoint_relation_joined, self._on_monitoring_relation_joined)
+        self.framework.observe(self.on.grafana_dashboard_relation_joined, self._on_monitoring_relation_joined)
+
         self.framework.observe(self.on.install, self._set_pod_spec)
         self.framework.observe(self.on.upgrade_charm, self._set_pod_spec)
         self.framework.observe(self.on.config_changed, self._set_pod_spec)
+        self.framework.observe(self.on.update_status, self._on_update_status)
+        self.framework.observe(self.on.leader_elected, self._on_leader_elected)
 
     def _set_pod_spec(self, event: charm.HookEvent):
         print("enter _set_pod_spec")
 
         if not self._stored.linstor_url:
+            # Nothing to retry: the relation hooks will run this again.
             self.unit.status = model.BlockedStatus("waiting for linstor relation")
-            event.defer()
             return
 
         print("got url")
@@ -85,13 +278,58 @@ class LinstorCSIControllerCharm(charm.CharmBase):
             csi_provisioner_image = self.get_image("csi-provisioner-image")
             csi_resizer_image = self.get_image("csi-resizer-image")
             csi_snapshotter_image = self.get_image("csi-snapshotter-image")
+            kubectl_image = self.get_image("kubectl-image")
         except OCIImageResourceError as e:
             self.unit.status = e.status
-            event.defer()
+            self._retry_later("pod-spec", "images not available")
             return
 
         print("got images")
 
+        try:
+            sidecar_args = _sidecar_args(self.config["sidecar-preset"], self.config["sidecar-tuning"])
+        except ValueError as e:
+            self.unit.status = model.BlockedStatus(f"invalid config: {e}")
+            return
+
+        try:
+            metrics_ports = _metrics_ports(self.config)
+        except ValueError as e:
+            self.unit.status = model.BlockedStatus(f"invalid config: {e}")
+            return
+
+        try:
+            capacity_poll_interval = _duration(self.config["capacity-poll-interval"])
+        except ValueError as e:
+            self.unit.status = model.BlockedStatus(f"invalid config: capacity-poll-interval: {e}")
+            return
+
+        try:
+            storage_classes = _storage_classes(self.app.name, self.config["storage-classes"])
+        except ValueError as e:
+            self.unit.status = model.BlockedStatus(f"invalid config: {e}")
+            return
+
+        storage_class_dir = {
+            "name": "storage-class-dir",
+            "mountPath": "/k8s",
+            "files": [
+                {
+                    "path": "init.sh",
+                    "content": _storage_class_script(self.app.name, storage_classes),
+                    "mode": 0o755,
+                },
+                *(
+                    {
+                        "path": f"{sc['metadata']['name']}.json",
+                        "content": json.dumps(sc),
+                        "mode": 0o644,
+                    }
+                    for sc in storage_classes
+                ),
+            ],
+        }
+
         socket_vol = {
             "name": "socket-dir",
             "mountPath": "/run/csi",
@@ -109,8 +347,9 @@ class LinstorCSIControllerCharm(charm.CharmBase):
         if self.unit.is_leader():
             print("is leader, setting spec")
 
-            self.app.status = model.MaintenanceStatus("Setting pod spec")
-            self.model.pod.set_spec(
+            apply_pod_spec(
+                self,
+                self._stored,
                 spec={
                     "version": 3,
                     "containers": [
@@ -130,7 +369,7 @@ class LinstorCSIControllerCharm(charm.CharmBase):
                                     "failureThreshold": 3,
                                     "httpGet": {
                                         "path": "/healthz",
-                                        "port": 9808,
+                                        "port": _HEALTH_PORT,
                                         "scheme": "HTTP",
                                     },
                                     "periodSeconds": 10,
@@ -144,10 +383,12 @@ class LinstorCSIControllerCharm(charm.CharmBase):
                             "imageDetails": csi_attacher_image,
                             "args": [
                                 "--csi-address=$(ADDRESS)",
-                                "--timeout=1m",
+                                *sidecar_args["csi-attacher"],
                                 "--leader-election=true",
                                 "--leader-election-namespace=$(NAMESPACE)",
+                                f"--http-endpoint=:{metrics_ports['csi-attacher']}",
                             ],
+                            "ports": [_metrics_container_port("csi-attacher", metrics_ports)],
                             "volumeConfig": [socket_vol],
                             "envConfig": csi_env,
                         },
@@ -163,14 +404,21 @@ class LinstorCSIControllerCharm(charm.CharmBase):
                             "imageDetails": csi_provisioner_image,
                             "args": [
                                 "--csi-address=$(ADDRESS)",
-                                "--timeout=1m",
+                                *sidecar_args["csi-provisioner"],
                                 "--default-fstype=ext4",
                                 "--enable-capacity",
+                                f"--capacity-poll-interval={capacity_poll_interval}",
                                 "--extra-create-metadata",
                                 "--capacity-ownerref-level=2",
+                                # Pass the topology of the node selected by the scheduler, so LINSTOR can place a
+                                # replica next to the consumer.
+                                "--feature-gates=Topology=true",
+                                "--strict-topology",
                                 "--leader-election=true",
                                 "--leader-election-namespace=$(NAMESPACE)",
+                                f"--http-endpoint=:{metrics_ports['csi-provisioner']}",
                             ],
+                            "ports": [_metrics_container_port("csi-provisioner", metrics_ports)],
                             "volumeConfig": [socket_vol],
                             "envConfig": csi_env,
                         },
@@ -179,11 +427,13 @@ class LinstorCSIControllerCharm(charm.CharmBase):
                             "imageDetails": csi_resizer_image,
                             "args": [
                                 "--csi-address=$(ADDRESS)",
-                                "--timeout=1m",
+                                *sidecar_args["csi-resizer"],
                                 "--handle-volume-inuse-error=false",
                                 "--leader-election=true",
                                 "--leader-election-namespace=$(NAMESPACE)",
+                                f"--http-endpoint=:{metrics_ports['csi-resizer']}",
                             ],
+                            "ports": [_metrics_container_port("csi-resizer", metrics_ports)],
                             "volumeConfig": [socket_vol],
                             "envConfig": csi_env,
                         },
@@ -192,13 +442,22 @@ class LinstorCSIControllerCharm(charm.CharmBase):
                             "imageDetails": csi_snapshotter_image,
                             "args": [
                                 "--csi-address=$(ADDRESS)",
-                                "--timeout=1m",
+                                *sidecar_args["csi-snapshotter"],
                                 "--leader-election=true",
                                 "--leader-election-namespace=$(NAMESPACE)",
+                                f"--http-endpoint=:{metrics_ports['csi-snapshotter']}",
                             ],
+                            "ports": [_metrics_container_port("csi-snapshotter", metrics_ports)],
                             "volumeConfig": [socket_vol],
                             "envConfig": csi_env,
                         },
+                        {
+                            "name": "storage-class-apply",
+                            "imageDetails": kubectl_image,
+                            "init": True,
+                            "command": ["sh", "/k8s/init.sh"],
+                            "volumeConfig": [storage_class_dir],
+                        },
                     ],
                     "serviceAccount": {
                         "roles": [
@@ -410,6 +669,23 @@ class LinstorCSIControllerCharm(charm.CharmBase):
                                     },
                                 ],
                             },
+                            {
+                                "name": "storage-class-apply",
+                                "global": True,
+                                "rules": [
+                                    {
+                                        "apiGroups": ["storage.k8s.io"],
+                                        "resources": ["storageclasses"],
+                                        "verbs": [
+                                            "get",
+                                            "list",
+                                            "patch",
+                                            "create",
+                                            "delete",
+                                        ],
+                                    },
+                                ],
+                            },
                             {
                                 "name": "csi-controller-leader-elector",
                                 "rules": [
@@ -431,11 +707,36 @@ class LinstorCSIControllerCharm(charm.CharmBase):
                         ],
                     },
                 },
+                k8s_resources={
+                    "kubernetesResources": {
+                        "services": [
+                            {
+                                "name": self._metrics_service_name,
+                                "spec": {
+                                    "type": "ClusterIP",
+                                    "selector": {"app.kubernetes.io/name": self.app.name},
+                                    "ports": [
+                                        {
+                                            "name": _metrics_port_name(sidecar),
+                                            "protocol": "TCP",
+                                            "port": port,
+                                            "targetPort": port,
+                                        }
+                                        for sidecar, port in metrics_ports.items()
+                                    ],
+                                },
+                            },
+                        ],
+                    },
+                },
             )
             self.app.status = model.ActiveStatus()
 
+        self._reconciled("pod-spec")
         self.unit.status = model.ActiveStatus()
 
+        self._update_monitoring_relations()
+
     def _on_linstor_relation_changed(self, event: charm.RelationChangedEvent):
         url = event.relation.data[event.app].get("url")
 
@@ -447,6 +748,65 @@ class LinstorCSIControllerCharm(charm.CharmBase):
         self._stored.linstor_url = None
         self._set_pod_spec(event)
 
+    def _on_monitoring_relation_joined(self, _event: charm.RelationJoinedEvent):
+        self._update_monitoring_relations()
+
+    def _update_monitoring_relations(self):
+        """Publish the scrape jobs and dashboards on the metrics-endpoint and grafana-dashboard relations.
+
+        This speaks the prometheus_scrape and grafana_dashboard interfaces. There is one scrape job per sidecar, all
+        scraped through the metrics Service. Only the sidecars of the elected leader pod process requests, so with more
+        than one unit the Service may also return the idle metrics of a standby pod.
+        """
+        if not self.unit.is_leader():
+            return
+
+        try:
+            metrics_ports = _metrics_ports(self.config)
+        except ValueError:
+            # Already reported by _set_pod_spec
+            return
+
+        topology = {
+            "model": self.model.name,
+            "model_uuid": self.model.uuid,
+            "application": self.app.name,
+            "charm_name": self.meta.name,
+        }
+        for relation in self.model.relations["metrics-endpoint"]:
+            relation.data[self.app]["scrape_metadata"] = json.dumps(topology)
+            relation.data[self.app]["scrape_jobs"] = json.dumps(
+                [
+                    {
+                        "job_name": sidecar,
+                        "metrics_path": "/metrics",
+                        "static_configs": [
+                            {"targets": [f"{self._metrics_service_name}.{self.model.name}.svc:{port}"]},
+                        ],
+                    }
+                    for sidecar, port in metrics_ports.items()
+                ]
+            )
+
+        for relation in self.model.relations["grafana-dashboard"]:
+            relation.data[self.app]["dashboards"] = json.dumps(_dashboards(_DASHBOARDS_DIR, topology))
+
+    @property
+    def _metrics_service_name(self) -> str:
+        return f"{self.app.name}-metrics"
+
+    def _on_leader_elected(self, _event: charm.LeaderElectedEvent):
+        forget_pod_spec(self._stored)
+
+    def _on_update_status(self, event: charm.UpdateStatusEvent):
+        run_due_steps(self._stored.pending, [("pod-spec", lambda: self._set_pod_spec(event))])
+
+    def _retry_later(self, name: str, reason: str):
+        retry_later(self._stored.pending, name, reason)
+
+    def _reconciled(self, name: str):
+        reconciled(self._stored.pending, name)
+
     def get_image(self, name) -> dict:
         override = self.model.resources.fetch(
             "image-override"
@@ -472,5 +832,243 @@ class LinstorCSIControllerCharm(charm.CharmBase):
             return {"imagePath": _DEFAULTS[name]["piraeus"]}
 
 
+def _sidecar_args(preset: str, tuning_str: str) -> typing.Dict[str, typing.List[str]]:
+    """Render the command line arguments of the CSI sidecars from a preset and the YAML tuning overrides.
+
+    The tuning is a mapping from sidecar to settings, i.e.:
+
+        csi-provisioner:
+          worker-threads: 200
+          kube-api-qps: 100
+    """
+    if preset not in _SIDECAR_PRESETS:
+        raise ValueError(f"sidecar-preset: unknown preset '{preset}', must be one of: {', '.join(_SIDECAR_PRESETS)}")
+
+    try:
+        tuning = yaml.safe_load(tuning_str) if tuning_str.strip() else None
+    except yaml.YAMLError as e:
+        raise ValueError(f"sidecar-tuning: invalid YAML: {e}")
+    if tuning is None:
+        tuning = {}
+    if not isinstance(tuning, dict):
+        raise ValueError("sidecar-tuning: expected a mapping of sidecars to settings")
+
+    result = {}
+    for sidecar, defaults in _SIDECAR_PRESETS[preset].items():
+        overrides = tuning.get(sidecar) or {}
+        if not isinstance(overrides, dict):
+            raise ValueError(f"sidecar-tuning: {sidecar} must be a mapping of settings to values")
+
+        settings = {**defaults, **overrides}
+        args = []
+        for key, check in _SIDECAR_SETTINGS.items():
+            if key not in settings:
+                continue
+            try:
+                value = check(settings[key])
+            except ValueError as e:
+                raise ValueError(f"sidecar-tuning: {sidecar}/{key}: {e}")
+            args.append(f"--{_SIDECAR_FLAGS.get((sidecar, key), key)}={value}")
+
+        unknown = settings.keys() - _SIDECAR_SETTINGS.keys()
+        if unknown:
+            raise ValueError(
+                f"sidecar-tuning: {sidecar}: unknown settings {', '.join(sorted(unknown))}, "
+                f"must be one of: {', '.join(_SIDECAR_SETTINGS)}"
+            )
+        result[sidecar] = args
+
+    unknown = tuning.keys() - result.keys()
+    if unknown:
+        raise ValueError(f"sidecar-tuning: unknown sidecars {', '.join(sorted(unknown))}")
+
+    return result
+
+
+def _metrics_ports(config) -> typing.Dict[str, int]:
+    """Read the metrics ports of the sidecars from the config, checking they don't collide"""
+    ports = {}
+    for sidecar in _METRICS_SIDECARS:
+        port = config[f"{sidecar}-metrics-port"]
+        if not 0 < port < 65536:
+            raise ValueError(f"{sidecar}-metrics-port: expected a port number, got {port}")
+        if port == _HEALTH_PORT or port in ports.values():
+            raise ValueError(f"{sidecar}-metrics-port: port {port} is already in use")
+        ports[sidecar] = port
+    return ports
+
+
+def _metrics_port_name(sidecar: str) -> str:
+    # Port names are limited to 15 characters, so drop the "csi-" prefix.
+    return sidecar[len("csi-"):]
+
+
+def _metrics_container_port(sidecar: str, metrics_ports: typing.Dict[str, int]) -> dict:
+    return {"name": _metrics_port_name(sidecar), "containerPort": metrics_ports[sidecar], "protocol": "TCP"}
+
+
+def _dashboards(dashboards_dir: pathlib.Path, topology: dict) -> dict:
+    """Load the dashboards in the compressed form expected by the grafana_dashboard interface"""
+    templates = {}
+    for path in sorted(dashboards_dir.glob("*.json")):
+        templates[f"file:{path.name}"] = {
+            "charm": topology["charm_name"],
+            "content": base64.b64encode(lzma.compress(path.read_bytes())).decode(),
+            "juju_topology": topology,
+            "inject_dropdowns": True,
+        }
+    # The consumer only re-reads the dashboards when the uuid changes, so derive it from the content.
+    digest = hashlib.sha256(json.dumps(templates, sort_keys=True).encode()).hexdigest()
+    return {"templates": templates, "uuid": digest}
+
+
+def _storage_classes(app: str, config_str: str) -> typing.List[dict]:
+    """Render the StorageClasses from the YAML mapping of class names to settings, i.e.:
+
+        fast-local:
+          preset: low-latency-local
+          storage-pool: nvme
+        replicated:
+          placement-count: 3
+          drbd-options:
+            Net/protocol: C
+    """
+    try:
+        classes = yaml.safe_load(config_str) if config_str.strip() else None
+    except yaml.YAMLError as e:
+        raise ValueError(f"storage-classes: invalid YAML: {e}")
+    if classes is None:
+        classes = {}
+    if not isinstance(classes, dict):
+        raise ValueError("storage-classes: expected a mapping of StorageClass names to settings")
+
+    result = []
+    for name, overrides in classes.items():
+        if not isinstance(name, str) or len(name) > 253 or not _K8S_NAME_RE.match(name):
+            raise ValueError(f"storage-classes: invalid StorageClass name '{name}'")
+
+        overrides = overrides or {}
+        if not isinstance(overrides, dict):
+            raise ValueError(f"storage-classes: {name} must be a mapping of settings to values")
+
+        overrides = dict(overrides)
+
+        preset = overrides.pop("preset", "default")
+        if preset not in _STORAGE_CLASS_PRESETS:
+            raise ValueError(
+                f"storage-classes: {name}: unknown preset '{preset}', "
+                f"must be one of: {', '.join(_STORAGE_CLASS_PRESETS)}"
+            )
+
+        unknown = overrides.keys() - _STORAGE_CLASS_SETTINGS.keys()
+        if unknown:
+            raise ValueError(
+                f"storage-classes: {name}: unknown settings {', '.join(sorted(unknown))}, "
+                f"must be one of: preset, {', '.join(_STORAGE_CLASS_SETTINGS)}"
+            )
+
+        settings = {}
+        for source in (_STORAGE_CLASS_PRESETS[preset], overrides):
+            for key, value in source.items():
+                try:
+                    value = _STORAGE_CLASS_SETTINGS[key][0](value)
+                except ValueError as e:
+                    raise ValueError(f"storage-classes: {name}/{key}: {e}")
+                if key == "drbd-options":
+                    # Options are merged, so a class can change a single option of its preset.
+                    value = {**settings.get(key, {}), **value}
+                settings[key] = value
+
+        parameters = {
+            _STORAGE_CLASS_SETTINGS[key][1]: str(value)
+            for key, value in settings.items()
+            if _STORAGE_CLASS_SETTINGS[key][1]
+        }
+        for option, value in settings.get("drbd-options", {}).items():
+            parameters[f"property.linstor.csi.linbit.com/DrbdOptions/{option}"] = value
+
+        result.append(
+            {
+                "apiVersion": "storage.k8s.io/v1",
+                "kind": "StorageClass",
+                "metadata": {
+                    "name": name,
+                    "labels": {
+                        "app.kubernetes.io/component": "cluster-config",
+                        "app.kubernetes.io/instance": app,
+                    },
+                },
+                "provisioner": "linstor.csi.linbit.com",
+                "allowVolumeExpansion": True,
+                "volumeBindingMode": settings["volume-binding-mode"],
+                "parameters": parameters,
+            }
+        )
+
+    return sorted(result, key=lambda sc: sc["metadata"]["name"])
+
+
+# Shell functions of the StorageClass apply script. Parameters, provisioner, reclaimPolicy and volumeBindingMode of a
+# StorageClass are immutable: the apiserver rejects changes to them with 422 Invalid, reported by kubectl as
+# "Forbidden: updates to ... are forbidden" or "field is immutable". Only then, and only for classes carrying the
+# labels of this application, the class is deleted and created again. Any other failure, like a conflict with a
+# class of the same name created by other means, or a transient apiserver error, is logged and skipped.
+_STORAGE_CLASS_FUNCTIONS = """
+apply_storage_class() {
+    if output=$(kubectl apply --server-side=true --field-manager %(field_manager)s \\
+            --filename "/k8s/$1.json" 2>&1); then
+        echo "$output"
+        return 0
+    fi
+    echo "$output" >&2
+
+    if ! echo "$output" | grep -qE 'Forbidden: updates to [A-Za-z]+ are forbidden|field is immutable'; then
+        echo "failed to apply StorageClass $1, skipping" >&2
+        return 0
+    fi
+
+    owner=$(kubectl get storageclasses.storage.k8s.io "$1" --output "jsonpath=%(owner_path)s")
+    if [ "$owner" != "cluster-config/%(app)s" ]; then
+        echo "StorageClass $1 is not managed by %(app)s, not recreating it" >&2
+        return 0
+    fi
+
+    kubectl delete storageclasses.storage.k8s.io "$1" &&
+        kubectl apply --server-side=true --field-manager %(field_manager)s --filename "/k8s/$1.json" ||
+        echo "failed to recreate StorageClass $1" >&2
+}
+"""
+
+
+def _storage_class_script(app: str, storage_classes: typing.List[dict]) -> str:
+    """Render the script that applies the StorageClasses and deletes the ones removed from the config.
+
+    Server-side apply leaves classes that didn't change untouched. Classes whose immutable fields changed are deleted
+    and created again, which does not affect existing volumes. Failures are only logged: they should not keep the CSI
+    controller from starting.
+    """
+    lines = [
+        "set -x",
+        _STORAGE_CLASS_FUNCTIONS
+        % {
+            "app": app,
+            "field_manager": _FIELD_MANAGER,
+            "owner_path": r"{.metadata.labels.app\.kubernetes\.io/component}/"
+            r"{.metadata.labels.app\.kubernetes\.io/instance}",
+        },
+    ]
+    for sc in storage_classes:
+        lines.append(f"apply_storage_class {sc['metadata']['name']}")
+
+    prune = (
+        "kubectl delete storageclasses.storage.k8s.io "
+        f"--selector app.kubernetes.io/component=cluster-config,app.kubernetes.io/instance={app}"
+    )
+    if storage_classes:
+        prune += " --field-selector " + ",".join(f"metadata.name!={sc['metadata']['name']}" for sc in storage_classes)
+    lines.append(f"{prune} || echo 'failed to delete removed StorageClasses' >&2")
+    return "\n".join(lines) + "\n"
+
+
 if __name__ == "__main__":
     main.main(LinstorCSIControllerCharm)
@@ -3,9 +3,14 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
+import base64
+import json
+import lzma
 import unittest
+from unittest import mock
 
-from charm import LinstorCSIControllerCharm
+from charm import _sidecar_args, _storage_class_script, _storage_classes, LinstorCSIControllerCharm
+from ops import model
 from ops.testing import Harness
 
 
@@ -13,4 +18,213 @@ class TestCharm(unittest.TestCase):
     def setUp(self):
         self.harness = Harness(LinstorCSIControllerCharm)
         self.addCleanup(self.harness.cleanup)
+        self.harness.set_model_name("storage")
+        self.harness.add_resource("image-override", "{}")
+        self.harness.add_resource("pull-secret", "")
         self.harness.begin()
+        self.harness.charm._stored.linstor_url = "http://linstor-api:3370"
+
+    def test_skips_unchanged_pod_spec(self):
+        self.harness.set_leader(True)
+
+        with mock.patch.object(
+            self.harness.charm.model.pod, "set_spec", wraps=self.harness.charm.model.pod.set_spec
+        ) as set_spec:
+            self.harness.charm.on.config_changed.emit()
+            self.harness.charm.on.config_changed.emit()
+            set_spec.assert_called_once()
+
+            self.harness.update_config({"sidecar-preset": "high-throughput"})
+            self.assertEqual(2, set_spec.call_count)
+
+    def test_sidecar_args(self):
+        self.harness.set_leader(True)
+        self.harness.update_config({"sidecar-tuning": "csi-resizer:\n  worker-threads: 20\n"})
+
+        spec, _ = self.harness.get_pod_spec()
+        args = {c["name"]: c.get("args") for c in spec["containers"]}
+        self.assertEqual(
+            ["--csi-address=$(ADDRESS)", "--timeout=1m", "--workers=20", "--handle-volume-inuse-error=false"],
+            args["csi-resizer"][:4],
+        )
+        self.assertIn("--timeout=1m", args["csi-attacher"])
+        self.assertIn("--feature-gates=Topology=true", args["csi-provisioner"])
+        self.assertIn("--strict-topology", args["csi-provisioner"])
+        self.assertIn("--capacity-poll-interval=1m", args["csi-provisioner"])
+
+    def test_invalid_sidecar_tuning_blocks(self):
+        self.harness.set_leader(True)
+        self.harness.update_config({"sidecar-tuning": "csi-provisioner:\n  timeout: 60\n"})
+
+        self.assertIsInstance(self.harness.charm.unit.status, model.BlockedStatus)
+        self.assertIsNone(self.harness.get_pod_spec())
+
+    def test_metrics(self):
+        self.harness.set_leader(True)
+        metrics_id = self.harness.add_relation("metrics-endpoint", "prometheus")
+        dashboard_id = self.harness.add_relation("grafana-dashboard", "grafana")
+        self.harness.update_config({"csi-resizer-metrics-port": 8080})
+
+        spec, k8s_resources = self.harness.get_pod_spec()
+        resizer = next(c for c in spec["containers"] if c["name"] == "csi-resizer")
+        self.assertIn("--http-endpoint=:8080", resizer["args"])
+        self.assertEqual([{"name": "resizer", "containerPort": 8080, "protocol": "TCP"}], resizer["ports"])
+        service = k8s_resources["kubernetesResources"]["services"][0]
+        self.assertEqual("linstor-csi-controller-metrics", service["name"])
+        self.assertEqual([9810, 9811, 8080, 9813], [p["port"] for p in service["spec"]["ports"]])
+
+        jobs = json.loads(self.harness.get_relation_data(metrics_id, "linstor-csi-controller")["scrape_jobs"])
+        self.assertEqual(
+            {
+                "job_name": "csi-resizer",
+                "metrics_path": "/metrics",
+                "static_configs": [{"targets": ["linstor-csi-controller-metrics.storage.svc:8080"]}],
+            },
+            jobs[2],
+        )
+
+        data = self.harness.get_relation_data(dashboard_id, "linstor-csi-controller")
+        template = json.loads(data["dashboards"])["templates"]["file:linstor-csi-controller.json"]
+        dashboard = json.loads(lzma.decompress(base64.b64decode(template["content"])))
+        self.assertEqual("LINSTOR CSI Controller", dashboard["title"])
+
+    def test_metrics_port_collision_blocks(self):
+        self.harness.set_leader(True)
+        self.harness.update_config({"csi-resizer-metrics-port": 9810})
+
+        self.assertIsInstance(self.harness.charm.unit.status, model.BlockedStatus)
+        self.assertIsNone(self.harness.get_pod_spec())
+
+    def test_invalid_capacity_poll_interval_blocks(self):
+        self.harness.set_leader(True)
+        self.harness.update_config({"capacity-poll-interval": "5 minutes"})
+
+        self.assertIsInstance(self.harness.charm.unit.status, model.BlockedStatus)
+        self.assertIsNone(self.harness.get_pod_spec())
+
+    def test_storage_classes(self):
+        self.harness.set_leader(True)
+        self.harness.update_config({"storage-classes": "fast:\n  preset: low-latency-local\n  storage-pool: nvme\n"})
+
+        spec, _ = self.harness.get_pod_spec()
+        init = next(c for c in spec["containers"] if c["name"] == "storage-class-apply")
+        self.assertTrue(init["init"])
+        files = {f["path"]: f["content"] for f in init["volumeConfig"][0]["files"]}
+        self.assertEqual({"init.sh", "fast.json"}, files.keys())
+        self.assertEqual("nvme", json.loads(files["fast.json"])["parameters"]["linstor.csi.linbit.com/storagePool"])
+        self.assertIn("metadata.name!=fast", files["init.sh"])
+
+    def test_invalid_storage_classes_blocks(self):
+        self.harness.set_leader(True)
+        self.harness.update_config({"storage-classes": "fast:\n  preset: fastest\n"})
+
+        self.assertIsInstance(self.harness.charm.unit.status, model.BlockedStatus)
+        self.assertIsNone(self.harness.get_pod_spec())
+
+
+class TestCharmHelpers(unittest.TestCase):
+    def test_sidecar_args(self):
+        args = _sidecar_args(
+            "high-throughput", "csi-provisioner:\n  kube-api-qps: 7.5\n  retry-interval-start: 500ms\n"
+        )
+        self.assertEqual(
+            [
+                "--timeout=2m",
+                "--worker-threads=100",
+                "--kube-api-qps=7.5",
+                "--kube-api-burst=100",
+                "--retry-interval-start=500ms",
+                "--retry-interval-max=30s",
+            ],
+            args["csi-provisioner"],
+        )
+        self.assertIn("--workers=20", args["csi-resizer"])
+        self.assertEqual(["--timeout=1m"], _sidecar_args("default", "")["csi-attacher"])
+
+    def test_sidecar_args_invalid(self):
+        for preset, tuning in [
+            ("fast", ""),
+            ("default", "- csi-provisioner"),
+            ("default", "csi-provisioner: ["),
+            ("default", "csi-node:\n  timeout: 1m\n"),
+            ("default", "csi-provisioner: 10\n"),
+            ("default", "csi-provisioner:\n  threads: 10\n"),
+            ("default", "csi-provisioner:\n  timeout: 1 minute\n"),
+            ("default", "csi-provisioner:\n  worker-threads: 0\n"),
+            ("default", "csi-provisioner:\n  kube-api-qps: true\n"),
+        ]:
+            with self.subTest(preset=preset, tuning=tuning):
+                self.assertRaises(ValueError, _sidecar_args, preset, tuning)
+
+    def test_storage_classes(self):
+        classes = _storage_classes(
+            "csi",
+            """
+replicated:
+  preset: replicated-throughput
+  placement-count: 3
+  replicas-on-same: [topology.kubernetes.io/region]
+  drbd-options:
+    Net/protocol: C
+    Net/allow-two-primaries: yes
+immediate:
+  volume-binding-mode: Immediate
+  layer-list: [storage]
+""",
+        )
+        self.assertEqual(["immediate", "replicated"], [sc["metadata"]["name"] for sc in classes])
+        self.assertEqual("Immediate", classes[0]["volumeBindingMode"])
+        self.assertEqual({"linstor.csi.linbit.com/layerList": "storage"}, classes[0]["parameters"])
+        self.assertEqual("csi", classes[1]["metadata"]["labels"]["app.kubernetes.io/instance"])
+        self.assertEqual("WaitForFirstConsumer", classes[1]["volumeBindingMode"])
+        self.assertEqual(
+            {
+                "linstor.csi.linbit.com/placementCount": "3",
+                "linstor.csi.linbit.com/layerList": "drbd storage",
+                "linstor.csi.linbit.com/replicasOnSame": "topology.kubernetes.io/region",
+                "linstor.csi.linbit.com/mountOpts": "noatime",
+                "property.linstor.csi.linbit.com/DrbdOptions/Net/max-buffers": "8000",
+                "property.linstor.csi.linbit.com/DrbdOptions/Net/max-epoch-size": "8000",
+                "property.linstor.csi.linbit.com/DrbdOptions/Disk/al-extents": "6007",
+                "property.linstor.csi.linbit.com/DrbdOptions/Net/protocol": "C",
+                "property.linstor.csi.linbit.com/DrbdOptions/Net/allow-two-primaries": "yes",
+            },
+            classes[1]["parameters"],
+        )
+        self.assertEqual(
+            "false",
+            _storage_classes("csi", "local:\n  preset: low-latency-local\n")[0]["parameters"][
+                "linstor.csi.linbit.com/allowRemoteVolumeAccess"
+            ],
+        )
+        self.assertEqual([], _storage_classes("csi", ""))
+
+    def test_storage_classes_invalid(self):
+        for config in [
+            "- fast",
+            "fast: [",
+            "Fast: {}",
+            "fast: 1",
+            "fast:\n  preset: fastest\n",
+            "fast:\n  replicas: 2\n",
+            "fast:\n  placement-count: 0\n",
+            "fast:\n  volume-binding-mode: Later\n",
+            "fast:\n  layer-list: []\n",
+            "fast:\n  allow-remote-volume-access: no-thanks\n",
+            "fast:\n  drbd-options:\n    protocol: C\n",
+            "fast:\n  drbd-options:\n    Net/protocol: [C]\n",
+        ]:
+            with self.subTest(config=config):
+                self.assertRaises(ValueError, _storage_classes, "csi", config)
+
+    def test_storage_class_script(self):
+        script = _storage_class_script("csi", _storage_classes("csi", "a: {}\nb: {}\n"))
+        self.assertIn(
+            'kubectl apply --server-side=true --field-manager charms.linbit.com/v1 --filename "/k8s/$1.json" ||',
+            script,
+        )
+        self.assertIn("\napply_storage_class a\napply_storage_class b\n", script)
+        # Only classes of this application are recreated
+        self.assertIn('if [ "$owner" != "cluster-config/csi" ]; then', script)
+        self.assertIn("--field-selector metadata.name!=a,metadata.name!=b", script)
+        self.assertNotIn("--field-selector", _storage_class_script("csi", []))
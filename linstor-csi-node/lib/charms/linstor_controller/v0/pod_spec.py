@@ -0,0 +1,71 @@
+# Copyright 2022 LINBIT HA-Solutions GmbH
+# See LICENSE file for licensing details.
+
+"""Skip setting pod specs that did not change.
+
+Every pod-spec-set makes Juju replace the workload, restarting its pods, even if the spec is identical. The charm
+keeps the digest of the last applied spec in its StoredState, under the name pod_spec_digest:
+
+    self._stored.set_default(pod_spec_digest=None)
+    ...
+    apply_pod_spec(self, self._stored, spec, k8s_resources=k8s_resources)
+
+The digest only knows what this unit applied. Another unit may have applied a different spec while this unit was not
+the leader, so call forget_pod_spec() on leader-elected.
+
+Shared by the LINSTOR charms, fetch it with:
+
+    charmcraft fetch-lib charms.linstor_controller.v0.pod_spec
+"""
+import hashlib
+import json
+import logging
+import typing
+
+from ops import charm, framework, model
+
+# The unique Charmhub library identifier, never change it
+LIBID = "b8e540ebcf34406bb366f1a0c2e6024b"
+
+# Increment this major API version when introducing breaking changes
+LIBAPI = 0
+
+# Increment this PATCH version before using `charmcraft publish-lib` or reset
+# to 0 if you are raising the major API version
+LIBPATCH = 1
+
+logger = logging.getLogger(__name__)
+
+
+def spec_digest(spec: dict, k8s_resources: typing.Optional[dict]) -> str:
+    """Hash the canonical JSON form of a pod spec, so equal specs have equal digests regardless of key order"""
+    canonical = json.dumps(
+        {"spec": spec, "k8s_resources": k8s_resources},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def apply_pod_spec(
+    unit_charm: charm.CharmBase,
+    stored: framework.StoredState,
+    spec: dict,
+    k8s_resources: typing.Optional[dict] = None,
+) -> bool:
+    """Set the pod spec, unless it is identical to the last one applied by this unit. Returns whether it was set."""
+    digest = spec_digest(spec, k8s_resources)
+    if digest == stored.pod_spec_digest:
+        logger.info("pod spec unchanged (sha256:%s), skipping set_spec", digest[:12])
+        return False
+
+    unit_charm.app.status = model.MaintenanceStatus("Setting pod spec")
+    unit_charm.model.pod.set_spec(spec, k8s_resources=k8s_resources)
+    stored.pod_spec_digest = digest
+    logger.info("applied pod spec sha256:%s", digest[:12])
+    return True
+
+
+def forget_pod_spec(stored: framework.StoredState):
+    """Make the next apply_pod_spec() set the spec, whatever was applied before"""
+    stored.pod_spec_digest = None
@@ -14,6 +14,8 @@ develop a new k8s charm using the Operator Framework:
 import json
 import logging
 
+from charms.linstor_controller.v0.pod_spec import apply_pod_spec, forget_pod_spec
+from charms.linstor_controller.v0.reconcile import reconciled, retry_later, run_due_steps
 from oci_image import OCIImageResourceError
 from ops import charm, framework, main, model
 
@@ -47,7 +49,12 @@ class LinstorCSINodeCharm(charm.CharmBase):
     def __init__(self, *args):
         super().__init__(*args)
 
-        self._stored.set_default(linstor_url=None, satellite_app_name=None)
+        self._stored.set_default(
+            linstor_url=None,
+            satellite_app_name=None,
+            pending={},
+            pod_spec_digest=None,
+        )
 
         self.framework.observe(
             self.on.linstor_relation_changed, self._on_linstor_relation_changed
@@ -57,6 +64,8 @@ class LinstorCSINodeCharm(charm.CharmBase):
         )
 
         self.framework.observe(self.on.config_changed, self._config_changed)
+        self.framework.observe(self.on.update_status, self._on_update_status)
+        self.framework.observe(self.on.leader_elected, self._on_leader_elected)
 
     def _config_changed(self, event: charm.HookEvent):
         try:
@@ -68,17 +77,15 @@ class LinstorCSINodeCharm(charm.CharmBase):
             csi_liveness_probe_image = self.get_image("csi-liveness-probe-image")
         except OCIImageResourceError as e:
             self.unit.status = e.status
-            event.defer()
+            self._retry_later("pod-spec", "images not available")
             return
 
         if not self._stored.linstor_url:
+            # Nothing to retry: the relation hooks will run this again.
             self.unit.status = model.BlockedStatus("waiting for linstor relation")
-            event.defer()
             return
 
         if self.unit.is_leader():
-            self.app.status = model.MaintenanceStatus("Setting pod spec")
-
             plugin_vol = {
                 "name": "plugin-dir",
                 "mountPath": "/run/csi",
@@ -142,7 +149,9 @@ kubectl apply --filename /k8s/csi-driver.json --server-side=true --field-manager
                 "PUBLISH_PATH": self.config["publish-path"],
             }
 
-            self.model.pod.set_spec(
+            apply_pod_spec(
+                self,
+                self._stored,
                 spec={
                     "version": 3,
                     "containers": [
@@ -245,6 +254,8 @@ kubectl apply --filename /k8s/csi-driver.json --server-side=true --field-manager
             )
 
             self.app.status = model.ActiveStatus()
+
+        self._reconciled("pod-spec")
         self.unit.status = model.ActiveStatus()
 
     def _on_linstor_relation_changed(self, event: charm.RelationChangedEvent):
@@ -258,6 +269,18 @@ kubectl apply --filename /k8s/csi-driver.json --server-side=true --field-manager
         self._stored.linstor_url = None
         self._config_changed(event)
 
+    def _on_leader_elected(self, _event: charm.LeaderElectedEvent):
+        forget_pod_spec(self._stored)
+
+    def _on_update_status(self, event: charm.UpdateStatusEvent):
+        run_due_steps(self._stored.pending, [("pod-spec", lambda: self._config_changed(event))])
+
+    def _retry_later(self, name: str, reason: str):
+        retry_later(self._stored.pending, name, reason)
+
+    def _reconciled(self, name: str):
+        reconciled(self._stored.pending, name)
+
     def get_image(self, name) -> dict:
         override = self.model.resources.fetch(
             "image-override"
@@ -4,6 +4,7 @@
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
 import unittest
+from unittest import mock
 
 from charm import LinstorCSINodeCharm
 from ops.testing import Harness
@@ -13,4 +14,26 @@ class TestCharm(unittest.TestCase):
     def setUp(self):
         self.harness = Harness(LinstorCSINodeCharm)
         self.addCleanup(self.harness.cleanup)
+        self.harness.add_resource("image-override", "{}")
+        self.harness.add_resource("pull-secret", "")
         self.harness.begin()
+
+    def test_skips_unchanged_pod_spec(self):
+        self.harness.set_leader(True)
+        self.harness.charm._stored.linstor_url = "http://linstor-api.linstor.svc:3370"
+
+        with mock.patch.object(
+            self.harness.charm.model.pod, "set_spec", wraps=self.harness.charm.model.pod.set_spec
+        ) as set_spec:
+            self.harness.charm.on.config_changed.emit()
+            self.harness.charm.on.config_changed.emit()
+            set_spec.assert_called_once()
+
+            self.harness.update_config({"publish-path": "/var/lib/kubelet"})
+            self.assertEqual(2, set_spec.call_count)
+
+        spec, _ = self.harness.get_pod_spec()
+        self.assertEqual(
+            "/var/lib/kubelet",
+            spec["containers"][0]["envConfig"]["PUBLISH_PATH"],
+        )
@@ -14,6 +14,8 @@ develop a new k8s charm using the Operator Framework:
 import json
 import logging
 
+from charms.linstor_controller.v0.pod_spec import apply_pod_spec, forget_pod_spec
+from charms.linstor_controller.v0.reconcile import reconciled, retry_later, run_due_steps
 from oci_image import OCIImageResourceError
 from ops import charm, framework, main, model
 
@@ -35,7 +37,7 @@ class LinstorHighAvailabilityControllerCharm(charm.CharmBase):
     def __init__(self, *args):
         super().__init__(*args)
 
-        self._stored.set_default(linstor_url=None)
+        self._stored.set_default(linstor_url=None, pending={}, pod_spec_digest=None)
 
         self.framework.observe(
             self.on.linstor_relation_changed, self._on_linstor_relation_changed
@@ -46,18 +48,20 @@ class LinstorHighAvailabilityControllerCharm(charm.CharmBase):
         self.framework.observe(self.on.install, self._set_pod_spec)
         self.framework.observe(self.on.upgrade_charm, self._set_pod_spec)
         self.framework.observe(self.on.config_changed, self._set_pod_spec)
+        self.framework.observe(self.on.update_status, self._on_update_status)
+        self.framework.observe(self.on.leader_elected, self._on_leader_elected)
 
     def _set_pod_spec(self, event: charm.HookEvent):
         try:
             linstor_ha_controller_image = self.get_image("linstor-ha-controller-image")
         except OCIImageResourceError as e:
             self.unit.status = e.status
-            event.defer()
+            self._retry_later("pod-spec", "images not available")
             return
 
         if not self._stored.linstor_url:
+            # Nothing to retry: the relation hooks will run this again.
             self.unit.status = model.BlockedStatus("waiting for linstor relation")
-            event.defer()
             return
 
         env = {
@@ -67,8 +71,9 @@ class LinstorHighAvailabilityControllerCharm(charm.CharmBase):
         }
 
         if self.unit.is_leader():
-            self.app.status = model.MaintenanceStatus("Setting pod spec")
-            self.model.pod.set_spec(
+            apply_pod_spec(
+                self,
+                self._stored,
                 spec={
                     "version": 3,
                     "containers": [
@@ -148,6 +153,7 @@ class LinstorHighAvailabilityControllerCharm(charm.CharmBase):
             )
             self.app.status = model.ActiveStatus()
 
+        self._reconciled("pod-spec")
         self.unit.status = model.ActiveStatus()
 
     def _on_linstor_relation_changed(self, event: charm.RelationChangedEvent):
@@ -161,6 +167,18 @@ class LinstorHighAvailabilityControllerCharm(charm.CharmBase):
         self._stored.linstor_url = None
         self._set_pod_spec(event)
 
+    def _on_leader_elected(self, _event: charm.LeaderElectedEvent):
+        forget_pod_spec(self._stored)
+
+    def _on_update_status(self, event: charm.UpdateStatusEvent):
+        run_due_steps(self._stored.pending, [("pod-spec", lambda: self._set_pod_spec(event))])
+
+    def _retry_later(self, name: str, reason: str):
+        retry_later(self._stored.pending, name, reason)
+
+    def _reconciled(self, name: str):
+        reconciled(self._stored.pending, name)
+
     def get_image(self, name) -> dict:
         override = self.model.resources.fetch(
             "image-override"
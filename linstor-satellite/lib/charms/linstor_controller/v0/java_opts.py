@@ -0,0 +1,73 @@
+# Copyright 2022 LINBIT HA-Solutions GmbH
+# See LICENSE file for licensing details.
+
+"""JVM options of the LINSTOR Controller and Satellite.
+
+Builds JAVA_OPTS from the java-heap-size, java-gc, java-thread-stack-size and java-opts config options, which the
+LINSTOR charms running a JVM share. Depends on charms.linstor_controller.v0.workload_resources.
+
+Shared by the LINSTOR charms, fetch it with:
+
+    charmcraft fetch-lib charms.linstor_controller.v0.java_opts
+"""
+import re
+import typing
+
+from charms.linstor_controller.v0.workload_resources import parse_quantity
+
+# The unique Charmhub library identifier, never change it
+LIBID = "53f1660cf3ab49d89d8fbfaa51bc3900"
+
+# Increment this major API version when introducing breaking changes
+LIBAPI = 0
+
+# Increment this PATCH version before using `charmcraft publish-lib` or reset
+# to 0 if you are raising the major API version
+LIBPATCH = 1
+
+_JAVA_SIZE_RE = re.compile(r"^([0-9]+)([kKmMgG]?)$")
+_JAVA_SIZE_FACTORS = {"": 1, "k": 2**10, "m": 2**20, "g": 2**30}
+
+JAVA_GC_FLAGS = {
+    "G1": "-XX:+UseG1GC",
+    "Parallel": "-XX:+UseParallelGC",
+    "Serial": "-XX:+UseSerialGC",
+    "Shenandoah": "-XX:+UseShenandoahGC",
+    "Z": "-XX:+UseZGC",
+}
+
+
+def parse_java_size(name: str, value: str) -> int:
+    match = _JAVA_SIZE_RE.match(value)
+    if not match:
+        raise ValueError(f"{name}: '{value}' is not a valid size, expected a number with optional k, m or g suffix")
+    return int(match.group(1)) * _JAVA_SIZE_FACTORS[match.group(2).lower()]
+
+
+def build_java_opts(config: typing.Mapping, memory_limit: typing.Optional[str]) -> str:
+    """Build the JAVA_OPTS for the LINSTOR JVM from the charm config"""
+    opts = []
+
+    heap = config["java-heap-size"]
+    if heap:
+        heap_bytes = parse_java_size("java-heap-size", heap)
+        if memory_limit and heap_bytes >= parse_quantity("memory-limit", memory_limit):
+            raise ValueError("java-heap-size must be smaller than the memory limit")
+        # A fixed heap size avoids pauses for resizing the heap
+        opts += [f"-Xms{heap}", f"-Xmx{heap}"]
+
+    gc = config["java-gc"]
+    if gc:
+        if gc not in JAVA_GC_FLAGS:
+            raise ValueError(f"java-gc: unknown garbage collector '{gc}', must be one of: {', '.join(JAVA_GC_FLAGS)}")
+        opts.append(JAVA_GC_FLAGS[gc])
+
+    stack = config["java-thread-stack-size"]
+    if stack:
+        parse_java_size("java-thread-stack-size", stack)
+        opts.append(f"-Xss{stack}")
+
+    if config["java-opts"]:
+        opts.append(config["java-opts"])
+
+    return " ".join(opts)
@@ -0,0 +1,90 @@
+# Copyright 2022 LINBIT HA-Solutions GmbH
+# See LICENSE file for licensing details.
+
+"""LINSTOR properties managed by a charm.
+
+The charms set LINSTOR properties from their config, next to properties set by hand. plan_props() records which keys
+a charm set in a property of its own, so only those are removed again once the config no longer sets them.
+drbd_option_props() turns DRBD options, given as YAML mapping of sections to options, into such properties.
+
+Shared by the LINSTOR charms, fetch it with:
+
+    charmcraft fetch-lib charms.linstor_controller.v0.linstor_props
+"""
+import typing
+
+import linstor
+
+# The unique Charmhub library identifier, never change it
+LIBID = "8054f9216a8b4172a74ae499bf829c0d"
+
+# Increment this major API version when introducing breaking changes
+LIBAPI = 0
+
+# Increment this PATCH version before using `charmcraft publish-lib` or reset
+# to 0 if you are raising the major API version
+LIBPATCH = 1
+
+# DRBD configuration sections that can be set as LINSTOR properties, and their property namespace.
+DRBD_OPTION_SECTIONS = {
+    "net": linstor.sharedconsts.NAMESPC_DRBD_NET_OPTIONS,
+    "disk": linstor.sharedconsts.NAMESPC_DRBD_DISK_OPTIONS,
+    "peer-device": linstor.sharedconsts.NAMESPC_DRBD_PEER_DEVICE_OPTIONS,
+    "resource": linstor.sharedconsts.NAMESPC_DRBD_RESOURCE_OPTIONS,
+}
+
+
+def drbd_option_props(name: str, sections: typing.Any) -> typing.Dict[str, str]:
+    """Turn a mapping of DRBD sections to options into LINSTOR properties, i.e.:
+
+        net:
+          max-buffers: 8000
+
+    to DrbdOptions/Net/max-buffers=8000. Raises ValueError, prefixed with name, for anything else.
+    """
+    if not isinstance(sections, dict):
+        raise ValueError(f"{name}: expected a mapping of sections to options")
+
+    result = {}
+    for section, options in sections.items():
+        if section not in DRBD_OPTION_SECTIONS:
+            raise ValueError(
+                f"{name}: unknown section '{section}', must be one of: {', '.join(DRBD_OPTION_SECTIONS)}"
+            )
+        if not isinstance(options, dict):
+            raise ValueError(f"{name}: section '{section}' must be a mapping of options to values")
+
+        for option, value in options.items():
+            if isinstance(value, (dict, list)) or value is None:
+                raise ValueError(f"{name}: {section}/{option} must be a single value")
+            if isinstance(value, bool):
+                # DRBD spells booleans as yes/no, YAML turns those into booleans.
+                value = "yes" if value else "no"
+            result[f"{DRBD_OPTION_SECTIONS[section]}/{option}"] = str(value)
+
+    return result
+
+
+def plan_props(
+    desired: typing.Dict[str, str],
+    current: typing.Dict[str, str],
+    managed_key: str,
+) -> typing.Tuple[typing.Dict[str, str], typing.List[str]]:
+    """Compute the properties to set and delete to get from the current to the desired properties.
+
+    The keys managed by the charm are recorded in the managed_key property. Only those keys are ever deleted, so
+    properties set by hand are left alone unless the config sets them too.
+    """
+    managed = set(current.get(managed_key, "").split())
+
+    to_set = {key: value for key, value in desired.items() if current.get(key) != value}
+    to_delete = sorted(key for key in managed - desired.keys() if key in current)
+
+    managed_value = " ".join(sorted(desired))
+    if current.get(managed_key, "") != managed_value:
+        if managed_value:
+            to_set[managed_key] = managed_value
+        elif managed_key in current:
+            to_delete.append(managed_key)
+
+    return to_set, to_delete
@@ -0,0 +1,91 @@
+# Copyright 2022 LINBIT HA-Solutions GmbH
+# See LICENSE file for licensing details.
+
+"""Reconcile steps retried from update-status.
+
+Instead of deferring events, which replays every deferred event on each following hook, a charm schedules the step
+that could not complete with retry_later(). On update-status, run_due_steps() runs every step whose delay has passed.
+Repeated failures back off exponentially (with jitter), and scheduling an already pending step only updates its delay.
+A step that raises is scheduled again like any other failure, so one broken step does not fail the hook or keep the
+other steps from running.
+
+The pending steps are kept in a dict of the charm's StoredState, for example:
+
+    self._stored.set_default(pending={})
+    ...
+    retry_later(self._stored.pending, "pod-spec", "controller not online")
+    ...
+    run_due_steps(self._stored.pending, [("pod-spec", self._set_pod_spec)])
+
+Shared by the LINSTOR charms, fetch it with:
+
+    charmcraft fetch-lib charms.linstor_controller.v0.reconcile
+"""
+import logging
+import random
+import time
+import typing
+
+# The unique Charmhub library identifier, never change it
+LIBID = "bf2c6cd6bb8f479bab5f1c52b33eb044"
+
+# Increment this major API version when introducing breaking changes
+LIBAPI = 0
+
+# Increment this PATCH version before using `charmcraft publish-lib` or reset
+# to 0 if you are raising the major API version
+LIBPATCH = 1
+
+logger = logging.getLogger(__name__)
+
+# Bounds for the delay before a pending step is retried, in seconds.
+BASE_DELAY = 30
+MAX_DELAY = 900
+
+
+def retry_later(pending: typing.MutableMapping, name: str, reason: str):
+    """Schedule a step to run again from update-status, backing off exponentially with jitter"""
+    entry = pending.get(name)
+    attempts = (entry["attempts"] if entry else 0) + 1
+    delay = min(MAX_DELAY, BASE_DELAY * 2 ** (attempts - 1))
+    delay = random.uniform(delay / 2, delay)
+
+    pending[name] = {
+        "attempts": attempts,
+        "not-before": time.time() + delay,
+    }
+    logger.info("%s: %s, retrying in %ds (attempt %d)", name, reason, delay, attempts)
+
+
+def reconciled(pending: typing.MutableMapping, name: str):
+    """Mark a step as done, dropping its backoff"""
+    pending.pop(name, None)
+
+
+def run_step(pending: typing.MutableMapping, name: str, step: typing.Callable[[], None]) -> bool:
+    """Run a step, scheduling it again if it raises. Returns False if it raised."""
+    try:
+        step()
+    except Exception as e:
+        logger.warning("reconcile step %s failed", name, exc_info=True)
+        retry_later(pending, name, f"failed with {type(e).__name__}: {e}")
+        return False
+    return True
+
+
+def run_due_steps(
+    pending: typing.MutableMapping, steps: typing.Iterable[typing.Tuple[str, typing.Callable[[], None]]]
+) -> typing.Set[str]:
+    """Run the pending steps whose delay has passed, in order. Returns the names of the steps that ran."""
+    ran = set()
+    for name, step in steps:
+        # Earlier steps may have already run (or rescheduled) the later ones.
+        entry = pending.get(name)
+        if entry is None or entry["not-before"] > time.time():
+            continue
+
+        logger.debug("running pending reconcile step %s", name)
+        run_step(pending, name, step)
+        ran.add(name)
+
+    return ran
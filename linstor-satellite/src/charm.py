@@ -11,13 +11,35 @@ develop a new k8s charm using the Operator Framework:
 
     https://discourse.charmhub.io/t/4208
 """
+import concurrent.futures
+import contextlib
+import fnmatch
+import ipaddress
 import json
 import logging
+import re
+import secrets
+import socket
+import subprocess
+import threading
+import time
 import typing
+import urllib.parse
 from collections import namedtuple
 
 import kubernetes
+import kubernetes.stream
 import linstor
+import toml
+import yaml
+from charms.linstor_controller.v0.java_opts import build_java_opts
+from charms.linstor_controller.v0.linstor_props import drbd_option_props, plan_props
+from charms.linstor_controller.v0.pod_spec import apply_pod_spec, forget_pod_spec
+from charms.linstor_controller.v0.reconcile import reconciled, retry_later, run_due_steps, run_step
+from charms.linstor_controller.v0.workload_resources import (
+    container_resources,
+    ensure_workload_resources,
+)
 from oci_image import OCIImageResourceError
 from ops import charm, framework, main, model
 
@@ -26,9 +48,126 @@ logger = logging.getLogger(__name__)
 __version__ = "1.0.0"
 
 StoragePoolConfig = namedtuple(
-    "StoragePoolConfig", ("name", "provider", "provider_name", "devices")
+    "StoragePoolConfig", ("name", "provider", "provider_name", "devices", "props"), defaults=(None,)
+)
+
+StoragePoolPlan = namedtuple("StoragePoolPlan", ("create", "update", "delete", "modify"))
+
+UnitPod = namedtuple("UnitPod", ("name", "uid", "node_name", "pod_ip"))
+
+EvacuationResult = namedtuple("EvacuationResult", ("moved", "failed"))
+
+_REGISTERED_FOR_KEY = f"{linstor.sharedconsts.NAMESPC_AUXILIARY}/charm/registered-for"
+
+# Lists the DRBD option properties set by the charm, so options removed from the config can be removed again.
+_MANAGED_DRBD_OPTIONS_KEY = f"{linstor.sharedconsts.NAMESPC_AUXILIARY}/charm/drbd-options"
+
+# Lists the storage pool properties set by the charm, so properties removed from the config can be removed again.
+_MANAGED_POOL_PROPS_KEY = f"{linstor.sharedconsts.NAMESPC_AUXILIARY}/charm/storage-pool-props"
+
+# Lists the node labels copied to Aux properties by the charm, so labels removed from the config can be removed again.
+_MANAGED_TOPOLOGY_KEY = f"{linstor.sharedconsts.NAMESPC_AUXILIARY}/charm/topology-labels"
+
+_UNIT_ANNOTATION = "unit.juju.is/id"
+
+# Name of the LINSTOR net interface used for DRBD replication if a replication network is configured.
+_REPLICATION_NIC = "replication"
+
+# Matches addresses in the output of "ip -o addr show".
+_IP_ADDR_RE = re.compile(
+    r"^[0-9]+:\s+([^\s@]+)(?:@\S+)?\s+inet6?\s+([0-9a-fA-F.:]+)/[0-9]+.*?\sscope\s+(\S+)", re.MULTILINE
 )
 
+# Where the DRBD module cache is mounted in the injector and satellite containers.
+_MODULE_CACHE_MOUNT = "/var/cache/drbd-modules"
+
+# Wraps the entrypoint of the DRBD injector image: modules built for a kernel release and injector image are kept in
+# the module cache, so they only need to be compiled once per node. The outcome is logged for the charm to report.
+#
+# This depends on how the LINBIT and Piraeus drbd9 injector images work: their entrypoint is /entry.sh, and the modules
+# they compile end up below /tmp or /lib/modules. The wrapper fails if there is no /entry.sh, and caches nothing if it
+# finds no built modules. Cached modules are checked by the injector just like modules loaded before, so a cache hit
+# does not skip its compatibility checks.
+_INJECTOR_WRAPPER = r"""#!/bin/sh
+set -e
+
+if [ ! -x /entry.sh ]; then
+    echo "drbd-module-cache: no /entry.sh, the module cache requires a LINBIT or Piraeus drbd9 injector image" >&2
+    exit 1
+fi
+
+cache="$DRBD_MODULE_CACHE/$(uname -r)/$DRBD_MODULE_VERSION"
+start=$(date +%s)
+
+report() {
+    echo "drbd-module-cache: $1 kernel=$(uname -r) drbd=$DRBD_MODULE_VERSION seconds=$(( $(date +%s) - start ))"
+}
+
+if [ -d /sys/module/drbd ]; then
+    # Let the injector verify the version of the already loaded module
+    /entry.sh
+    report loaded
+    exit 0
+fi
+
+if [ -f "$cache/drbd.ko" ] && [ -f "$cache/drbd_transport_tcp.ko" ]; then
+    modprobe libcrc32c || true
+    if insmod "$cache/drbd.ko" usermode_helper=disabled && insmod "$cache/drbd_transport_tcp.ko" && /entry.sh; then
+        report hit
+        exit 0
+    fi
+    echo "drbd-module-cache: failed to load cached modules, building them again"
+    rmmod drbd_transport_tcp 2>/dev/null || true
+    rmmod drbd 2>/dev/null || true
+    rm -rf "$cache"
+fi
+
+marker=$(mktemp)
+/entry.sh
+
+mkdir -p "$cache.tmp"
+find /tmp "/lib/modules/$(uname -r)" -name 'drbd*.ko' -newer "$marker" -exec cp {} "$cache.tmp" \;
+if [ -f "$cache.tmp/drbd.ko" ]; then
+    rm -rf "$cache"
+    mv "$cache.tmp" "$cache"
+else
+    echo "drbd-module-cache: no built modules found, nothing cached"
+    rm -rf "$cache.tmp"
+fi
+report miss
+"""
+
+_TOPOLOGY_UNTRUSTED = "topology labels require juju trust"
+
+# Seconds between checks whether a replica placed during evacuation finished its resync.
+_EVACUATION_POLL_INTERVAL = 5
+
+_C_MAX_RATE_KEY = f"{linstor.sharedconsts.NAMESPC_DRBD_PEER_DEVICE_OPTIONS}/c-max-rate"
+
+_DISKLESS_FLAGS = {
+    linstor.sharedconsts.FLAG_DISKLESS,
+    linstor.sharedconsts.FLAG_DRBD_DISKLESS,
+    linstor.sharedconsts.FLAG_TIE_BREAKER,
+}
+
+# fio workloads of the benchmark-pool action: profile name -> (rw, block size)
+_BENCHMARK_PROFILES = {
+    "randread-4k": ("randread", "4k"),
+    "randwrite-4k": ("randwrite", "4k"),
+    "read-1m": ("read", "1M"),
+    "write-1m": ("write", "1M"),
+}
+
+_MODULE_CACHE_REPORT_RE = re.compile(
+    r"^drbd-module-cache: (hit|miss|loaded) kernel=(\S+) drbd=(\S*) seconds=([0-9]+)$", re.MULTILINE
+)
+
+# Upper bound for concurrent connections a single hook opens to the LINSTOR Controller.
+_MAX_LINSTOR_CONNECTIONS = 4
+
+# Seconds to wait for a TCP connection to a LINSTOR API endpoint, before trying the next one.
+_LINSTOR_CONNECT_TIMEOUT = 2
+
 _DEFAULTS = {
     "linstor-satellite-image": {
         "piraeus": "quay.io/piraeusdatastore/piraeus-server:v1.18.2",
@@ -38,6 +177,10 @@ _DEFAULTS = {
         "piraeus": "quay.io/piraeusdatastore/drbd9-focal:v9.1.7",
         "linbit": "drbd.io/drbd9-focal:v9.1.7",
     },
+    "drbd-reactor-image": {
+        "piraeus": "quay.io/piraeusdatastore/drbd-reactor:v0.8.0",
+        "linbit": "drbd.io/drbd-reactor:v0.8.0",
+    },
 }
 
 
@@ -47,7 +190,24 @@ class LinstorSatelliteCharm(charm.CharmBase):
     def __init__(self, *args):
         super().__init__(*args)
 
-        self._stored.set_default(linstor_url=None)
+        self._stored.set_default(
+            linstor_url=None,
+            linstor_endpoints=[],
+            pod_name=None,
+            pod_uid=None,
+            node_name=None,
+            pod_ip=None,
+            pending={},
+            pod_spec_digest=None,
+            module_load=None,
+        )
+
+        # Per-dispatch caches: a new charm instance is created for every hook.
+        self._core_v1 = None
+        self._apps_v1 = None
+        self._unit_pod = None
+        self._linstor_session = None
+        self._linstor_lists = {}
 
         self.framework.observe(
             self.on.linstor_relation_changed, self._on_linstor_relation_changed
@@ -55,20 +215,42 @@ class LinstorSatelliteCharm(charm.CharmBase):
         self.framework.observe(
             self.on.linstor_relation_broken, self._on_linstor_relation_broken
         )
+        self.framework.observe(
+            self.on.metrics_endpoint_relation_joined, self._on_metrics_endpoint_relation_joined
+        )
 
         self.framework.observe(self.on.install, self._set_pod_spec)
         self.framework.observe(self.on.upgrade_charm, self._set_pod_spec)
         self.framework.observe(self.on.config_changed, self._set_pod_spec)
+        self.framework.observe(self.on.update_status, self._on_update_status)
+        self.framework.observe(self.on.leader_elected, self._on_leader_elected)
+        self.framework.observe(self.on.purge_module_cache_action, self._on_purge_module_cache_action)
+        self.framework.observe(self.on.benchmark_pool_action, self._on_benchmark_pool_action)
+        self.framework.observe(self.on.evacuate_action, self._on_evacuate_action)
+
+        self.framework.observe(self.framework.on.commit, self._close_linstor_session)
 
     def _set_pod_spec(self, event: charm.HookEvent):
         try:
             linstor_satellite_image = self.get_image("linstor-satellite-image")
             drbd_injector_image = self.get_image("drbd-injector-image")
+            drbd_reactor_image = self.get_image("drbd-reactor-image") if self.config["monitoring"] else None
         except OCIImageResourceError as e:
             self.model.unit.status = e.status
-            event.defer()
+            self._retry_later("pod-spec", "images not available")
+            return
+
+        try:
+            resources = container_resources(self.config)
+            java_opts = build_java_opts(self.config, resources.get("limits", {}).get("memory"))
+        except ValueError as e:
+            self.unit.status = model.BlockedStatus(f"invalid config: {e}")
             return
 
+        satellite_env = {}
+        if java_opts:
+            satellite_env["JAVA_OPTS"] = java_opts
+
         injector_volumes = [
             {
                 "name": "device-dir",
@@ -85,10 +267,36 @@ class LinstorSatelliteCharm(charm.CharmBase):
             "LB_FAIL_IF_USERMODE_HELPER_NOT_DISABLED": "yes",
         }
 
-        mode = self.config["injection-mode"]
+        satellite_volumes = [
+            {
+                "name": "device-dir",
+                "mountPath": "/dev",
+                "hostPath": {"path": "/dev", "type": "Directory"},
+            },
+            {
+                "name": "sys-dir",
+                "mountPath": "/sys",
+                "hostPath": {"path": "/sys", "type": "Directory"},
+            },
+            {
+                "name": "modules-dir",
+                "mountPath": "/lib/modules",
+                "hostPath": {
+                    "path": "/lib/modules",
+                    "type": "Directory",
+                },
+            },
+        ]
+        injector = {
+            "name": "drbd-injector",
+            "init": True,
+            "imageDetails": drbd_injector_image,
+            "kubernetes": {"securityContext": {"privileged": True}},
+            "volumeConfig": injector_volumes,
+            "envConfig": injector_env,
+        }
 
-        if mode == "auto" and not self.model.resources.fetch("pull-secret").read_bytes():
-            mode = "compile"
+        mode = self._injection_mode()
 
         if mode == "compile":
             injector_env["LB_HOW"] = "compile"
@@ -99,12 +307,66 @@ class LinstorSatelliteCharm(charm.CharmBase):
                     "hostPath": {"path": "/usr/src", "type": "Directory"},
                 }
             )
+
+            cache_path = self.config["module-cache-path"]
+            cache_key = _module_cache_key(drbd_injector_image["imagePath"])
+            if cache_path and not cache_key:
+                logger.warning(
+                    "not caching DRBD modules: drbd-injector-image %s has neither a version tag nor a digest",
+                    drbd_injector_image["imagePath"],
+                )
+            if cache_path and cache_key:
+                cache_volume = {
+                    "name": "module-cache-dir",
+                    "mountPath": _MODULE_CACHE_MOUNT,
+                    "hostPath": {"path": cache_path, "type": "DirectoryOrCreate"},
+                }
+                injector_volumes += [
+                    cache_volume,
+                    {
+                        "name": "injector-wrapper",
+                        "mountPath": "/charm",
+                        "files": [{"path": "inject-drbd.sh", "content": _INJECTOR_WRAPPER}],
+                    },
+                ]
+                # Mounted in the satellite as well, so the cache can be purged via the running pod.
+                satellite_volumes.append(cache_volume)
+                injector_env["DRBD_MODULE_CACHE"] = _MODULE_CACHE_MOUNT
+                injector_env["DRBD_MODULE_VERSION"] = cache_key
+                injector["command"] = ["/bin/sh", "/charm/inject-drbd.sh"]
         if mode == "package":
             injector_env["LB_HOW"] = "shipped_modules"
 
+        sidecars = []
+        if drbd_reactor_image:
+            monitoring_port = self.config["monitoring-port"]
+            reactor_conf = toml.dumps(
+                {
+                    "prometheus": [{"enums": True, "address": f"0.0.0.0:{monitoring_port}"}],
+                }
+            )
+            sidecars.append(
+                {
+                    "name": "drbd-reactor",
+                    "imageDetails": drbd_reactor_image,
+                    "args": ["--config", "/etc/drbd-reactor/drbd-reactor.toml"],
+                    "ports": [{"name": "prometheus", "containerPort": monitoring_port}],
+                    # Needed to receive DRBD events from the kernel
+                    "kubernetes": {"securityContext": {"privileged": True}},
+                    "volumeConfig": [
+                        {
+                            "name": "drbd-reactor-config",
+                            "mountPath": "/etc/drbd-reactor",
+                            "files": [{"path": "drbd-reactor.toml", "content": reactor_conf}],
+                        },
+                    ],
+                }
+            )
+
         if self.unit.is_leader():
-            self.app.status = model.MaintenanceStatus("Setting pod spec")
-            self.model.pod.set_spec(
+            apply_pod_spec(
+                self,
+                self._stored,
                 spec={
                     "version": 3,
                     "containers": [
@@ -121,35 +383,11 @@ class LinstorSatelliteCharm(charm.CharmBase):
                                 },
                             ],
                             "kubernetes": {"securityContext": {"privileged": True}},
-                            "volumeConfig": [
-                                {
-                                    "name": "device-dir",
-                                    "mountPath": "/dev",
-                                    "hostPath": {"path": "/dev", "type": "Directory"},
-                                },
-                                {
-                                    "name": "sys-dir",
-                                    "mountPath": "/sys",
-                                    "hostPath": {"path": "/sys", "type": "Directory"},
-                                },
-                                {
-                                    "name": "modules-dir",
-                                    "mountPath": "/lib/modules",
-                                    "hostPath": {
-                                        "path": "/lib/modules",
-                                        "type": "Directory",
-                                    },
-                                },
-                            ],
-                        },
-                        {
-                            "name": "drbd-injector",
-                            "init": True,
-                            "imageDetails": drbd_injector_image,
-                            "kubernetes": {"securityContext": {"privileged": True}},
-                            "volumeConfig": injector_volumes,
-                            "envConfig": injector_env,
+                            "envConfig": satellite_env,
+                            "volumeConfig": satellite_volumes,
                         },
+                        injector,
+                        *sidecars,
                     ],
                 },
                 k8s_resources={
@@ -158,132 +396,422 @@ class LinstorSatelliteCharm(charm.CharmBase):
                     },
                 },
             )
+            self._ensure_workload_resources()
             self.app.status = model.ActiveStatus()
 
-        self._ensure_node_registered(event)
-        self._ensure_storage_pools(event)
+        self._reconciled("pod-spec")
+
+        self._update_metrics_endpoint()
+        self._ensure_node_registered()
+        self._ensure_storage_pools()
+        self._ensure_replication_network()
+        self._ensure_drbd_node_options()
+        self._ensure_node_topology()
 
-    def _ensure_node_registered(self, event):
+    def _ensure_node_registered(self):
         """Ensure each unit is registered as a node"""
 
+        if not self._stored.linstor_url:
+            logger.debug("No linstor url set %s", self.unit.name)
+            return
+
         self.unit.status = model.MaintenanceStatus("Updating node registration")
 
         pod = self._get_unit_pod()
         if not pod:
-            logger.debug("could not find pod matching unit %s", self.unit.name)
-            event.defer()
-            return
-
-        if not self._stored.linstor_url:
-            logger.debug("No linstor url set %s", self.unit.name)
-            event.defer()
+            self._retry_later("node-registration", f"could not find pod matching unit {self.unit.name}")
             return
 
         try:
-            with self._linstor_client(self._stored.linstor_url) as client:
-                nodes_resp = client.node_list_raise(
-                    filter_by_nodes=[pod.spec.node_name]
+            nodes_resp = self._list_on_node("node_list_raise", pod.node_name)
+            if len(nodes_resp.nodes) == 0:
+                props = {_REGISTERED_FOR_KEY: self.app.name}
+
+                create_resp = self.linstor.call(
+                    "node_create",
+                    pod.node_name,
+                    linstor.sharedconsts.VAL_NODE_TYPE_STLT,
+                    pod.pod_ip,
+                    property_dict=props,
                 )
-                if len(nodes_resp.nodes) == 0:
-                    props = {
-                        f"{linstor.sharedconsts.NAMESPC_AUXILIARY}/charm/registered-for": self.app.name,
-                    }
-
-                    create_resp = client.node_create(
-                        pod.spec.node_name,
-                        linstor.sharedconsts.VAL_NODE_TYPE_STLT,
-                        pod.status.pod_ip,
-                        property_dict=props,
-                    )
-                    _assert_no_linstor_error(create_resp)
+                self._forget_linstor_lists()
+                _assert_no_linstor_error(create_resp)
         except linstor.errors.LinstorNetworkError:
             self.unit.status = model.MaintenanceStatus(
                 "waiting for controller to come online"
             )
-            event.defer()
+            self._retry_later("node-registration", "controller not online")
             return
-        self.unit.status = model.ActiveStatus()
 
-    def _ensure_storage_pools(self, event):
+        self._reconciled("node-registration")
+        self.unit.status = self._active_status()
+
+    def _ensure_storage_pools(self):
         """Ensure each unit has the configured storage pools available"""
+        if not self._stored.linstor_url:
+            self.unit.status = self._active_status()
+            return
+
+        try:
+            expected_pools = _parse_storage_pool_config(self.config["storage-pools"])
+        except ValueError as e:
+            # Retrying can't help, the next config-changed runs this again.
+            self._reconciled("storage-pools")
+            self.unit.status = model.BlockedStatus(f"invalid storage-pools: {e}")
+            return
+
         self.unit.status = model.MaintenanceStatus("Updating storage pools")
 
+        pod = self._get_unit_pod()
+        if not pod:
+            self._retry_later("storage-pools", f"could not find pod matching unit {self.unit.name}")
+            return
+
+        try:
+            # Both lists are independent, so fetch them at the same time.
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                nodes_future = executor.submit(self._list_on_node, "node_list_raise", pod.node_name)
+                pools_future = executor.submit(self._list_on_node, "storage_pool_list_raise", pod.node_name)
+                nodes = nodes_future.result().nodes
+                actual_pools = pools_future.result().storage_pools
+        except linstor.errors.LinstorNetworkError:
+            self._retry_later("storage-pools", "controller not online")
+            return
+
+        if len(nodes) < 1:
+            self._retry_later("storage-pools", "node not registered")
+            return
+
+        node = nodes[0]
+        if node.connection_status != linstor.sharedconsts.ConnectionStatus.ONLINE.name:
+            self._retry_later("storage-pools", "satellite not online")
+            return
+
+        plan = _plan_storage_pools(expected_pools, actual_pools, self.app.name)
+
+        tasks = {}
+        for pool_name in plan.delete:
+            tasks[pool_name] = (self._delete_storage_pool, pod.node_name, pool_name)
+        for pool in plan.update:
+            tasks[pool.name] = (self._recreate_storage_pool, pod.node_name, pool)
+        for pool in plan.create:
+            tasks[pool.name] = (self._create_storage_pool, pod.node_name, pool)
+        for pool_name, to_set, to_delete in plan.modify:
+            tasks[pool_name] = (self._modify_storage_pool, pod.node_name, pool_name, to_set, to_delete)
+
+        if tasks:
+            try:
+                self._run_storage_pool_tasks(tasks)
+            except linstor.LinstorError as e:
+                self._retry_later("storage-pools", e.message)
+                self.unit.status = model.WaitingStatus(f"{e.message}, retrying")
+                return
+
+        self._reconciled("storage-pools")
+        self.unit.status = self._active_status()
+
+    def _run_storage_pool_tasks(self, tasks: typing.Dict[str, tuple]):
+        """Run independent storage pool operations concurrently, reporting progress in the unit status"""
+        # Pools are created, removed or changed even if some tasks fail.
+        self._forget_linstor_lists()
+        failed = []
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=_MAX_LINSTOR_CONNECTIONS
+        ) as executor:
+            futures = {
+                executor.submit(fn, *args): pool_name
+                for pool_name, (fn, *args) in tasks.items()
+            }
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                pool_name = futures[future]
+                try:
+                    future.result()
+                except linstor.LinstorError as e:
+                    logger.error("failed to update storage pool %s: %s", pool_name, e)
+                    failed.append(pool_name)
+
+                self.unit.status = model.MaintenanceStatus(
+                    f"Updating storage pools ({done}/{len(tasks)})"
+                )
+
+        if failed:
+            raise linstor.LinstorError(f"failed to update storage pools: {', '.join(sorted(failed))}")
+
+    def _create_storage_pool(self, node_name: str, pool: StoragePoolConfig):
+        logger.debug("creating pool %s on node %s", pool.name, node_name)
+        props, _ = plan_props(pool.props or {}, {}, _MANAGED_POOL_PROPS_KEY)
+        props[_REGISTERED_FOR_KEY] = self.app.name
+
+        with self.linstor.client() as client:
+            if pool.devices:
+                resp = client.physical_storage_create_device_pool(
+                    node_name=node_name,
+                    provider_kind=pool.provider,
+                    device_paths=pool.devices,
+                    # Strip slashes from provider pool names, LINSTOR does not expect them here,
+                    # i.e. a LVMTHIN pool with pool name "thinpool" will get an LV "linstor_thinpool/thinpool".
+                    pool_name=pool.provider_name[pool.provider_name.rfind("/") + 1:],
+                    storage_pool_name=pool.name,
+                )
+                _assert_no_linstor_error(resp)
+                resp = client.storage_pool_modify(node_name, pool.name, props)
+            else:
+                resp = client.storage_pool_create(
+                    node_name=node_name,
+                    storage_pool_name=pool.name,
+                    storage_driver=pool.provider,
+                    driver_pool_name=pool.provider_name,
+                    property_dict=props,
+                )
+            _assert_no_linstor_error(resp)
+
+    def _modify_storage_pool(
+        self, node_name: str, pool_name: str, to_set: typing.Dict[str, str], to_delete: typing.List[str]
+    ):
+        logger.debug(
+            "updating properties of pool %s on node %s: set %s, delete %s", pool_name, node_name, to_set, to_delete
+        )
+        with self.linstor.client() as client:
+            resp = client.storage_pool_modify(node_name, pool_name, to_set, delete_props=to_delete)
+            _assert_no_linstor_error(resp)
+
+    def _delete_storage_pool(self, node_name: str, pool_name: str):
+        logger.debug("deleting pool %s on node %s", pool_name, node_name)
+        with self.linstor.client() as client:
+            _assert_no_linstor_error(client.storage_pool_delete(node_name, pool_name))
+
+    def _recreate_storage_pool(self, node_name: str, pool: StoragePoolConfig):
+        logger.warning(
+            "pool %s on node %s does not match its configuration, recreating it",
+            pool.name,
+            node_name,
+        )
+        self._delete_storage_pool(node_name, pool.name)
+        self._create_storage_pool(node_name, pool)
+
+    def _ensure_replication_network(self):
+        """Route DRBD replication of this node over the configured network, by preferring a dedicated net interface"""
         if not self._stored.linstor_url:
-            self.unit.status = model.ActiveStatus()
-            event.defer()
             return
 
         pod = self._get_unit_pod()
         if not pod:
-            logger.debug("could not find pod matching unit %s", self.unit.name)
-            event.defer()
+            self._retry_later("replication-network", f"could not find pod matching unit {self.unit.name}")
             return
 
+        network = self.config["replication-network"]
+        session = self.linstor
         try:
-            with self._linstor_client(self._stored.linstor_url) as client:
-                nodes = client.node_list_raise(
-                    filter_by_nodes=[pod.spec.node_name]
-                ).nodes
-                if len(nodes) < 1:
-                    logger.debug("node not registered")
-                    event.defer()
-                    return
+            nodes = self._list_on_node("node_list_raise", pod.node_name).nodes
+            pools = self._list_on_node("storage_pool_list_raise", pod.node_name).storage_pools
+        except linstor.errors.LinstorNetworkError:
+            self._retry_later("replication-network", "controller not online")
+            return
+
+        if len(nodes) < 1:
+            self._retry_later("replication-network", "node not registered")
+            return
 
-                node = nodes[0]
-                pool_list_response = client.storage_pool_list_raise(
-                    filter_by_nodes=[pod.spec.node_name]
+        node = nodes[0]
+        current = next((nic for nic in node.net_interfaces if nic.name == _REPLICATION_NIC), None)
+
+        address = None
+        if network:
+            try:
+                address = _select_address(self._exec_in_satellite(pod, ["ip", "-o", "addr", "show"]), network)
+            except (kubernetes.client.exceptions.ApiException, subprocess.CalledProcessError) as e:
+                self._retry_later("replication-network", f"could not list addresses of pod {pod.name}: {e}")
+                return
+            except ValueError as e:
+                self.unit.status = model.BlockedStatus(f"invalid config: {e}")
+                return
+
+            if address is None:
+                self.unit.status = model.BlockedStatus(f"no address on node {pod.node_name} matches {network}")
+                return
+
+        pref_nic = _REPLICATION_NIC if address else None
+        key = linstor.sharedconsts.KEY_PREF_NIC
+        try:
+            if address and current is None:
+                logger.info("creating net interface %s at %s on node %s", _REPLICATION_NIC, address, node.name)
+                _assert_no_linstor_error(session.call("netinterface_create", node.name, _REPLICATION_NIC, address))
+            elif address and current.address != address:
+                logger.info("moving net interface %s on node %s to address %s", _REPLICATION_NIC, node.name, address)
+                _assert_no_linstor_error(session.call("netinterface_modify", node.name, _REPLICATION_NIC, ip=address))
+
+            tasks = {}
+            for pool in pools:
+                to_set, to_delete = _plan_pref_nic(pref_nic, pool.properties.get(key))
+                if to_set or to_delete:
+                    tasks[pool.name] = (self._modify_storage_pool, node.name, pool.name, to_set, to_delete)
+            if tasks:
+                self._run_storage_pool_tasks(tasks)
+
+            to_set, to_delete = _plan_pref_nic(pref_nic, node.props.get(key))
+            if to_set or to_delete:
+                logger.info(
+                    "updating preferred net interface of node %s: set %s, delete %s", node.name, to_set, to_delete
+                )
+                _assert_no_linstor_error(
+                    session.call("node_modify", node.name, property_dict=to_set, delete_props=to_delete)
                 )
-                actual_pools = pool_list_response.storage_pools
+
+            if pref_nic is None and current is not None:
+                # Only remove the interface once nothing prefers it anymore
+                logger.info("removing net interface %s from node %s", _REPLICATION_NIC, node.name)
+                _assert_no_linstor_error(session.call("netinterface_delete", node.name, _REPLICATION_NIC))
         except linstor.errors.LinstorNetworkError:
-            logger.debug("Controller not online, postponing storage pool configuration")
-            event.defer()
+            self._retry_later("replication-network", "controller not online")
+            return
+        except linstor.LinstorError as e:
+            self._retry_later("replication-network", str(e))
             return
 
-        if node.connection_status != linstor.sharedconsts.ConnectionStatus.ONLINE.name:
-            logger.debug("Satellite not online, postponing storage pool configuration")
-            event.defer()
+        self._reconciled("replication-network")
+
+    def _ensure_drbd_node_options(self):
+        """Apply the DRBD options overrides matching this node as node properties, only sending changed properties"""
+        if not self._stored.linstor_url:
             return
 
-        expected_pools = _parse_storage_pool_config(self.config["storage-pools"])
+        pod = self._get_unit_pod()
+        if not pod:
+            self._retry_later("drbd-options", f"could not find pod matching unit {self.unit.name}")
+            return
 
-        for expected_pool in expected_pools:
-            if any(expected_pool.name == x.name for x in actual_pools):
-                logger.debug(
-                    "pool %s already exists on node %s, skipping",
-                    expected_pool.name,
-                    pod.spec.node_name,
+        try:
+            desired = _parse_drbd_node_options(self.config["drbd-node-options"], pod.node_name)
+        except ValueError as e:
+            self.unit.status = model.BlockedStatus(f"invalid config: {e}")
+            return
+
+        try:
+            nodes = self._list_on_node("node_list_raise", pod.node_name).nodes
+            if len(nodes) < 1:
+                self._retry_later("drbd-options", "node not registered")
+                return
+
+            to_set, to_delete = plan_props(desired, nodes[0].props, _MANAGED_DRBD_OPTIONS_KEY)
+            if to_set or to_delete:
+                logger.info("updating DRBD options of node %s: set %s, delete %s", pod.node_name, to_set, to_delete)
+                resp = self.linstor.call(
+                    "node_modify", pod.node_name, property_dict=to_set, delete_props=to_delete
                 )
-                continue
+                _assert_no_linstor_error(resp)
+        except linstor.errors.LinstorNetworkError:
+            self._retry_later("drbd-options", "controller not online")
+            return
 
-            with self._linstor_client(self._stored.linstor_url) as client:
-                if expected_pool.devices:
-                    resp = client.physical_storage_create_device_pool(
-                        node_name=pod.spec.node_name,
-                        provider_kind=expected_pool.provider,
-                        device_paths=expected_pool.devices,
-                        # Strip slashes from provider pool names, LINSTOR does not expect them here,
-                        # i.e. a LVMTHIN pool with pool name "thinpool" will get an LV "linstor_thinpool/thinpool".
-                        pool_name=expected_pool.provider_name[
-                            expected_pool.provider_name.rfind("/") + 1:
-                        ],
-                        storage_pool_name=expected_pool.name,
-                    )
-                else:
-                    resp = client.storage_pool_create(
-                        node_name=pod.spec.node_name,
-                        storage_pool_name=expected_pool.name,
-                        storage_driver=expected_pool.provider,
-                        driver_pool_name=expected_pool.provider_name,
-                    )
+        self._reconciled("drbd-options")
+
+    def _ensure_node_topology(self):
+        """Copy the configured labels of the Kubernetes node to Aux properties of the LINSTOR node.
+
+        LINSTOR CSI reports the Aux properties of a node as its topology, so volumes can be placed near their consumers
+        and StorageClasses can spread replicas by zone or rack. Reading Kubernetes nodes requires a trusted charm.
+        Without any labels configured, the Kubernetes node is not read, only labels copied before are removed.
+        """
+        if not self._stored.linstor_url:
+            return
+
+        pod = self._get_unit_pod()
+        if not pod:
+            self._retry_later("topology", f"could not find pod matching unit {self.unit.name}")
+            return
+
+        labels = self.config["topology-labels"].split()
+        desired = {}
+        if labels:
+            try:
+                k8s_node = self.core_v1.read_node(pod.node_name)  # type: kubernetes.client.models.V1Node
+            except kubernetes.client.exceptions.ApiException as e:
+                if e.status == 403:
+                    # Retrying does not help until the operator trusts the charm, which update-status notices.
+                    logger.warning("not allowed to read node %s: %s", pod.node_name, e.reason)
+                    self._reconciled("topology")
+                    self.unit.status = model.BlockedStatus(_TOPOLOGY_UNTRUSTED)
+                    return
+                self._retry_later("topology", f"could not read node {pod.node_name}: {e.reason}")
+                return
+
+            desired = _topology_props(labels, k8s_node.metadata.labels or {})
+
+        try:
+            nodes = self._list_on_node("node_list_raise", pod.node_name).nodes
+            if len(nodes) < 1:
+                self._retry_later("topology", "node not registered")
+                return
+
+            to_set, to_delete = plan_props(desired, nodes[0].props, _MANAGED_TOPOLOGY_KEY)
+            if to_set or to_delete:
+                logger.info("updating topology of node %s: set %s, delete %s", pod.node_name, to_set, to_delete)
+                resp = self.linstor.call(
+                    "node_modify", pod.node_name, property_dict=to_set, delete_props=to_delete
+                )
                 _assert_no_linstor_error(resp)
+        except linstor.errors.LinstorNetworkError:
+            self._retry_later("topology", "controller not online")
+            return
 
-        self.unit.status = model.ActiveStatus()
+        self._reconciled("topology")
+        if self.unit.status == model.BlockedStatus(_TOPOLOGY_UNTRUSTED):
+            self.unit.status = self._active_status()
+
+    def _on_metrics_endpoint_relation_joined(self, _event: charm.RelationJoinedEvent):
+        self._update_metrics_endpoint()
+
+    def _update_metrics_endpoint(self):
+        """Publish the drbd-reactor scrape target of this unit on all metrics-endpoint relations.
+
+        This speaks the prometheus_scrape interface: the application data describes the scrape job, where the "*" host
+        is replaced with the address of every unit. As the pods use the host network, that is the address of the node.
+        """
+        relations = self.model.relations["metrics-endpoint"]
+        if not relations:
+            return
+
+        pod = self._get_unit_pod()
+        if not pod or not pod.pod_ip:
+            self._retry_later("metrics-endpoint", f"could not find address of unit {self.unit.name}")
+            return
+
+        jobs = []
+        if self.config["monitoring"]:
+            jobs.append(
+                {
+                    "metrics_path": "/metrics",
+                    "static_configs": [{"targets": [f"*:{self.config['monitoring-port']}"]}],
+                }
+            )
+
+        for relation in relations:
+            relation.data[self.unit]["prometheus_scrape_unit_address"] = pod.pod_ip
+            relation.data[self.unit]["prometheus_scrape_unit_name"] = self.unit.name
+            if self.unit.is_leader():
+                relation.data[self.app]["scrape_metadata"] = json.dumps(
+                    {
+                        "model": self.model.name,
+                        "model_uuid": self.model.uuid,
+                        "application": self.app.name,
+                        "charm_name": self.meta.name,
+                    }
+                )
+                relation.data[self.app]["scrape_jobs"] = json.dumps(jobs)
+
+        self._reconciled("metrics-endpoint")
 
     def _on_linstor_relation_changed(self, event: charm.RelationChangedEvent):
-        self._stored.linstor_url = event.relation.data[event.app].get("url")
+        endpoints = _parse_linstor_endpoints(event.relation.data[event.app])
+        self._stored.linstor_endpoints = endpoints
+        # linstor_url is the endpoint that worked last, keep it as long as it is still published.
+        if self._stored.linstor_url not in endpoints:
+            self._stored.linstor_url = endpoints[0] if endpoints else None
 
-        self._ensure_node_registered(event)
-        self._ensure_storage_pools(event)
+        self._ensure_node_registered()
+        self._ensure_storage_pools()
+        self._ensure_replication_network()
+        self._ensure_drbd_node_options()
 
     def _on_linstor_relation_broken(self, _event: charm.RelationBrokenEvent):
         if not self._stored.linstor_url:
@@ -294,39 +822,619 @@ class LinstorSatelliteCharm(charm.CharmBase):
             logger.debug("could not find pod matching unit %s", self.unit.name)
             return
 
+        if self.config["evacuate-on-removal"]:
+            self._evacuate_before_removal(pod.node_name)
+
         try:
-            with self._linstor_client(self._stored.linstor_url) as client:
-                logger.debug(
-                    "removing satellite %s from controller", pod.spec.node_name
-                )
-                resp = client.node_delete(pod.spec.node_name)
+            with self.linstor.client() as client:
+                logger.debug("removing satellite %s from controller", pod.node_name)
+                resp = client.node_delete(pod.node_name)
                 _assert_no_linstor_error(resp)
         except linstor.errors.LinstorNetworkError:
             logger.debug(
                 "Controller seems to be down already, skipping unregistering node"
             )
+        except linstor.errors.LinstorError as e:
+            logger.warning("could not remove satellite %s from controller: %s", pod.node_name, e)
 
+        self._forget_controller()
+
+    def _evacuate_before_removal(self, node_name: str):
+        """Move resources off the node before it is removed, for at most evacuation-timeout seconds.
+
+        This runs inside the relation-broken hook, as no later hook is guaranteed when the unit is removed. The node is
+        removed afterwards in any case, so resources that could not be moved lose the replica on this node.
+        """
+        def progress(done, total):
+            self.unit.status = model.MaintenanceStatus(f"Evacuating node ({done}/{total} resources)")
+
+        try:
+            result = self._evacuate_node(node_name, progress)
+        except linstor.errors.LinstorNetworkError:
+            logger.debug("Controller seems to be down already, skipping evacuation")
+            return
+        except linstor.errors.LinstorError as e:
+            logger.warning("evacuation of node %s failed, removing it anyway: %s", node_name, e)
+            return
+
+        if result.failed:
+            logger.warning(
+                "could not evacuate %d resources from node %s, removing it anyway: %s",
+                len(result.failed),
+                node_name,
+                ", ".join(sorted(result.failed)),
+            )
+
+    def _forget_controller(self):
         self._stored.linstor_url = None
+        self._stored.linstor_endpoints = []
+        self._reconciled("node-registration")
+        self._reconciled("storage-pools")
+        self._reconciled("replication-network")
+        self._reconciled("drbd-options")
+
+    def _on_evacuate_action(self, event: charm.ActionEvent):
+        if not self._stored.linstor_url:
+            event.fail("not related to a LINSTOR controller")
+            return
+
+        pod = self._get_unit_pod()
+        if not pod:
+            event.fail(f"could not find pod matching unit {self.unit.name}")
+            return
+
+        start = time.monotonic()
+        try:
+            result = self._evacuate_node(
+                pod.node_name, lambda done, total: event.log(f"evacuated {done}/{total} resources")
+            )
+            if event.params["delete-node"] and not result.failed:
+                event.log(f"removing node {pod.node_name}")
+                _assert_no_linstor_error(self.linstor.call("node_delete", pod.node_name))
+        except linstor.LinstorError as e:
+            event.fail(f"evacuation of node {pod.node_name} failed: {e}")
+            return
+
+        event.set_results(
+            {
+                "node": pod.node_name,
+                "moved": len(result.moved),
+                "failed": json.dumps(result.failed),
+                "seconds": round(time.monotonic() - start),
+            }
+        )
+        if result.failed:
+            event.fail(f"could not evacuate {len(result.failed)} resources: {', '.join(sorted(result.failed))}")
+
+    def _evacuate_node(
+        self, node_name: str, progress: typing.Callable[[int, int], None]
+    ) -> EvacuationResult:
+        """Move all resources off a node, waiting until every resource was moved or failed.
+
+        If the evacuation fails, the node is allowed as target for automatic placement again.
+        """
+        state = self._start_evacuation(node_name)
+        result = None
+        try:
+            while True:
+                result = self._evacuation_pass(state, progress)
+                if result is not None:
+                    return result
+                time.sleep(_EVACUATION_POLL_INTERVAL)
+        finally:
+            if result is None or result.failed:
+                self._restore_autoplace(state)
+
+    def _start_evacuation(self, node_name: str) -> dict:
+        """Keep the auto-placer from putting new replicas on the node, returning the state of a new evacuation"""
+        session = self.linstor
+        nodes = session.call("node_list_raise", filter_by_nodes=[node_name]).nodes
+        autoplace = nodes[0].props.get(linstor.sharedconsts.KEY_AUTOPLACE_ALLOW_TARGET) if nodes else None
+
+        resp = session.call(
+            "node_modify",
+            node_name,
+            property_dict={linstor.sharedconsts.KEY_AUTOPLACE_ALLOW_TARGET: "false"},
+        )
+        _assert_no_linstor_error(resp)
+
+        resources = session.call("resource_list_raise", filter_by_nodes=[node_name]).resources
+        logger.info("evacuating %d resources from node %s", len(resources), node_name)
+        return {
+            "node": node_name,
+            "autoplace": autoplace,
+            "deadline": time.time() + self.config["evacuation-timeout"],
+            "total": len(resources),
+            # Diskful replicas every resource being moved needs outside the node, counted before placing a new one.
+            "required": {},
+            "rate-limited": [],
+            "moved": [],
+            "failed": {},
+        }
+
+    def _evacuation_pass(
+        self, state: dict, progress: typing.Callable[[int, int], None]
+    ) -> typing.Optional[EvacuationResult]:
+        """Advance an evacuation without waiting for any resync, returning the result once it is finished.
+
+        Each resource gets a new replica elsewhere, and the replica on the node is only removed once the new one is
+        UpToDate. Up to evacuation-parallelism resources are moved at the same time, to bound the resync load.
+        """
+        node_name = state["node"]
+        resources = [
+            rsc
+            for rsc in self.linstor.call("resource_list_raise", filter_by_nodes=[node_name]).resources
+            if rsc.name not in state["moved"] and rsc.name not in state["failed"]
+        ]
+        moving = sum(1 for rsc in resources if rsc.name in state["required"])
+        finished = True
+        for rsc in resources:
+            try:
+                if rsc.name in state["required"]:
+                    done = self._finish_moving(state, rsc)
+                elif time.time() > state["deadline"]:
+                    raise TimeoutError(f"evacuation timed out before {rsc.name} was moved")
+                elif _is_diskless(rsc):
+                    # Nothing to move, clients and tie-breakers are placed again by LINSTOR as needed.
+                    _assert_no_linstor_error(self.linstor.call("resource_delete", node_name, rsc.name))
+                    done = True
+                elif moving < self.config["evacuation-parallelism"]:
+                    self._start_moving(state, rsc)
+                    moving += 1
+                    done = False
+                else:
+                    done = False
+            except (linstor.LinstorError, TimeoutError) as e:
+                logger.error("failed to evacuate resource %s from node %s: %s", rsc.name, node_name, e)
+                state["failed"][rsc.name] = str(e)
+                try:
+                    self._remove_rate_limit(state, rsc.name)
+                except linstor.LinstorError as cleanup_error:
+                    logger.warning("could not remove resync rate limit of %s: %s", rsc.name, cleanup_error)
+                continue
+
+            if done:
+                state["moved"].append(rsc.name)
+            else:
+                finished = False
+
+        progress(len(state["moved"]) + len(state["failed"]), state["total"])
+        if not finished:
+            return None
+
+        return EvacuationResult(sorted(state["moved"]), dict(state["failed"]))
+
+    def _start_moving(self, state: dict, rsc: linstor.responses.Resource):
+        session = self.linstor
+        replicas = session.call("resource_list_raise", filter_by_resources=[rsc.name]).resources
+        required = sum(1 for replica in replicas if not _is_diskless(replica))
+        state["required"][rsc.name] = required
+
+        max_rate = self.config["evacuation-max-rate"]
+        if max_rate:
+            definitions = session.call(
+                "resource_dfn_list_raise", query_volume_definitions=False, filter_by_resource_definitions=[rsc.name]
+            ).resource_definitions
+            # Don't override (and later remove) a resync rate configured for the resource itself.
+            if not any(_C_MAX_RATE_KEY in rd.properties for rd in definitions):
+                _assert_no_linstor_error(session.call("resource_dfn_modify", rsc.name, {_C_MAX_RATE_KEY: max_rate}))
+                state["rate-limited"].append(rsc.name)
+
+        if _count_replicas_elsewhere(replicas, state["node"]) < required:
+            resp = session.call("resource_auto_place", rsc.name, None, additional_place_count=1)
+            _assert_no_linstor_error(resp)
+
+    def _finish_moving(self, state: dict, rsc: linstor.responses.Resource) -> bool:
+        """Remove the replica from the node once the new one is synced, returning whether the resource was moved"""
+        node_name = state["node"]
+        replicas = self.linstor.call("resource_list_raise", filter_by_resources=[rsc.name]).resources
+        if not _replicas_up_to_date(replicas, node_name, state["required"][rsc.name]):
+            if time.time() > state["deadline"]:
+                raise TimeoutError(f"new replica of {rsc.name} did not finish syncing in time")
+            return False
+
+        logger.debug("removing replica of %s from node %s", rsc.name, node_name)
+        _assert_no_linstor_error(self.linstor.call("resource_delete", node_name, rsc.name))
+        self._remove_rate_limit(state, rsc.name)
+        return True
+
+    def _remove_rate_limit(self, state: dict, name: str):
+        if name in state["rate-limited"]:
+            resp = self.linstor.call("resource_dfn_modify", name, {}, delete_props=[_C_MAX_RATE_KEY])
+            _assert_no_linstor_error(resp)
+            state["rate-limited"].remove(name)
+
+    def _restore_autoplace(self, state: dict):
+        """Allow the node as placement target again, as it was before the evacuation started"""
+        key = linstor.sharedconsts.KEY_AUTOPLACE_ALLOW_TARGET
+        try:
+            if state["autoplace"] is None:
+                resp = self.linstor.call("node_modify", state["node"], delete_props=[key])
+            else:
+                resp = self.linstor.call("node_modify", state["node"], property_dict={key: state["autoplace"]})
+            _assert_no_linstor_error(resp)
+        except linstor.LinstorError as e:
+            logger.warning("could not restore %s of node %s: %s", key, state["node"], e)
+
+    def _on_leader_elected(self, _event: charm.LeaderElectedEvent):
+        forget_pod_spec(self._stored)
+        # The scrape job is published in the application data, which only the leader can write.
+        self._update_metrics_endpoint()
+
+    def _on_update_status(self, event: charm.UpdateStatusEvent):
+        """Run pending reconcile steps whose backoff delay has passed"""
+        steps = [
+            ("pod-spec", lambda: self._set_pod_spec(event)),
+            ("workload-resources", self._ensure_workload_resources),
+            ("metrics-endpoint", self._update_metrics_endpoint),
+            ("node-registration", self._ensure_node_registered),
+            ("storage-pools", self._ensure_storage_pools),
+            ("replication-network", self._ensure_replication_network),
+            ("drbd-options", self._ensure_drbd_node_options),
+            ("topology", self._ensure_node_topology),
+        ]
+
+        ran = run_due_steps(self._stored.pending, steps)
+
+        if "workload-resources" not in ran and "workload-resources" not in self._stored.pending:
+            # The patch is only dropped once Juju applied a new pod spec, after the hook that set it.
+            run_step(self._stored.pending, "workload-resources", self._ensure_workload_resources)
+
+        if "topology" not in ran and "topology" not in self._stored.pending:
+            # Node labels change without any hook, so keep following them.
+            run_step(self._stored.pending, "topology", self._ensure_node_topology)
 
-    def _get_unit_pod(self) -> typing.Optional[kubernetes.client.models.V1Pod]:
-        core_v1 = _core_v1_api()
-        pods = core_v1.list_namespaced_pod(
+        self._report_module_load()
+
+    def _injection_mode(self) -> str:
+        mode = self.config["injection-mode"]
+        if mode == "auto" and not self.model.resources.fetch("pull-secret").read_bytes():
+            mode = "compile"
+        return mode
+
+    def _report_module_load(self):
+        """Record whether the DRBD injector of the current pod could use the module cache, once per pod"""
+        if self._injection_mode() != "compile" or not self.config["module-cache-path"]:
+            return
+
+        pod = self._get_unit_pod()
+        if not pod:
+            return
+
+        if self._stored.module_load and self._stored.module_load["pod-uid"] == pod.uid:
+            return
+
+        try:
+            log = self.core_v1.read_namespaced_pod_log(pod.name, self.model.name, container="drbd-injector")
+        except kubernetes.client.exceptions.ApiException as e:
+            if e.status in (400, 404):
+                logger.debug("injector log of pod %s not available yet: %s", pod.name, e.reason)
+                return
+            raise
+
+        report = _parse_module_cache_report(log)
+        if report is None:
+            logger.debug("no module cache report in injector log of pod %s", pod.name)
+            return
+
+        self._stored.module_load = {"pod-uid": pod.uid, **report}
+        logger.info(
+            "DRBD module cache %s for kernel %s, injector %s: modules ready after %ds",
+            report["result"],
+            report["kernel"],
+            report["drbd"],
+            report["seconds"],
+        )
+        if isinstance(self.unit.status, model.ActiveStatus):
+            self.unit.status = self._active_status()
+
+    def _active_status(self) -> model.ActiveStatus:
+        load = self._stored.module_load
+        if not load:
+            return model.ActiveStatus()
+
+        messages = {
+            "hit": "DRBD module loaded from cache in {}s",
+            "miss": "DRBD module built in {}s (cache miss)",
+            "loaded": "DRBD module already loaded",
+        }
+        return model.ActiveStatus(messages[load["result"]].format(load["seconds"]))
+
+    def _on_purge_module_cache_action(self, event: charm.ActionEvent):
+        if not self.config["module-cache-path"]:
+            event.fail("the module cache is disabled")
+            return
+
+        kernel = event.params.get("kernel-release", "")
+        if "/" in kernel or kernel in (".", ".."):
+            event.fail(f"invalid kernel release '{kernel}'")
+            return
+
+        pod = self._get_unit_pod()
+        if not pod:
+            event.fail(f"could not find pod matching unit {self.unit.name}")
+            return
+
+        if kernel:
+            command = ["rm", "-rfv", f"{_MODULE_CACHE_MOUNT}/{kernel}"]
+        else:
+            command = ["find", _MODULE_CACHE_MOUNT, "-mindepth", "1", "-delete", "-print"]
+
+        try:
+            removed = self._exec_in_satellite(pod, command).splitlines()
+        except subprocess.CalledProcessError as e:
+            event.fail(f"purging the module cache failed: {e.stderr}")
+            return
+
+        logger.info("purged %d entries from the DRBD module cache on node %s", len(removed), pod.node_name)
+        event.set_results({"node": pod.node_name, "removed": len(removed)})
+
+    def _on_benchmark_pool_action(self, event: charm.ActionEvent):
+        pool = event.params["pool"]
+        profile = event.params["profile"]
+        if profile not in _BENCHMARK_PROFILES:
+            event.fail(f"unknown profile '{profile}', must be one of: {', '.join(_BENCHMARK_PROFILES)}")
+            return
+
+        if not self._stored.linstor_url:
+            event.fail("not related to a LINSTOR controller")
+            return
+
+        pod = self._get_unit_pod()
+        if not pod:
+            event.fail(f"could not find pod matching unit {self.unit.name}")
+            return
+
+        try:
+            self._exec_in_satellite(pod, ["fio", "--version"])
+        except (kubernetes.client.exceptions.ApiException, subprocess.CalledProcessError) as e:
+            event.fail(
+                "fio is not available in the linstor-satellite container, use an image that includes it: "
+                f"{getattr(e, 'stderr', None) or e}"
+            )
+            return
+
+        resource = f"charm-benchmark-{secrets.token_hex(4)}"
+        rw, block_size = _BENCHMARK_PROFILES[profile]
+        try:
+            with self.linstor.client() as client:
+                event.log(f"creating volume {resource} in pool {pool} on node {pod.node_name}")
+                # Only the storage layer, so the pool itself is measured, not DRBD replication.
+                _assert_no_linstor_error(client.resource_dfn_create(resource, layer_list=["storage"]))
+                try:
+                    _assert_no_linstor_error(client.volume_dfn_create(resource, event.params["size-mib"] * 1024))
+                    _assert_no_linstor_error(
+                        client.resource_create(
+                            [linstor.ResourceData(pod.node_name, resource, storage_pool=pool, layer_list=["storage"])]
+                        )
+                    )
+                    volumes = client.volume_list_raise(filter_by_nodes=[pod.node_name], filter_by_resources=[resource])
+                    device = volumes.resources[0].volumes[0].device_path
+
+                    event.log(f"running fio {profile} with iodepth {event.params['iodepth']} on {device}")
+                    output = self._exec_in_satellite(
+                        pod,
+                        [
+                            "fio",
+                            "--name=benchmark",
+                            f"--filename={device}",
+                            "--direct=1",
+                            "--ioengine=libaio",
+                            f"--rw={rw}",
+                            f"--bs={block_size}",
+                            f"--iodepth={event.params['iodepth']}",
+                            f"--numjobs={event.params['numjobs']}",
+                            f"--runtime={event.params['runtime']}",
+                            "--time_based",
+                            "--group_reporting",
+                            "--output-format=json",
+                        ],
+                        timeout=event.params["runtime"] + 120,
+                    )
+                finally:
+                    self._remove_benchmark_volume(event, client, resource)
+        except (linstor.LinstorError, kubernetes.client.exceptions.ApiException, subprocess.CalledProcessError) as e:
+            event.fail(f"benchmark of pool {pool} failed: {getattr(e, 'stderr', None) or e}")
+            return
+
+        results = _summarize_fio(output, "read" if "read" in rw else "write")
+        logger.info("benchmark %s of pool %s on node %s: %s", profile, pool, pod.node_name, results)
+        event.set_results({"node": pod.node_name, "pool": pool, "profile": profile, **results})
+
+    def _remove_benchmark_volume(self, event: charm.ActionEvent, client: linstor.Linstor, resource: str):
+        """Remove the volume of a benchmark, without hiding the error that ended the benchmark"""
+        event.log(f"removing volume {resource}")
+        try:
+            _assert_no_linstor_error(client.resource_dfn_delete(resource))
+        except linstor.LinstorError as e:
+            logger.warning("could not remove benchmark volume %s: %s", resource, e)
+            event.log(f"could not remove volume {resource}, delete it manually: {e}")
+
+    def _exec_in_satellite(self, pod: UnitPod, command: typing.List[str], timeout: int = 60) -> str:
+        """Run a command in the satellite container of the given pod and return its output"""
+        resp = kubernetes.stream.stream(
+            self.core_v1.connect_get_namespaced_pod_exec,
+            pod.name,
+            self.model.name,
+            container="linstor-satellite",
+            command=command,
+            stderr=True,
+            stdin=False,
+            stdout=True,
+            tty=False,
+            _preload_content=False,
+        )
+        resp.run_forever(timeout=timeout)
+        if resp.returncode != 0:
+            raise subprocess.CalledProcessError(resp.returncode, command, resp.read_stdout(), resp.read_stderr())
+
+        return resp.read_stdout()
+
+    def _retry_later(self, name: str, reason: str):
+        retry_later(self._stored.pending, name, reason)
+
+    def _reconciled(self, name: str):
+        reconciled(self._stored.pending, name)
+
+    def _ensure_workload_resources(self):
+        """Apply the configured resource requirements to the satellite DaemonSet.
+
+        Pod spec v3 has no field for container resources, so they are patched onto the DaemonSet created by Juju. Juju
+        drops them when it applies a new pod spec, so update-status checks them again. With guaranteed-qos, the
+        resources apply to the DRBD injector and drbd-reactor as well, as the pod is only Guaranteed if every container
+        is.
+        """
+        if not self.unit.is_leader():
+            return
+
+        try:
+            resources = container_resources(self.config)
+        except ValueError:
+            # Already reported by _set_pod_spec
+            return
+
+        if not ensure_workload_resources(
+            self.apps_v1,
+            "DaemonSet",
+            self.app.name,
+            self.model.name,
+            None if self.config["guaranteed-qos"] else "linstor-satellite",
+            resources,
+        ):
+            self._retry_later("workload-resources", "daemonset not created yet")
+            return
+
+        self._reconciled("workload-resources")
+
+    def _list_on_node(self, method: str, node_name: str):
+        """Call a LINSTOR list method filtered to one node, at most once per hook.
+
+        Most hooks run several reconcile steps, each of which needs the node or its storage pools. The steps only
+        change properties they manage themselves, so one listing serves all of them. Steps that create nodes or change
+        storage pools call _forget_linstor_lists(), so later steps see the result.
+        """
+        key = (method, node_name)
+        if key not in self._linstor_lists:
+            self._linstor_lists[key] = self.linstor.call(method, filter_by_nodes=[node_name])
+        return self._linstor_lists[key]
+
+    def _forget_linstor_lists(self):
+        self._linstor_lists.clear()
+
+    def _get_unit_pod(self) -> typing.Optional[UnitPod]:
+        """Return the pod running this unit, resolving it at most once per hook"""
+        if self._unit_pod is None:
+            self._unit_pod = self._resolve_unit_pod()
+        return self._unit_pod
+
+    def _resolve_unit_pod(self) -> typing.Optional[UnitPod]:
+        pod = None
+        if self._stored.pod_name:
+            pod = self._read_pod(self._stored.pod_name)
+
+        if pod is None:
+            pod = self._find_unit_pod()
+
+        if pod is None:
+            return None
+
+        if pod.metadata.uid != self._stored.pod_uid:
+            logger.debug(
+                "pod for unit %s changed to %s (%s), refreshing cache",
+                self.unit.name,
+                pod.metadata.name,
+                pod.metadata.uid,
+            )
+            self._stored.pod_name = pod.metadata.name
+            self._stored.pod_uid = pod.metadata.uid
+            self._stored.node_name = pod.spec.node_name
+            self._stored.pod_ip = pod.status.pod_ip
+        else:
+            # Node and IP are only assigned once the pod is scheduled, so they may be missing from an earlier lookup.
+            self._stored.node_name = self._stored.node_name or pod.spec.node_name
+            self._stored.pod_ip = self._stored.pod_ip or pod.status.pod_ip
+
+        if not self._stored.node_name:
+            logger.debug("pod %s is not scheduled yet", self._stored.pod_name)
+            return None
+
+        return UnitPod(
+            self._stored.pod_name,
+            self._stored.pod_uid,
+            self._stored.node_name,
+            self._stored.pod_ip,
+        )
+
+    def _read_pod(self, name: str) -> typing.Optional[kubernetes.client.models.V1Pod]:
+        """Fetch a single pod by name, returning None if it no longer belongs to this unit"""
+        try:
+            pod = self.core_v1.read_namespaced_pod(name, self.model.name)  # type: kubernetes.client.models.V1Pod
+        except kubernetes.client.exceptions.ApiException as e:
+            if e.status == 404:
+                logger.debug("cached pod %s no longer exists", name)
+                return None
+            raise
+
+        if (pod.metadata.annotations or {}).get(_UNIT_ANNOTATION) != self.unit.name:
+            logger.debug("cached pod %s belongs to a different unit", name)
+            return None
+
+        return pod
+
+    def _find_unit_pod(self) -> typing.Optional[kubernetes.client.models.V1Pod]:
+        """Search all pods of the application for the one running this unit"""
+        pods = self.core_v1.list_namespaced_pod(
             self.model.name, label_selector=f"app.kubernetes.io/name={self.app.name}"
         )  # type: kubernetes.client.models.V1PodList
 
-        logger.debug("Found pods %r", pods.items)
-
         pod: kubernetes.client.models.V1Pod
         for pod in pods.items:
-            if pod.metadata.annotations.get("unit.juju.is/id") == self.unit.name:
+            if (pod.metadata.annotations or {}).get(_UNIT_ANNOTATION) == self.unit.name:
                 return pod
 
         return None
 
+    @property
+    def core_v1(self) -> kubernetes.client.CoreV1Api:
+        """Kubernetes API client, shared by all calls in this hook"""
+        if self._core_v1 is None:
+            self._core_v1 = _core_v1_api()
+        return self._core_v1
+
+    @property
+    def apps_v1(self) -> kubernetes.client.AppsV1Api:
+        if self._apps_v1 is None:
+            self._apps_v1 = _apps_v1_api()
+        return self._apps_v1
+
+    @property
+    def linstor(self) -> "LinstorSession":
+        """LINSTOR connections to the related controller, shared by all calls in this hook"""
+        endpoints = tuple(self._stored.linstor_endpoints) or (self._stored.linstor_url,)
+        if self._linstor_session is None or self._linstor_session.urls != endpoints:
+            self._close_linstor_session(None)
+            self._linstor_session = LinstorSession(
+                endpoints,
+                self._linstor_client,
+                preferred=self._stored.linstor_url,
+                on_healthy=self._remember_linstor_endpoint,
+            )
+        return self._linstor_session
+
+    def _remember_linstor_endpoint(self, url: str):
+        logger.info("using LINSTOR API endpoint %s", url)
+        self._stored.linstor_url = url
+
+    def _close_linstor_session(self, _event):
+        if self._linstor_session is not None:
+            self._linstor_session.close()
+            self._linstor_session = None
+
     def _linstor_client(self, url):
         return linstor.Linstor(
             url,
             timeout=60,
+            keep_alive=True,
             agent_info=f"charm-operator/{self.meta.name}/{__version__}",
         )
 
@@ -355,7 +1463,160 @@ class LinstorSatelliteCharm(charm.CharmBase):
             return {"imagePath": _DEFAULTS[name]["piraeus"]}
 
 
+class LinstorSession:
+    """A small pool of keep-alive connections to a LINSTOR Controller.
+
+    Connections are only opened when needed and are reused for the rest of the hook. At most
+    max_connections are open at the same time, so independent requests can run in parallel.
+
+    New connections go to the endpoint that worked last. If it can't be reached within a short
+    timeout, the other endpoints are tried in turn, and the first one that works is remembered.
+    """
+
+    def __init__(
+        self,
+        urls: typing.Sequence[str],
+        factory: typing.Callable[[str], linstor.Linstor],
+        max_connections: int = _MAX_LINSTOR_CONNECTIONS,
+        preferred: typing.Optional[str] = None,
+        on_healthy: typing.Optional[typing.Callable[[str], None]] = None,
+        probe: typing.Optional[typing.Callable[[str, float], bool]] = None,
+    ):
+        self.urls = tuple(urls)
+        self.healthy = preferred
+        self._factory = factory
+        self._on_healthy = on_healthy
+        self._probe = probe or _probe_endpoint
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._idle = []  # type: typing.List[linstor.Linstor]
+        self._all = []  # type: typing.List[linstor.Linstor]
+
+    @contextlib.contextmanager
+    def client(self) -> typing.Iterator[linstor.Linstor]:
+        with self._slots:
+            with self._lock:
+                client = self._idle.pop() if self._idle else None
+
+            if client is None:
+                client = self._connect()
+                with self._lock:
+                    self._all.append(client)
+
+            broken = False
+            try:
+                yield client
+            except linstor.errors.LinstorNetworkError:
+                broken = True
+                raise
+            finally:
+                with self._lock:
+                    if broken:
+                        # Don't hand out a connection in unknown state again
+                        self._all.remove(client)
+                        client.disconnect()
+                    else:
+                        self._idle.append(client)
+
+    def _connect(self) -> linstor.Linstor:
+        errors = []
+        for url in sorted(self.urls, key=lambda u: u != self.healthy):
+            if not self._probe(url, _LINSTOR_CONNECT_TIMEOUT):
+                errors.append(f"{url}: not reachable")
+                continue
+
+            client = self._factory(url)
+            try:
+                client.connect()
+            except linstor.errors.LinstorNetworkError as e:
+                errors.append(f"{url}: {e}")
+                continue
+
+            if url != self.healthy:
+                self.healthy = url
+                if self._on_healthy:
+                    self._on_healthy(url)
+            return client
+
+        raise linstor.errors.LinstorNetworkError(f"no LINSTOR API endpoint reachable: {'; '.join(errors)}")
+
+    def call(self, method: str, *args, **kwargs):
+        """Run a single LINSTOR API method on one of the pooled connections"""
+        with self.client() as client:
+            return getattr(client, method)(*args, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for client in self._all:
+                client.disconnect()
+            self._all.clear()
+            self._idle.clear()
+
+
+def _probe_endpoint(url: str, timeout: float) -> bool:
+    """Check that a TCP connection to the endpoint can be opened within the timeout"""
+    parsed = urllib.parse.urlparse(url)
+    try:
+        with socket.create_connection((parsed.hostname, parsed.port or linstor.Linstor.REST_PORT), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _parse_linstor_endpoints(data: typing.Mapping[str, str]) -> typing.List[str]:
+    """Read the LINSTOR API endpoints from the relation data, falling back to the single url of older controllers"""
+    try:
+        endpoints = json.loads(data.get("endpoints") or "[]")
+    except json.JSONDecodeError:
+        endpoints = []
+    if isinstance(endpoints, list) and endpoints:
+        return [str(e) for e in endpoints]
+    return [data["url"]] if data.get("url") else []
+
+
+def _module_cache_key(image: str) -> typing.Optional[str]:
+    """Return a key to tell modules built by different injector images apart, None if the image can't be told apart.
+
+    A digest identifies the image exactly. Otherwise the key is the image reference, which is only stable for version
+    tags, so images without a tag or tagged "latest" are not cached. The wrapper still has the injector check cached
+    modules, in case a version tag was moved.
+    """
+    name, _, digest = image.partition("@")
+    if digest:
+        return digest.replace(":", "-")
+
+    # A colon before the last slash separates a registry port, not a tag.
+    repository = name[name.rfind("/") + 1:]
+    _, _, tag = repository.partition(":")
+    if tag in ("", "latest"):
+        return None
+    return re.sub(r"[^A-Za-z0-9._-]", "_", name)
+
+
+def _parse_module_cache_report(log: str) -> typing.Optional[dict]:
+    """Find the outcome of the module cache lookup in the DRBD injector log"""
+    matches = _MODULE_CACHE_REPORT_RE.findall(log)
+    if not matches:
+        return None
+
+    result, kernel, drbd, seconds = matches[-1]
+    return {"result": result, "kernel": kernel, "drbd": drbd, "seconds": int(seconds)}
+
+
 def _parse_storage_pool_config(conf_str: str) -> typing.List[StoragePoolConfig]:
+    """Parse the storage pool config.
+
+    The config is either a YAML (or JSON) list of pools, or the older format of space-separated key-value lists.
+    """
+    try:
+        conf = yaml.safe_load(conf_str)
+    except yaml.YAMLError:
+        # The older format is not always valid YAML, i.e. if a value contains ": "
+        conf = None
+
+    if isinstance(conf, list):
+        return [_parse_storage_pool_entry(entry) for entry in conf]
+
     pools = conf_str.split()
 
     result = []
@@ -371,9 +1632,9 @@ def _parse_storage_pool_config(conf_str: str) -> typing.List[StoragePoolConfig]:
 
         for part in parts:
             key, val = part.split("=", 1)
-            if key not in StoragePoolConfig._fields:
+            if key not in StoragePoolConfig._fields or key == "props":
                 raise ValueError(
-                    f"unknown key {key}, must be one of: {StoragePoolConfig._fields}"
+                    f"unknown key {key}, must be one of: {StoragePoolConfig._fields[:-1]}"
                 )
 
             if key == "devices":
@@ -392,12 +1653,216 @@ def _parse_storage_pool_config(conf_str: str) -> typing.List[StoragePoolConfig]:
                 pool["provider"],
                 pool["provider_name"],
                 pool["devices"],
+                {},
             )
         )
 
     return result
 
 
+def _parse_storage_pool_entry(entry: typing.Any) -> StoragePoolConfig:
+    if not isinstance(entry, dict):
+        raise ValueError(f"pool config {entry} must be a mapping")
+
+    unknown = entry.keys() - set(StoragePoolConfig._fields)
+    if unknown:
+        raise ValueError(f"unknown keys {sorted(unknown)}, must be one of: {StoragePoolConfig._fields}")
+    if not entry.get("name"):
+        raise ValueError(f"pool config {entry} is missing a name")
+    if not entry.get("provider"):
+        raise ValueError(f"pool config {entry} is missing a provider")
+
+    devices = entry.get("devices") or []
+    if isinstance(devices, str):
+        devices = [devices]
+
+    props = entry.get("props") or {}
+    if not isinstance(props, dict):
+        raise ValueError(f"props of pool {entry['name']} must be a mapping")
+    for key, value in props.items():
+        if isinstance(value, (dict, list)) or value is None:
+            raise ValueError(f"property {key} of pool {entry['name']} must be a single value")
+
+    return StoragePoolConfig(
+        str(entry["name"]),
+        str(entry["provider"]),
+        entry.get("provider_name"),
+        [str(device) for device in devices],
+        {str(key): str(value) for key, value in props.items()},
+    )
+
+
+def _plan_storage_pools(
+    expected: typing.List[StoragePoolConfig],
+    actual: typing.List[linstor.responses.StoragePool],
+    owner: str,
+) -> StoragePoolPlan:
+    """Compute the changes needed to turn the actual storage pools into the expected ones.
+
+    Only pools registered for the owner application are ever deleted, so pools created by hand or by LINSTOR itself
+    (like the default diskless pool) are left alone. Pools that can stay in place get their properties updated.
+    """
+    actual_by_name = {pool.name: pool for pool in actual}
+
+    create = []
+    update = []
+    modify = []
+    for pool in expected:
+        current = actual_by_name.pop(pool.name, None)
+        if current is None:
+            create.append(pool)
+        elif not _storage_pool_matches(pool, current):
+            update.append(pool)
+        else:
+            to_set, to_delete = plan_props(pool.props or {}, current.properties, _MANAGED_POOL_PROPS_KEY)
+            if to_set or to_delete:
+                modify.append((pool.name, to_set, to_delete))
+
+    delete = [
+        name
+        for name, pool in actual_by_name.items()
+        if pool.properties.get(_REGISTERED_FOR_KEY) == owner
+    ]
+
+    return StoragePoolPlan(create, update, delete, modify)
+
+
+def _storage_pool_matches(
+    expected: StoragePoolConfig, actual: linstor.responses.StoragePool
+) -> bool:
+    def normalize_provider(provider):
+        return provider.upper().replace("_", "")
+
+    if normalize_provider(expected.provider) != normalize_provider(actual.provider_kind):
+        return False
+
+    if expected.devices:
+        # LINSTOR derives the provider name of pools it creates from devices itself.
+        return True
+
+    actual_provider_name = actual.properties.get(
+        f"{linstor.sharedconsts.NAMESPC_STORAGE_DRIVER}/{linstor.sharedconsts.KEY_STOR_POOL_NAME}"
+    )
+    return (expected.provider_name or None) == (actual_provider_name or None)
+
+
+def _select_address(ip_output: str, network: str) -> typing.Optional[str]:
+    """Select the address to use for a network, given by CIDR or interface name, from "ip -o addr show" output.
+
+    IPv4 addresses are preferred over IPv6 addresses, link-local addresses are never used.
+    """
+    try:
+        cidr = ipaddress.ip_network(network, strict=False)
+    except ValueError:
+        cidr = None
+        if "/" in network:
+            raise ValueError(f"replication-network: '{network}' is neither a CIDR network nor an interface name")
+
+    candidates = []
+    for interface, address, scope in _IP_ADDR_RE.findall(ip_output):
+        if scope in ("link", "host"):
+            continue
+        ip = ipaddress.ip_address(address)
+        if (cidr is not None and ip in cidr) or (cidr is None and interface == network):
+            candidates.append(ip)
+
+    if not candidates:
+        return None
+
+    return str(min(candidates, key=lambda ip: ip.version))
+
+
+def _plan_pref_nic(
+    pref_nic: typing.Optional[str], current: typing.Optional[str]
+) -> typing.Tuple[typing.Dict[str, str], typing.List[str]]:
+    """Compute the property changes to prefer the given net interface, or to stop preferring the charm's interface"""
+    key = linstor.sharedconsts.KEY_PREF_NIC
+    if pref_nic is not None:
+        return ({key: pref_nic}, []) if current != pref_nic else ({}, [])
+
+    # Only undo a preference the charm set itself
+    return ({}, [key]) if current == _REPLICATION_NIC else ({}, [])
+
+
+def _is_diskless(rsc: linstor.responses.Resource) -> bool:
+    return bool(_DISKLESS_FLAGS.intersection(rsc.flags))
+
+
+def _count_replicas_elsewhere(replicas: typing.List[linstor.responses.Resource], node_name: str) -> int:
+    return sum(1 for replica in replicas if replica.node_name != node_name and not _is_diskless(replica))
+
+
+def _replicas_up_to_date(replicas: typing.List[linstor.responses.Resource], node_name: str, required: int) -> bool:
+    """Check if enough diskful replicas outside the given node exist, all of them fully synced"""
+    others = [replica for replica in replicas if replica.node_name != node_name and not _is_diskless(replica)]
+    if len(others) < required:
+        return False
+
+    return all(volume.state.disk_state == "UpToDate" for replica in others for volume in replica.volumes)
+
+
+def _summarize_fio(output: str, direction: str) -> dict:
+    """Extract IOPS, bandwidth and latency percentiles of one direction from fio JSON output"""
+    job = json.loads(output)["jobs"][0][direction]
+    percentiles = job.get("clat_ns", {}).get("percentile", {})
+
+    def latency_us(key):
+        return round(percentiles.get(key, 0) / 1000, 1)
+
+    return {
+        "iops": round(job["iops"]),
+        "bandwidth-mib": round(job["bw"] / 1024, 1),
+        "latency-mean-us": round(job.get("lat_ns", {}).get("mean", 0) / 1000, 1),
+        "latency-p50-us": latency_us("50.000000"),
+        "latency-p99-us": latency_us("99.000000"),
+        "latency-p99-9-us": latency_us("99.900000"),
+    }
+
+
+def _parse_drbd_node_options(conf_str: str, node_name: str) -> typing.Dict[str, str]:
+    """Parse the per-node DRBD options config into the LINSTOR properties for the given node.
+
+    The config is a YAML mapping from node name pattern to DRBD configuration sections, i.e.:
+
+        "storage-fast-*":
+          net:
+            max-buffers: 36864
+        storage-slow-1:
+          peer-device:
+            c-max-rate: 250M
+
+    If multiple patterns match a node, options from later patterns take precedence.
+    """
+    try:
+        conf = yaml.safe_load(conf_str) if conf_str.strip() else None
+    except yaml.YAMLError as e:
+        raise ValueError(f"drbd-node-options: invalid YAML: {e}")
+    if conf is None:
+        return {}
+    if not isinstance(conf, dict):
+        raise ValueError("drbd-node-options: expected a mapping of node name patterns to DRBD options")
+
+    result = {}
+    for pattern, sections in conf.items():
+        # Validate all entries, not just the ones matching this node, so every unit reports errors the same way.
+        props = drbd_option_props(f"drbd-node-options: {pattern}", sections)
+        if fnmatch.fnmatchcase(node_name, str(pattern)):
+            result.update(props)
+
+    return result
+
+
+def _topology_props(labels: typing.List[str], node_labels: typing.Dict[str, str]) -> typing.Dict[str, str]:
+    """Map the selected Kubernetes node labels to Aux properties, i.e. topology.kubernetes.io/zone=a to
+    Aux/topology.kubernetes.io/zone=a. Labels missing on the node are skipped.
+    """
+    return {
+        f"{linstor.sharedconsts.NAMESPC_AUXILIARY}/{label}": node_labels[label]
+        for label in labels
+        if label in node_labels
+    }
+
+
 def _assert_no_linstor_error(response: typing.List[linstor.ApiCallResponse]):
     if not linstor.Linstor.all_api_responses_no_error(response):
         raise linstor.LinstorError(f"got failure response from Linstor {response}")
@@ -408,5 +1873,10 @@ def _core_v1_api() -> kubernetes.client.CoreV1Api:
     return kubernetes.client.CoreV1Api()
 
 
+def _apps_v1_api() -> kubernetes.client.AppsV1Api:
+    kubernetes.config.load_incluster_config()
+    return kubernetes.client.AppsV1Api()
+
+
 if __name__ == "__main__":
     main.main(LinstorSatelliteCharm)
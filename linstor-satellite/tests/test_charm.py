@@ -3,9 +3,33 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
+import json
+import subprocess
+import time
 import unittest
+from unittest import mock
 
-from charm import _parse_storage_pool_config, StoragePoolConfig
+import kubernetes
+import linstor
+from charm import (
+    _module_cache_key,
+    _parse_drbd_node_options,
+    _parse_linstor_endpoints,
+    _parse_module_cache_report,
+    _parse_storage_pool_config,
+    _plan_storage_pools,
+    _select_address,
+    _summarize_fio,
+    _topology_props,
+    EvacuationResult,
+    LinstorSatelliteCharm,
+    LinstorSession,
+    StoragePoolConfig,
+    StoragePoolPlan,
+    UnitPod,
+)
+from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
+from ops.testing import Harness
 
 
 class TestCharmHelpers(unittest.TestCase):
@@ -18,15 +42,41 @@ class TestCharmHelpers(unittest.TestCase):
             {
                 "conf": "provider=lvmthin,provider_name=storage/thinpool,name=thinpool",
                 "expected": [
-                    StoragePoolConfig("thinpool", "lvmthin", "storage/thinpool", [])
+                    StoragePoolConfig("thinpool", "lvmthin", "storage/thinpool", [], {})
                 ],
             },
             {
                 "conf": "provider=lvmthin,provider_name=storage/thinpool,name=thinpool "
                 "provider=zfs,provider_name=ssds,name=ssds,devices=/dev/sdc,devices=/dev/sdd",
                 "expected": [
-                    StoragePoolConfig("thinpool", "lvmthin", "storage/thinpool", []),
-                    StoragePoolConfig("ssds", "zfs", "ssds", ["/dev/sdc", "/dev/sdd"]),
+                    StoragePoolConfig("thinpool", "lvmthin", "storage/thinpool", [], {}),
+                    StoragePoolConfig("ssds", "zfs", "ssds", ["/dev/sdc", "/dev/sdd"], {}),
+                ],
+            },
+            {
+                "conf": "- name: thinpool\n"
+                "  provider: LVM_THIN\n"
+                "  provider_name: storage/thinpool\n"
+                "  props:\n"
+                "    StorDriver/LvcreateOptions: -i 2 -I 64\n"
+                "    MaxOversubscriptionRatio: 5\n"
+                "- {name: ssds, provider: ZFS_THIN, provider_name: ssds, devices: /dev/sdc}\n",
+                "expected": [
+                    StoragePoolConfig(
+                        "thinpool",
+                        "LVM_THIN",
+                        "storage/thinpool",
+                        [],
+                        {"StorDriver/LvcreateOptions": "-i 2 -I 64", "MaxOversubscriptionRatio": "5"},
+                    ),
+                    StoragePoolConfig("ssds", "ZFS_THIN", "ssds", ["/dev/sdc"], {}),
+                ],
+            },
+            {
+                "conf": '[{"name": "ssds", "provider": "ZFS", "provider_name": "ssds", '
+                '"props": {"StorDriver/ZfscreateOptions": "-o recordsize=64k"}}]',
+                "expected": [
+                    StoragePoolConfig("ssds", "ZFS", "ssds", [], {"StorDriver/ZfscreateOptions": "-o recordsize=64k"}),
                 ],
             },
         ]
@@ -35,3 +85,1021 @@ class TestCharmHelpers(unittest.TestCase):
             with self.subTest(conf=test["conf"]):
                 actual = _parse_storage_pool_config(test["conf"])
                 self.assertEqual(test["expected"], actual)
+
+    def test_plan_storage_pools(self):
+        def actual(name, provider, provider_name=None, owner=None, extra_props=None):
+            props = dict(extra_props or {})
+            if provider_name:
+                props["StorDriver/StorPoolName"] = provider_name
+            if owner:
+                props["Aux/charm/registered-for"] = owner
+            return linstor.responses.StoragePool(
+                {"storage_pool_name": name, "provider_kind": provider, "props": props}
+            )
+
+        expected = [
+            StoragePoolConfig("thinpool", "LVM_THIN", "storage/thinpool", []),
+            StoragePoolConfig("ssds", "ZFS_THIN", "ssds", ["/dev/sdc"]),
+            StoragePoolConfig("new", "LVM", "storage", []),
+            StoragePoolConfig("moved", "LVM_THIN", "storage/other", []),
+            StoragePoolConfig("tuned", "LVM", "storage", [], {"MaxOversubscriptionRatio": "5"}),
+        ]
+        current = [
+            actual("DfltDisklessStorPool", "DISKLESS"),
+            actual("thinpool", "LVM_THIN", "storage/thinpool", "linstor-satellite"),
+            actual("ssds", "ZFS_THIN", "linstor_ssds", "linstor-satellite"),
+            actual("moved", "LVM_THIN", "storage/thinpool", "linstor-satellite"),
+            actual("removed", "LVM", "storage", "linstor-satellite"),
+            actual("manual", "LVM", "storage"),
+            actual("tuned", "LVM", "storage", "linstor-satellite", {"MaxOversubscriptionRatio": "2"}),
+        ]
+
+        plan = _plan_storage_pools(expected, current, "linstor-satellite")
+
+        self.assertEqual(
+            StoragePoolPlan(
+                create=[expected[2]],
+                update=[expected[3]],
+                delete=["removed"],
+                modify=[
+                    (
+                        "tuned",
+                        {"MaxOversubscriptionRatio": "5", "Aux/charm/storage-pool-props": "MaxOversubscriptionRatio"},
+                        [],
+                    )
+                ],
+            ),
+            plan,
+        )
+
+    def test_parse_drbd_node_options(self):
+        conf = (
+            "'storage-*':\n"
+            "  net: {max-buffers: 8000, sndbuf-size: 0}\n"
+            "storage-slow-1:\n"
+            "  net: {max-buffers: 2048}\n"
+            "  peer-device: {c-max-rate: 250M}\n"
+        )
+        self.assertEqual(
+            {"DrbdOptions/Net/max-buffers": "8000", "DrbdOptions/Net/sndbuf-size": "0"},
+            _parse_drbd_node_options(conf, "storage-fast-1"),
+        )
+        self.assertEqual(
+            {
+                "DrbdOptions/Net/max-buffers": "2048",
+                "DrbdOptions/Net/sndbuf-size": "0",
+                "DrbdOptions/PeerDevice/c-max-rate": "250M",
+            },
+            _parse_drbd_node_options(conf, "storage-slow-1"),
+        )
+        self.assertEqual({}, _parse_drbd_node_options(conf, "compute-1"))
+        self.assertEqual({}, _parse_drbd_node_options("", "compute-1"))
+
+        # Errors are reported even if the invalid entry does not match the node
+        with self.assertRaises(ValueError):
+            _parse_drbd_node_options("other: {network: {max-buffers: 1}}", "compute-1")
+        with self.assertRaises(ValueError):
+            _parse_drbd_node_options("compute-*: {net: [", "compute-1")
+
+    def test_topology_props(self):
+        self.assertEqual(
+            {"Aux/topology.kubernetes.io/zone": "a", "Aux/example.com/rack": "r1"},
+            _topology_props(
+                ["topology.kubernetes.io/region", "topology.kubernetes.io/zone", "example.com/rack"],
+                {"topology.kubernetes.io/zone": "a", "example.com/rack": "r1", "kubernetes.io/os": "linux"},
+            ),
+        )
+
+    def test_module_cache_key(self):
+        testcases = {
+            "quay.io/piraeusdatastore/drbd9-focal:v9.1.7": "quay.io_piraeusdatastore_drbd9-focal_v9.1.7",
+            "registry.local:5000/drbd9-focal": None,
+            "registry.local:5000/drbd9-focal:latest": None,
+            "drbd.io/drbd9-focal@sha256:0123abcd": "sha256-0123abcd",
+            "drbd.io/drbd9-focal:v9.1.7@sha256:0123abcd": "sha256-0123abcd",
+        }
+        for image, expected in testcases.items():
+            with self.subTest(image=image):
+                self.assertEqual(expected, _module_cache_key(image))
+
+    def test_parse_module_cache_report(self):
+        self.assertIsNone(_parse_module_cache_report("DRBD module is already loaded\n"))
+        self.assertEqual(
+            {"result": "hit", "kernel": "5.4.0-91-generic", "drbd": "v9.1.7", "seconds": 2},
+            _parse_module_cache_report(
+                "drbd-module-cache: failed to load cached modules, building them again\n"
+                "drbd-module-cache: hit kernel=5.4.0-91-generic drbd=v9.1.7 seconds=2\n"
+            ),
+        )
+
+    def test_select_address(self):
+        ip_output = (
+            "1: lo    inet 127.0.0.1/8 scope host lo\\       valid_lft forever preferred_lft forever\n"
+            "2: ens3    inet 10.0.0.5/24 brd 10.0.0.255 scope global ens3\\       valid_lft forever\n"
+            "3: ens5f1    inet6 fe80::1/64 scope link \\       valid_lft forever preferred_lft forever\n"
+            "3: ens5f1    inet6 fd00:100::5/64 scope global \\       valid_lft forever preferred_lft forever\n"
+            "3: ens5f1    inet 192.168.100.5/24 brd 192.168.100.255 scope global ens5f1\\       valid_lft forever\n"
+        )
+
+        self.assertEqual("192.168.100.5", _select_address(ip_output, "192.168.100.0/24"))
+        self.assertEqual("192.168.100.5", _select_address(ip_output, "ens5f1"))
+        self.assertEqual("fd00:100::5", _select_address(ip_output, "fd00:100::/64"))
+        self.assertIsNone(_select_address(ip_output, "172.16.0.0/16"))
+        self.assertIsNone(_select_address(ip_output, "lo"))
+        with self.assertRaises(ValueError):
+            _select_address(ip_output, "ens5/24")
+
+    def test_summarize_fio(self):
+        output = json.dumps(
+            {
+                "jobs": [
+                    {
+                        "read": {
+                            "iops": 51234.56,
+                            "bw": 204938,
+                            "lat_ns": {"mean": 623456.0},
+                            "clat_ns": {
+                                "percentile": {"50.000000": 577536, "99.000000": 1335296, "99.900000": 2899968},
+                            },
+                        },
+                        "write": {"iops": 0, "bw": 0},
+                    }
+                ]
+            }
+        )
+
+        self.assertEqual(
+            {
+                "iops": 51235,
+                "bandwidth-mib": 200.1,
+                "latency-mean-us": 623.5,
+                "latency-p50-us": 577.5,
+                "latency-p99-us": 1335.3,
+                "latency-p99-9-us": 2900.0,
+            },
+            _summarize_fio(output, "read"),
+        )
+
+
+def _pod(name, uid, unit, node_name="node-1", pod_ip="10.0.0.1"):
+    return kubernetes.client.V1Pod(
+        metadata=kubernetes.client.V1ObjectMeta(
+            name=name, uid=uid, annotations={"unit.juju.is/id": unit}
+        ),
+        spec=kubernetes.client.V1PodSpec(containers=[], node_name=node_name),
+        status=kubernetes.client.V1PodStatus(pod_ip=pod_ip),
+    )
+
+
+class TestUnitPod(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(LinstorSatelliteCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.set_model_name("linstor")
+        self.harness.begin()
+        self.core_v1 = mock.Mock()
+        self.harness.charm._core_v1 = self.core_v1
+
+    def test_lists_pods_on_cache_miss(self):
+        self.core_v1.list_namespaced_pod.return_value = kubernetes.client.V1PodList(
+            items=[
+                _pod("sat-a", "uid-a", "linstor-satellite/1"),
+                _pod("sat-b", "uid-b", "linstor-satellite/0"),
+            ]
+        )
+
+        pod = self.harness.charm._get_unit_pod()
+
+        self.assertEqual(UnitPod("sat-b", "uid-b", "node-1", "10.0.0.1"), pod)
+        self.core_v1.read_namespaced_pod.assert_not_called()
+        self.assertEqual("sat-b", self.harness.charm._stored.pod_name)
+
+        # Resolved only once per hook
+        self.harness.charm._get_unit_pod()
+        self.core_v1.list_namespaced_pod.assert_called_once()
+
+    def test_reads_cached_pod_by_name(self):
+        self.harness.charm._stored.pod_name = "sat-b"
+        self.harness.charm._stored.pod_uid = "uid-b"
+        self.harness.charm._stored.node_name = "node-1"
+        self.harness.charm._stored.pod_ip = "10.0.0.1"
+        self.core_v1.read_namespaced_pod.return_value = _pod(
+            "sat-b", "uid-b", "linstor-satellite/0"
+        )
+
+        pod = self.harness.charm._get_unit_pod()
+
+        self.assertEqual(UnitPod("sat-b", "uid-b", "node-1", "10.0.0.1"), pod)
+        self.core_v1.read_namespaced_pod.assert_called_once_with("sat-b", "linstor")
+        self.core_v1.list_namespaced_pod.assert_not_called()
+
+    def test_refreshes_node_once_scheduled(self):
+        self.harness.charm._stored.pod_name = "sat-b"
+        self.harness.charm._stored.pod_uid = "uid-b"
+        self.harness.charm._stored.node_name = None
+        self.harness.charm._stored.pod_ip = None
+        self.core_v1.read_namespaced_pod.return_value = _pod("sat-b", "uid-b", "linstor-satellite/0", None, None)
+
+        self.assertIsNone(self.harness.charm._resolve_unit_pod())
+
+        self.core_v1.read_namespaced_pod.return_value = _pod(
+            "sat-b", "uid-b", "linstor-satellite/0", "node-1", "10.0.0.1"
+        )
+
+        self.assertEqual(UnitPod("sat-b", "uid-b", "node-1", "10.0.0.1"), self.harness.charm._resolve_unit_pod())
+
+    def test_refreshes_cache_when_pod_replaced(self):
+        self.harness.charm._stored.pod_name = "sat-b"
+        self.harness.charm._stored.pod_uid = "uid-b"
+        self.harness.charm._stored.node_name = "node-1"
+        self.harness.charm._stored.pod_ip = "10.0.0.1"
+        self.core_v1.read_namespaced_pod.side_effect = kubernetes.client.exceptions.ApiException(status=404)
+        self.core_v1.list_namespaced_pod.return_value = kubernetes.client.V1PodList(
+            items=[_pod("sat-c", "uid-c", "linstor-satellite/0", "node-2", "10.0.0.2")]
+        )
+
+        pod = self.harness.charm._get_unit_pod()
+
+        self.assertEqual(UnitPod("sat-c", "uid-c", "node-2", "10.0.0.2"), pod)
+        self.assertEqual("uid-c", self.harness.charm._stored.pod_uid)
+
+    def test_reports_module_cache_once_per_pod(self):
+        self.harness.add_resource("pull-secret", "")
+        self.harness.charm._unit_pod = UnitPod("sat-b", "uid-b", "node-1", "10.0.0.1")
+        self.core_v1.read_namespaced_pod_log.return_value = (
+            "drbd-module-cache: miss kernel=5.4.0-91-generic drbd=v9.1.7 seconds=187\n"
+        )
+        self.harness.charm.unit.status = ActiveStatus()
+
+        self.harness.charm._report_module_load()
+        self.harness.charm._report_module_load()
+
+        self.core_v1.read_namespaced_pod_log.assert_called_once_with("sat-b", "linstor", container="drbd-injector")
+        self.assertEqual("uid-b", self.harness.charm._stored.module_load["pod-uid"])
+        self.assertEqual(
+            ActiveStatus("DRBD module built in 187s (cache miss)"), self.harness.charm.unit.status
+        )
+
+
+class TestStoragePools(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(LinstorSatelliteCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        charm = self.harness.charm
+        charm._stored.linstor_url = "http://linstor-api:3370"
+        charm._unit_pod = UnitPod("sat-b", "uid-b", "node-1", "10.0.0.5")
+        self.client = mock.MagicMock()
+        charm._linstor_session = LinstorSession(
+            [charm._stored.linstor_url], lambda _url: self.client, probe=lambda *_: True
+        )
+
+    def test_invalid_config_blocks(self):
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"storage-pools": "- name: thinpool\n  size: 10G\n"})
+        self.harness.charm._stored.pending["storage-pools"] = {"attempts": 1, "not-before": 0}
+
+        self.harness.charm._ensure_storage_pools()
+
+        self.assertIsInstance(self.harness.charm.unit.status, BlockedStatus)
+        self.assertTrue(self.harness.charm.unit.status.message.startswith("invalid storage-pools: unknown keys"))
+        self.assertNotIn("storage-pools", self.harness.charm._stored.pending)
+        self.client.node_list_raise.assert_not_called()
+
+    def test_steps_share_node_list(self):
+        self.client.node_list_raise.return_value = linstor.responses.NodeListResponse(
+            [{"name": "node-1", "type": "SATELLITE", "connection_status": "ONLINE", "props": {}}]
+        )
+        self.client.storage_pool_list_raise.return_value = linstor.responses.StoragePoolListResponse([])
+        charm = self.harness.charm
+
+        charm._ensure_node_registered()
+        charm._ensure_storage_pools()
+        charm._ensure_drbd_node_options()
+        charm._ensure_node_topology()
+
+        self.client.node_list_raise.assert_called_once_with(filter_by_nodes=["node-1"])
+        self.client.storage_pool_list_raise.assert_called_once_with(filter_by_nodes=["node-1"])
+        self.client.node_create.assert_not_called()
+
+    def test_failed_pool_is_retried(self):
+        with self.harness.hooks_disabled():
+            self.harness.update_config(
+                {
+                    "storage-pools": "provider=LVM_THIN,provider_name=storage/thinpool,name=thinpool "
+                    "provider=ZFS,provider_name=ssds,name=ssds "
+                    "provider=FILE_THIN,provider_name=/var/lib/linstor-pools,name=files"
+                }
+            )
+        self.client.node_list_raise.return_value = linstor.responses.NodeListResponse(
+            [{"name": "node-1", "type": "SATELLITE", "connection_status": "ONLINE", "props": {}}]
+        )
+        self.client.storage_pool_list_raise.return_value = linstor.responses.StoragePoolListResponse([])
+
+        def create(storage_pool_name, **_kwargs):
+            if storage_pool_name == "ssds":
+                raise linstor.LinstorError("zpool ssds does not exist")
+            return []
+
+        self.client.storage_pool_create.side_effect = create
+        charm = self.harness.charm
+
+        with mock.patch("time.time", return_value=1000.0):
+            charm._ensure_storage_pools()
+
+        self.assertEqual(
+            WaitingStatus("failed to update storage pools: ssds, retrying"),
+            charm.unit.status,
+        )
+        self.assertEqual(1, charm._stored.pending["storage-pools"]["attempts"])
+        self.assertGreater(charm._stored.pending["storage-pools"]["not-before"], 1000.0)
+        self.assertEqual(
+            {"thinpool", "ssds", "files"},
+            {c[1]["storage_pool_name"] for c in self.client.storage_pool_create.call_args_list},
+        )
+
+        # The retry only creates the pool that is still missing.
+        self.client.storage_pool_create.reset_mock(side_effect=True)
+        self.client.storage_pool_create.return_value = []
+        self.client.storage_pool_list_raise.return_value = linstor.responses.StoragePoolListResponse(
+            [
+                {
+                    "storage_pool_name": name,
+                    "node_name": "node-1",
+                    "provider_kind": provider,
+                    "props": {"StorDriver/StorPoolName": provider_name, "Aux/charm/registered-for": charm.app.name},
+                }
+                for name, provider, provider_name in [
+                    ("thinpool", "LVM_THIN", "storage/thinpool"),
+                    ("files", "FILE_THIN", "/var/lib/linstor-pools"),
+                ]
+            ]
+        )
+        charm._forget_linstor_lists()
+        charm._ensure_storage_pools()
+
+        self.client.storage_pool_create.assert_called_once()
+        self.assertEqual("ssds", self.client.storage_pool_create.call_args[1]["storage_pool_name"])
+        self.assertNotIn("storage-pools", charm._stored.pending)
+        self.assertIsInstance(charm.unit.status, ActiveStatus)
+
+
+class TestReplicationNetwork(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(LinstorSatelliteCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        charm = self.harness.charm
+        charm._stored.linstor_url = "http://linstor-api:3370"
+        charm._unit_pod = UnitPod("sat-b", "uid-b", "node-1", "10.0.0.5")
+        charm._exec_in_satellite = mock.Mock(
+            return_value="3: ens5f1    inet 192.168.100.5/24 brd 192.168.100.255 scope global ens5f1\n"
+        )
+        self.client = mock.MagicMock()
+        self.client.node_modify.return_value = []
+        self.client.storage_pool_modify.return_value = []
+        self.client.netinterface_create.return_value = []
+        self.client.netinterface_modify.return_value = []
+        self.client.netinterface_delete.return_value = []
+        charm._linstor_session = LinstorSession(
+            [charm._stored.linstor_url], lambda _url: self.client, probe=lambda *_: True
+        )
+
+    def _node(self, props, nics):
+        self.client.node_list_raise.return_value = linstor.responses.NodeListResponse(
+            [{"name": "node-1", "type": "SATELLITE", "props": props, "net_interfaces": nics}]
+        )
+        self.client.storage_pool_list_raise.return_value = linstor.responses.StoragePoolListResponse(
+            [
+                {"storage_pool_name": "thinpool", "node_name": "node-1", "provider_kind": "LVM_THIN"},
+                {
+                    "storage_pool_name": "ssds",
+                    "node_name": "node-1",
+                    "provider_kind": "ZFS",
+                    "props": {"PrefNic": "replication"},
+                },
+            ]
+        )
+
+    def test_moves_existing_node_to_replication_network(self):
+        self._node({}, [{"name": "default", "address": "10.0.0.5"}])
+
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"replication-network": "192.168.100.0/24"})
+        self.harness.charm._ensure_replication_network()
+
+        self.client.netinterface_create.assert_called_once_with("node-1", "replication", "192.168.100.5")
+        self.client.node_create.assert_not_called()
+        self.client.node_modify.assert_called_once_with(
+            "node-1", property_dict={"PrefNic": "replication"}, delete_props=[]
+        )
+        self.client.storage_pool_modify.assert_called_once_with(
+            "node-1", "thinpool", {"PrefNic": "replication"}, delete_props=[]
+        )
+
+    def test_removes_replication_network(self):
+        self._node(
+            {"PrefNic": "replication"},
+            [{"name": "default", "address": "10.0.0.5"}, {"name": "replication", "address": "192.168.100.5"}],
+        )
+
+        self.harness.charm._ensure_replication_network()
+
+        self.client.node_modify.assert_called_once_with("node-1", property_dict={}, delete_props=["PrefNic"])
+        self.client.storage_pool_modify.assert_called_once_with("node-1", "ssds", {}, delete_props=["PrefNic"])
+        self.client.netinterface_delete.assert_called_once_with("node-1", "replication")
+
+    def test_retries_if_controller_goes_away(self):
+        self._node({}, [{"name": "default", "address": "10.0.0.5"}])
+        self.client.netinterface_create.side_effect = linstor.errors.LinstorNetworkError("connection refused")
+
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"replication-network": "192.168.100.0/24"})
+        self.harness.charm._ensure_replication_network()
+
+        self.assertIn("replication-network", self.harness.charm._stored.pending)
+        self.client.node_modify.assert_not_called()
+
+
+class TestNodeTopology(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(LinstorSatelliteCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        charm = self.harness.charm
+        charm._stored.linstor_url = "http://linstor-api:3370"
+        charm._unit_pod = UnitPod("sat-b", "uid-b", "node-1", "10.0.0.5")
+        charm._core_v1 = mock.Mock()
+        charm._core_v1.read_node.return_value = kubernetes.client.V1Node(
+            metadata=kubernetes.client.V1ObjectMeta(
+                name="node-1",
+                labels={"kubernetes.io/hostname": "node-1", "topology.kubernetes.io/zone": "b"},
+            ),
+        )
+        self.client = mock.MagicMock()
+        self.client.node_modify.return_value = []
+        charm._linstor_session = LinstorSession(
+            [charm._stored.linstor_url], lambda _url: self.client, probe=lambda *_: True
+        )
+        with self.harness.hooks_disabled():
+            self.harness.update_config(
+                {"topology-labels": "topology.kubernetes.io/region topology.kubernetes.io/zone kubernetes.io/hostname"}
+            )
+
+    def _node(self, props):
+        self.client.node_list_raise.return_value = linstor.responses.NodeListResponse(
+            [{"name": "node-1", "type": "SATELLITE", "props": props}]
+        )
+
+    def test_no_labels_skips_kubernetes_node(self):
+        self._node({"Aux/kubernetes.io/hostname": "node-1", "Aux/charm/topology-labels": "Aux/kubernetes.io/hostname"})
+
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"topology-labels": ""})
+        self.harness.charm._ensure_node_topology()
+
+        self.harness.charm._core_v1.read_node.assert_not_called()
+        self.client.node_modify.assert_called_once_with(
+            "node-1",
+            property_dict={},
+            delete_props=["Aux/kubernetes.io/hostname", "Aux/charm/topology-labels"],
+        )
+
+    def test_untrusted_charm_blocks(self):
+        self._node({})
+        self.harness.charm._core_v1.read_node.side_effect = kubernetes.client.exceptions.ApiException(
+            status=403, reason="Forbidden"
+        )
+
+        self.harness.charm._ensure_node_topology()
+
+        self.assertEqual(BlockedStatus("topology labels require juju trust"), self.harness.charm.unit.status)
+        self.assertNotIn("topology", self.harness.charm._stored.pending)
+        self.client.node_modify.assert_not_called()
+
+        self.harness.charm._core_v1.read_node.side_effect = None
+        self.harness.charm._ensure_node_topology()
+
+        self.assertIsInstance(self.harness.charm.unit.status, ActiveStatus)
+
+    def test_copies_node_labels(self):
+        self._node({"Aux/topology.kubernetes.io/zone": "a"})
+
+        self.harness.charm._ensure_node_topology()
+
+        self.client.node_modify.assert_called_once_with(
+            "node-1",
+            property_dict={
+                "Aux/topology.kubernetes.io/zone": "b",
+                "Aux/kubernetes.io/hostname": "node-1",
+                "Aux/charm/topology-labels": "Aux/kubernetes.io/hostname Aux/topology.kubernetes.io/zone",
+            },
+            delete_props=[],
+        )
+
+    def test_removes_unselected_labels(self):
+        self._node(
+            {
+                "Aux/topology.kubernetes.io/zone": "b",
+                "Aux/kubernetes.io/hostname": "node-1",
+                "Aux/charm/topology-labels": "Aux/kubernetes.io/hostname Aux/topology.kubernetes.io/zone",
+            }
+        )
+
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"topology-labels": "topology.kubernetes.io/zone"})
+        self.harness.charm._ensure_node_topology()
+
+        self.client.node_modify.assert_called_once_with(
+            "node-1",
+            property_dict={"Aux/charm/topology-labels": "Aux/topology.kubernetes.io/zone"},
+            delete_props=["Aux/kubernetes.io/hostname"],
+        )
+
+    def test_unchanged_topology(self):
+        self._node(
+            {
+                "Aux/topology.kubernetes.io/zone": "b",
+                "Aux/kubernetes.io/hostname": "node-1",
+                "Aux/charm/topology-labels": "Aux/kubernetes.io/hostname Aux/topology.kubernetes.io/zone",
+            }
+        )
+
+        self.harness.charm._ensure_node_topology()
+
+        self.client.node_modify.assert_not_called()
+        self.assertNotIn("topology", self.harness.charm._stored.pending)
+
+    def test_update_status_syncs_topology_once(self):
+        charm = self.harness.charm
+        for pending in [{}, {"topology": {"attempts": 1, "not-before": 0}}]:
+            charm._stored.pending = pending
+            with mock.patch.object(charm, "_ensure_node_topology") as topology, mock.patch.object(
+                charm, "_report_module_load"
+            ):
+                charm.on.update_status.emit()
+
+            topology.assert_called_once()
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(LinstorSatelliteCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.add_resource("image-override", "{}")
+        self.harness.add_resource("pull-secret", "")
+        self.harness.begin()
+        self.harness.charm._apps_v1 = mock.MagicMock()
+        self.harness.charm._unit_pod = UnitPod("sat-b", "uid-b", "node-1", "10.0.0.5")
+        self.harness.set_leader(True)
+
+    def test_skips_unchanged_pod_spec(self):
+
+        with mock.patch.object(
+            self.harness.charm.model.pod, "set_spec", wraps=self.harness.charm.model.pod.set_spec
+        ) as set_spec:
+            self.harness.charm.on.config_changed.emit()
+            self.harness.charm.on.config_changed.emit()
+            set_spec.assert_called_once()
+
+            self.harness.update_config({"java-heap-size": "1g"})
+            self.assertEqual(2, set_spec.call_count)
+
+    def test_guaranteed_qos_applies_to_all_containers(self):
+        apps_v1 = self.harness.charm._apps_v1
+        apps_v1.api_client = kubernetes.client.ApiClient()
+        apps_v1.read_namespaced_daemon_set.return_value = kubernetes.client.V1DaemonSet(
+            spec=kubernetes.client.V1DaemonSetSpec(
+                selector=kubernetes.client.V1LabelSelector(),
+                template=kubernetes.client.V1PodTemplateSpec(
+                    spec=kubernetes.client.V1PodSpec(
+                        containers=[
+                            kubernetes.client.V1Container(name="linstor-satellite"),
+                            kubernetes.client.V1Container(name="drbd-reactor"),
+                        ],
+                        init_containers=[kubernetes.client.V1Container(name="drbd-injector")],
+                    ),
+                ),
+            ),
+        )
+
+        self.harness.update_config({"cpu-request": "1", "memory-request": "1Gi", "guaranteed-qos": True})
+
+        resources = {"limits": {"cpu": "1", "memory": "1Gi"}, "requests": {"cpu": "1", "memory": "1Gi"}}
+        apps_v1.patch_namespaced_daemon_set.assert_called_once_with(
+            "linstor-satellite",
+            self.harness.model.name,
+            [
+                {"op": "add", "path": "/spec/template/spec/containers/0/resources", "value": resources},
+                {"op": "add", "path": "/spec/template/spec/containers/1/resources", "value": resources},
+                {"op": "add", "path": "/spec/template/spec/initContainers/0/resources", "value": resources},
+            ],
+            field_manager="charms.linbit.com/v1",
+        )
+
+    def test_module_cache_with_default_injector(self):
+        self.harness.charm.on.config_changed.emit()
+
+        spec, _ = self.harness.get_pod_spec()
+        injector = next(c for c in spec["containers"] if c["name"] == "drbd-injector")
+        self.assertEqual(["/bin/sh", "/charm/inject-drbd.sh"], injector["command"])
+        self.assertEqual(
+            "quay.io_piraeusdatastore_drbd9-focal_v9.1.7", injector["envConfig"]["DRBD_MODULE_VERSION"]
+        )
+
+    def test_no_module_cache_for_latest_injector(self):
+        self.harness.add_resource(
+            "image-override",
+            json.dumps({"drbd-injector-image": {"imagePath": "quay.io/piraeusdatastore/drbd9-focal:latest"}}),
+        )
+        self.harness.charm.on.config_changed.emit()
+
+        spec, _ = self.harness.get_pod_spec()
+        injector = next(c for c in spec["containers"] if c["name"] == "drbd-injector")
+        self.assertNotIn("command", injector)
+        self.assertNotIn("DRBD_MODULE_CACHE", injector["envConfig"])
+
+    def test_module_cache_with_pinned_injector(self):
+        self.harness.add_resource(
+            "image-override",
+            json.dumps({"drbd-injector-image": {"imagePath": "quay.io/piraeusdatastore/drbd9-focal@sha256:0123abcd"}}),
+        )
+        self.harness.charm.on.config_changed.emit()
+
+        spec, _ = self.harness.get_pod_spec()
+        injector = next(c for c in spec["containers"] if c["name"] == "drbd-injector")
+        self.assertEqual(["/bin/sh", "/charm/inject-drbd.sh"], injector["command"])
+        self.assertEqual("sha256-0123abcd", injector["envConfig"]["DRBD_MODULE_VERSION"])
+
+    def test_monitoring_sidecar_and_scrape_job(self):
+        rel_id = self.harness.add_relation("metrics-endpoint", "prometheus")
+        self.harness.add_relation_unit(rel_id, "prometheus/0")
+        self.harness.update_config({"monitoring": True, "monitoring-port": 9000})
+
+        spec, _ = self.harness.get_pod_spec()
+        reactor = spec["containers"][-1]
+        self.assertEqual("drbd-reactor", reactor["name"])
+        self.assertEqual([{"name": "prometheus", "containerPort": 9000}], reactor["ports"])
+        self.assertIn('address = "0.0.0.0:9000"', reactor["volumeConfig"][0]["files"][0]["content"])
+
+        self.assertEqual(
+            {"prometheus_scrape_unit_address": "10.0.0.5", "prometheus_scrape_unit_name": "linstor-satellite/0"},
+            self.harness.get_relation_data(rel_id, "linstor-satellite/0"),
+        )
+        app_data = self.harness.get_relation_data(rel_id, "linstor-satellite")
+        self.assertEqual(
+            [{"metrics_path": "/metrics", "static_configs": [{"targets": ["*:9000"]}]}],
+            json.loads(app_data["scrape_jobs"]),
+        )
+
+    def test_no_scrape_job_without_monitoring(self):
+        rel_id = self.harness.add_relation("metrics-endpoint", "prometheus")
+        self.harness.add_relation_unit(rel_id, "prometheus/0")
+
+        self.assertEqual([], json.loads(self.harness.get_relation_data(rel_id, "linstor-satellite")["scrape_jobs"]))
+
+
+class TestBenchmarkPool(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(LinstorSatelliteCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        charm = self.harness.charm
+        charm._stored.linstor_url = "http://linstor-api:3370"
+        charm._unit_pod = UnitPod("sat-b", "uid-b", "node-1", "10.0.0.5")
+        charm._exec_in_satellite = mock.Mock()
+        self.client = mock.MagicMock()
+        for method in ("resource_dfn_create", "volume_dfn_create", "resource_create", "resource_dfn_delete"):
+            getattr(self.client, method).return_value = []
+        self.client.volume_list_raise.return_value = linstor.responses.ResourceResponse(
+            [{"name": "bench", "node_name": "node-1", "volumes": [{"device_path": "/dev/vg/bench_00000"}]}]
+        )
+        charm._linstor_session = LinstorSession(
+            [charm._stored.linstor_url], lambda _url: self.client, probe=lambda *_: True
+        )
+        self.event = mock.Mock(
+            params={
+                "pool": "thinpool",
+                "profile": "randread-4k",
+                "iodepth": 32,
+                "numjobs": 1,
+                "runtime": 10,
+                "size-mib": 64,
+            }
+        )
+
+    def test_removes_volume_if_fio_fails(self):
+        self.harness.charm._exec_in_satellite.side_effect = [
+            "fio-3.28",
+            subprocess.CalledProcessError(1, ["fio"], "", "fio: failed to open /dev/vg/bench_00000"),
+        ]
+
+        self.harness.charm._on_benchmark_pool_action(self.event)
+
+        resource = self.client.resource_dfn_create.call_args[0][0]
+        self.client.resource_dfn_delete.assert_called_once_with(resource)
+        self.event.fail.assert_called_once_with(
+            "benchmark of pool thinpool failed: fio: failed to open /dev/vg/bench_00000"
+        )
+        self.event.set_results.assert_not_called()
+
+    def test_fails_without_fio(self):
+        self.harness.charm._exec_in_satellite.side_effect = subprocess.CalledProcessError(
+            127, ["fio", "--version"], "", "fio: not found"
+        )
+
+        self.harness.charm._on_benchmark_pool_action(self.event)
+
+        self.client.resource_dfn_create.assert_not_called()
+        self.assertIn("fio is not available", self.event.fail.call_args[0][0])
+
+    def test_failed_exec_is_not_hidden_by_cleanup(self):
+        self.harness.charm._exec_in_satellite.side_effect = [
+            "fio-3.28",
+            kubernetes.client.exceptions.ApiException(status=500, reason="Internal Server Error"),
+        ]
+        self.client.resource_dfn_delete.side_effect = linstor.LinstorError("connection refused")
+
+        self.harness.charm._on_benchmark_pool_action(self.event)
+
+        self.assertIn("Internal Server Error", self.event.fail.call_args[0][0])
+        self.event.set_results.assert_not_called()
+
+
+def _resource(name, node_name, disk_state="UpToDate", flags=()):
+    return {
+        "name": name,
+        "node_name": node_name,
+        "flags": list(flags),
+        "volumes": [{"state": {"disk_state": disk_state}}],
+    }
+
+
+class TestEvacuation(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(LinstorSatelliteCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"evacuation-max-rate": "200M"})
+        charm = self.harness.charm
+        charm._stored.linstor_url = "http://linstor-api:3370"
+        self.client = mock.MagicMock()
+        for method in ("node_modify", "node_delete", "resource_auto_place", "resource_dfn_modify"):
+            getattr(self.client, method).return_value = []
+        self.client.node_list_raise.return_value.nodes = [mock.Mock(props={})]
+        self.client.resource_dfn_list_raise.return_value = linstor.responses.ResourceDefinitionResponse(
+            [{"name": "pvc-1", "props": {}}, {"name": "pvc-2", "props": {}}]
+        )
+        charm._linstor_session = LinstorSession(
+            [charm._stored.linstor_url], lambda _url: self.client, probe=lambda *_: True
+        )
+
+        # Resources on node-1, removed again by resource_delete
+        self.on_node = {
+            "pvc-1": _resource("pvc-1", "node-1"),
+            "pvc-2": _resource("pvc-2", "node-1", "Diskless", ["DRBD_DISKLESS"]),
+        }
+        # Replicas of pvc-1 returned by consecutive lookups
+        self.replicas = []
+
+        def resource_list(filter_by_nodes=None, filter_by_resources=None):
+            if filter_by_nodes:
+                return linstor.responses.ResourceResponse(list(self.on_node.values()))
+            return linstor.responses.ResourceResponse(self.replicas.pop(0))
+
+        def resource_delete(node_name, name):
+            del self.on_node[name]
+            return []
+
+        self.client.resource_list_raise.side_effect = resource_list
+        self.client.resource_delete.side_effect = resource_delete
+
+    @mock.patch("charm.time.sleep")
+    def test_evacuate_node(self, sleep):
+        self.replicas = [
+            [_resource("pvc-1", "node-1"), _resource("pvc-1", "node-2")],
+            [_resource("pvc-1", "node-1"), _resource("pvc-1", "node-2"), _resource("pvc-1", "node-3", "Inconsistent")],
+            [_resource("pvc-1", "node-1"), _resource("pvc-1", "node-2"), _resource("pvc-1", "node-3")],
+        ]
+        progress = mock.Mock()
+
+        result = self.harness.charm._evacuate_node("node-1", progress)
+
+        self.assertEqual(EvacuationResult(["pvc-1", "pvc-2"], {}), result)
+        # The node stays excluded from placement once it is empty.
+        self.client.node_modify.assert_called_once_with("node-1", property_dict={"AutoplaceTarget": "false"})
+        self.client.resource_auto_place.assert_called_once_with("pvc-1", None, additional_place_count=1)
+        self.assertEqual(2, sleep.call_count)
+        self.assertEqual(
+            [mock.call("node-1", "pvc-2"), mock.call("node-1", "pvc-1")],
+            self.client.resource_delete.call_args_list,
+        )
+        self.assertEqual(
+            [
+                mock.call("pvc-1", {"DrbdOptions/PeerDevice/c-max-rate": "200M"}),
+                mock.call("pvc-1", {}, delete_props=["DrbdOptions/PeerDevice/c-max-rate"]),
+            ],
+            self.client.resource_dfn_modify.call_args_list,
+        )
+        self.assertEqual(mock.call(2, 2), progress.call_args)
+
+    def test_keeps_replica_if_placement_fails(self):
+        del self.on_node["pvc-2"]
+        self.replicas = [[_resource("pvc-1", "node-1"), _resource("pvc-1", "node-2")]]
+        self.client.resource_auto_place.return_value = [
+            linstor.ApiCallResponse({"ret_code": linstor.sharedconsts.MASK_ERROR, "message": "not enough nodes"})
+        ]
+
+        result = self.harness.charm._evacuate_node("node-1", mock.Mock())
+
+        self.assertEqual(["pvc-1"], list(result.failed))
+        self.client.resource_delete.assert_not_called()
+        # The rate limit is removed again
+        self.assertEqual(2, self.client.resource_dfn_modify.call_count)
+        # The node is a placement target again
+        self.assertEqual(
+            mock.call("node-1", delete_props=["AutoplaceTarget"]), self.client.node_modify.call_args
+        )
+
+    def test_restores_autoplace_on_error(self):
+        self.client.node_list_raise.return_value.nodes = [mock.Mock(props={"AutoplaceTarget": "true"})]
+        self.client.resource_list_raise.side_effect = [
+            linstor.responses.ResourceResponse(list(self.on_node.values())),
+            linstor.errors.LinstorNetworkError("connection refused"),
+        ]
+
+        with self.assertRaises(linstor.errors.LinstorNetworkError):
+            self.harness.charm._evacuate_node("node-1", mock.Mock())
+
+        self.assertEqual(
+            mock.call("node-1", property_dict={"AutoplaceTarget": "true"}), self.client.node_modify.call_args
+        )
+
+    @mock.patch("charm.time.sleep")
+    def test_evacuates_on_removal(self, sleep):
+        charm = self.harness.charm
+        charm._get_unit_pod = lambda: UnitPod("linstor-satellite-0", "uid", "node-1", "10.0.0.1")
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"evacuate-on-removal": True})
+            rel_id = self.harness.add_relation("linstor", "linstor-controller")
+        del self.on_node["pvc-2"]
+        self.replicas = [
+            [_resource("pvc-1", "node-1"), _resource("pvc-1", "node-2")],
+            [_resource("pvc-1", "node-1"), _resource("pvc-1", "node-2"), _resource("pvc-1", "node-3", "Inconsistent")],
+            [_resource("pvc-1", "node-1"), _resource("pvc-1", "node-2"), _resource("pvc-1", "node-3")],
+        ]
+
+        # The hook waits for the resync, as there may be no later hook to continue in.
+        self.harness.remove_relation(rel_id)
+
+        sleep.assert_called()
+        self.client.resource_delete.assert_called_once_with("node-1", "pvc-1")
+        self.client.node_delete.assert_called_once_with("node-1")
+        self.assertIsNone(charm._stored.linstor_url)
+
+    def test_removes_node_if_evacuation_fails(self):
+        charm = self.harness.charm
+        charm._get_unit_pod = lambda: UnitPod("linstor-satellite-0", "uid", "node-1", "10.0.0.1")
+        with self.harness.hooks_disabled():
+            self.harness.update_config({"evacuate-on-removal": True})
+            rel_id = self.harness.add_relation("linstor", "linstor-controller")
+        self.client.node_modify.return_value = [
+            linstor.ApiCallResponse({"ret_code": linstor.sharedconsts.MASK_ERROR, "message": "access denied"})
+        ]
+
+        self.harness.remove_relation(rel_id)
+
+        self.client.resource_auto_place.assert_not_called()
+        self.client.node_delete.assert_called_once_with("node-1")
+        self.assertIsNone(charm._stored.linstor_url)
+
+
+class TestLinstorSession(unittest.TestCase):
+    def test_reuses_connections(self):
+        factory = mock.Mock(side_effect=lambda _url: mock.Mock())
+        session = LinstorSession(["http://linstor:3370"], factory, probe=lambda *_: True)
+
+        with session.client() as first:
+            pass
+        with session.client() as second:
+            pass
+
+        self.assertIs(first, second)
+        factory.assert_called_once()
+        first.connect.assert_called_once()
+
+        session.close()
+        first.disconnect.assert_called_once()
+
+    def test_discards_broken_connections(self):
+        factory = mock.Mock(side_effect=lambda _url: mock.Mock())
+        session = LinstorSession(["http://linstor:3370"], factory, probe=lambda *_: True)
+
+        with self.assertRaises(linstor.errors.LinstorNetworkError):
+            with session.client() as broken:
+                raise linstor.errors.LinstorNetworkError("connection reset")
+
+        broken.disconnect.assert_called_once()
+        with session.client() as fresh:
+            self.assertIsNot(broken, fresh)
+
+    def test_fails_over_to_reachable_endpoint(self):
+        urls = ["http://linstor-api:3370", "http://10.0.0.1:3370", "http://10.0.0.2:3370"]
+        factory = mock.Mock()
+        factory.side_effect = lambda url: mock.Mock(
+            connect=mock.Mock(side_effect=linstor.errors.LinstorNetworkError("refused") if "10.0.0.1" in url else None)
+        )
+        on_healthy = mock.Mock()
+        probe = mock.Mock(side_effect=lambda url, _timeout: "linstor-api" not in url)
+        session = LinstorSession(urls, factory, preferred=urls[0], on_healthy=on_healthy, probe=probe)
+
+        with session.client():
+            pass
+
+        self.assertEqual([mock.call(urls[1]), mock.call(urls[2])], factory.call_args_list)
+        on_healthy.assert_called_once_with(urls[2])
+        self.assertEqual(urls[2], session.healthy)
+
+        # New connections start with the endpoint that worked
+        session.close()
+        probe.reset_mock()
+        with session.client():
+            pass
+        probe.assert_called_once_with(urls[2], mock.ANY)
+
+    def test_no_reachable_endpoint(self):
+        session = LinstorSession(["http://linstor-api:3370"], mock.Mock(), probe=lambda *_: False)
+
+        with self.assertRaises(linstor.errors.LinstorNetworkError):
+            with session.client():
+                pass
+
+    def test_parse_linstor_endpoints(self):
+        self.assertEqual(
+            ["http://a:3370", "http://b:3370"],
+            _parse_linstor_endpoints({"url": "http://a:3370", "endpoints": '["http://a:3370", "http://b:3370"]'}),
+        )
+        self.assertEqual(["http://a:3370"], _parse_linstor_endpoints({"url": "http://a:3370"}))
+        self.assertEqual(["http://a:3370"], _parse_linstor_endpoints({"url": "http://a:3370", "endpoints": "{"}))
+        self.assertEqual([], _parse_linstor_endpoints({}))
+
+
+class TestRetryScheduler(unittest.TestCase):
+    def setUp(self):
+        self.harness = Harness(LinstorSatelliteCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.add_resource("pull-secret", "")
+        self.harness.begin()
+        self.harness.charm._core_v1 = mock.Mock()
+        self.harness.charm._core_v1.list_namespaced_pod.return_value = kubernetes.client.V1PodList(items=[])
+
+    @mock.patch("charm.time.time", return_value=1000.0)
+    def test_retry_backs_off(self, _time):
+        charm = self.harness.charm
+
+        charm._retry_later("storage-pools", "controller not online")
+        first = charm._stored.pending["storage-pools"]
+        self.assertEqual(1, first["attempts"])
+        self.assertTrue(1015 <= first["not-before"] <= 1030)
+
+        for _ in range(10):
+            charm._retry_later("storage-pools", "controller not online")
+        later = charm._stored.pending["storage-pools"]
+        self.assertEqual(11, later["attempts"])
+        self.assertTrue(1450 <= later["not-before"] <= 1900)
+
+        # Pending steps are coalesced by name
+        self.assertEqual(["storage-pools"], list(charm._stored.pending.keys()))
+
+        charm._reconciled("storage-pools")
+        self.assertNotIn("storage-pools", charm._stored.pending)
+
+    def test_update_status_runs_due_steps(self):
+        charm = self.harness.charm
+        charm._stored.pending["storage-pools"] = {"attempts": 1, "not-before": 0}
+        charm._stored.pending["node-registration"] = {
+            "attempts": 1,
+            "not-before": time.time() + 60,
+        }
+
+        with mock.patch.object(charm, "_ensure_storage_pools") as pools, mock.patch.object(
+            charm, "_ensure_node_registered"
+        ) as registration:
+            self.harness.charm.on.update_status.emit()
+
+        pools.assert_called_once()
+        registration.assert_not_called()
+
+    def test_update_status_reschedules_failed_step(self):
+        charm = self.harness.charm
+        charm._stored.pending["storage-pools"] = {"attempts": 1, "not-before": 0}
+        charm._stored.pending["drbd-options"] = {"attempts": 1, "not-before": 0}
+
+        with mock.patch.object(
+            charm, "_ensure_storage_pools", side_effect=RuntimeError("cannot schedule new futures after shutdown")
+        ), mock.patch.object(charm, "_ensure_drbd_node_options") as drbd_options:
+            self.harness.charm.on.update_status.emit()
+
+        drbd_options.assert_called_once()
+        self.assertEqual(2, charm._stored.pending["storage-pools"]["attempts"])
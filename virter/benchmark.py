@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# Copyright 2022 LINBIT HA-Solutions GmbH
+# See LICENSE file for licensing details.
+
+"""Measure the provisioning throughput of the LINSTOR CSI driver.
+
+For every requested size N, N PersistentVolumeClaims are created at once and the time until each one is Bound is
+recorded. Pods are then started for a subset of the volumes, recording the time until the volume is attached and the
+time until the pod is ready. Finally, a snapshot is taken, restored and a volume is cloned.
+
+Times are measured by polling the Kubernetes API, so they have a resolution of the poll interval. The results are
+written as JSON, so runs with different charm or image versions can be compared.
+"""
+import argparse
+import datetime
+import json
+import math
+import subprocess
+import sys
+import time
+import typing
+
+_LABEL = "linstor-benchmark"
+_STORAGE_CLASS = "linstor-benchmark"
+_SNAPSHOT_CLASS = "linstor-benchmark"
+
+
+class Kubectl:
+    def __init__(self, command: typing.List[str], namespace: str):
+        self.command = command
+        self.namespace = namespace
+
+    def run(self, *args: str, stdin: typing.Optional[str] = None) -> str:
+        return subprocess.run(
+            [*self.command, "--namespace", self.namespace, *args],
+            input=stdin,
+            stdout=subprocess.PIPE,
+            check=True,
+            universal_newlines=True,
+        ).stdout
+
+    def apply(self, objs: typing.List[dict]):
+        self.run("apply", "-f", "-", stdin=json.dumps({"apiVersion": "v1", "kind": "List", "items": objs}))
+
+    def items(self, kind: str, *args: str) -> typing.List[dict]:
+        return json.loads(self.run("get", kind, "-o", "json", *args))["items"]
+
+    def has_resource(self, kind: str) -> bool:
+        return kind in self.run("api-resources", "-o", "name").split()
+
+
+def percentiles(values: typing.List[float]) -> dict:
+    if not values:
+        return {"count": 0}
+
+    values = sorted(values)
+
+    def pct(p):
+        return round(values[min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1)], 2)
+
+    return {
+        "count": len(values),
+        "p50": pct(50),
+        "p90": pct(90),
+        "p99": pct(99),
+        "max": round(values[-1], 2),
+    }
+
+
+def wait_for(
+    what: str,
+    poll: typing.Callable[[], typing.Dict[str, bool]],
+    start: float,
+    timeout: float,
+    interval: float,
+) -> typing.Dict[str, float]:
+    """Poll until all keys reported by poll() are True, returning the seconds from start until each key was True"""
+    done = {}
+    while True:
+        now = time.monotonic()
+        state = poll()
+        for key, ok in state.items():
+            if ok and key not in done:
+                done[key] = now - start
+        if state and len(done) >= len(state):
+            return done
+        if now - start > timeout:
+            raise TimeoutError(f"timed out waiting for {what}: {len(done)}/{len(state)} done")
+        time.sleep(interval)
+
+
+def pvc(name: str, size: str, labels: dict, data_source: typing.Optional[dict] = None) -> dict:
+    obj = {
+        "apiVersion": "v1",
+        "kind": "PersistentVolumeClaim",
+        "metadata": {"name": name, "labels": labels},
+        "spec": {
+            "storageClassName": _STORAGE_CLASS,
+            "accessModes": ["ReadWriteOnce"],
+            "resources": {"requests": {"storage": size}},
+        },
+    }
+    if data_source:
+        obj["spec"]["dataSource"] = data_source
+    return obj
+
+
+def pod(name: str, claim: str, labels: dict, image: str) -> dict:
+    return {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "metadata": {"name": name, "labels": labels},
+        "spec": {
+            "terminationGracePeriodSeconds": 0,
+            "containers": [
+                {
+                    "name": "demo",
+                    "image": image,
+                    "command": ["tail", "-f", "/dev/null"],
+                    "volumeMounts": [{"name": "data", "mountPath": "/mnt/data"}],
+                }
+            ],
+            "volumes": [{"name": "data", "persistentVolumeClaim": {"claimName": claim}}],
+        },
+    }
+
+
+def pod_ready(obj: dict) -> bool:
+    conditions = obj.get("status", {}).get("conditions", [])
+    return any(c["type"] == "Ready" and c["status"] == "True" for c in conditions)
+
+
+def bound_claims(kubectl: Kubectl, selector: str) -> typing.Dict[str, bool]:
+    return {c["metadata"]["name"]: c["status"].get("phase") == "Bound" for c in kubectl.items("pvc", "-l", selector)}
+
+
+def attached_claims(kubectl: Kubectl, claims: typing.Dict[str, str]) -> typing.Dict[str, bool]:
+    """Report for each claim, given by its volume name, if the volume is attached to a node"""
+    attached = {
+        va["spec"]["source"].get("persistentVolumeName")
+        for va in json.loads(kubectl.run("get", "volumeattachments", "-o", "json"))["items"]
+        if va.get("status", {}).get("attached")
+    }
+    return {claim: volume in attached for volume, claim in claims.items()}
+
+
+def cleanup(kubectl: Kubectl, selector: str, args: argparse.Namespace) -> float:
+    start = time.monotonic()
+    kubectl.run("delete", "pods,pvc", "-l", selector, "--wait=false")
+
+    def claims_gone():
+        return {"gone": not kubectl.items("pvc", "-l", selector)}
+
+    wait_for("volumes to be deleted", claims_gone, start, args.timeout, args.interval)
+
+    def volumes_gone():
+        pvs = json.loads(kubectl.run("get", "pv", "-o", "json"))["items"]
+        return {"gone": not any(pv["spec"].get("storageClassName") == _STORAGE_CLASS for pv in pvs)}
+
+    wait_for("persistent volumes to be deleted", volumes_gone, start, args.timeout, args.interval)
+    return round(time.monotonic() - start, 2)
+
+
+def run_scale(kubectl: Kubectl, count: int, args: argparse.Namespace) -> dict:
+    selector = f"{_LABEL}=scale-{count}"
+    labels = {_LABEL: f"scale-{count}"}
+    claims = [f"bench-{count}-{i}" for i in range(count)]
+    print(f"scale {count}: creating {count} volumes", flush=True)
+
+    start = time.monotonic()
+    kubectl.apply([pvc(name, args.size, labels) for name in claims])
+    bound = wait_for(
+        "volumes to be bound", lambda: bound_claims(kubectl, selector), start, args.timeout, args.interval
+    )
+    provisioning = time.monotonic() - start
+
+    with_pods = claims[:args.max_pods]
+    print(f"scale {count}: starting {len(with_pods)} pods", flush=True)
+    volumes = {c["spec"]["volumeName"]: c["metadata"]["name"] for c in kubectl.items("pvc", "-l", selector)}
+    volumes = {volume: claim for volume, claim in volumes.items() if claim in with_pods}
+
+    start = time.monotonic()
+    kubectl.apply([pod(f"{name}-pod", name, labels, args.image) for name in with_pods])
+
+    # Volume attachments are recorded while waiting for the pods, in the same poll loop.
+    attached = {}
+
+    def poll():
+        now = time.monotonic() - start
+        for claim, ok in attached_claims(kubectl, volumes).items():
+            if ok and claim not in attached:
+                attached[claim] = now
+        return {p["metadata"]["name"]: pod_ready(p) for p in kubectl.items("pods", "-l", selector)}
+
+    ready = wait_for("pods to be ready", poll, start, args.timeout, args.interval)
+
+    result = {
+        "volumes": count,
+        "pods": len(with_pods),
+        "provisioning_seconds": round(provisioning, 2),
+        "volumes_per_second": round(count / max(provisioning, 0.001), 2),
+        "time_to_bound": percentiles(list(bound.values())),
+        "time_to_attach": percentiles(list(attached.values())),
+        "pod_start": percentiles(list(ready.values())),
+    }
+    print(f"scale {count}: cleaning up", flush=True)
+    result["cleanup_seconds"] = cleanup(kubectl, selector, args)
+    return result
+
+
+def run_snapshot_and_clone(kubectl: Kubectl, args: argparse.Namespace) -> dict:
+    selector = f"{_LABEL}=data-source"
+    labels = {_LABEL: "data-source"}
+    result = {}
+
+    start = time.monotonic()
+    kubectl.apply(
+        [pvc("bench-source", args.size, labels), pod("bench-source-pod", "bench-source", labels, args.image)]
+    )
+
+    def poll_source():
+        return {p["metadata"]["name"]: pod_ready(p) for p in kubectl.items("pods", "-l", selector)}
+
+    wait_for("source pod to be ready", poll_source, start, args.timeout, args.interval)
+
+    def restore(name: str, data_source: dict) -> dict:
+        start = time.monotonic()
+        kubectl.apply([pvc(name, args.size, labels, data_source), pod(f"{name}-pod", name, labels, args.image)])
+
+        def poll_bound():
+            return {name: bound_claims(kubectl, selector).get(name, False)}
+
+        def poll_ready():
+            pods = kubectl.items("pods", "-l", selector)
+            return {name: any(pod_ready(p) for p in pods if p["metadata"]["name"] == f"{name}-pod")}
+
+        bound = wait_for(f"{name} to be bound", poll_bound, start, args.timeout, args.interval)
+        ready = wait_for(f"{name} pod to be ready", poll_ready, start, args.timeout, args.interval)
+        return {"time_to_bound": round(bound[name], 2), "pod_start": round(ready[name], 2)}
+
+    print("cloning volume", flush=True)
+    result["clone"] = restore(
+        "bench-clone", {"name": "bench-source", "kind": "PersistentVolumeClaim", "apiGroup": ""}
+    )
+
+    if kubectl.has_resource("volumesnapshots.snapshot.storage.k8s.io"):
+        print("taking snapshot", flush=True)
+        start = time.monotonic()
+        kubectl.apply(
+            [
+                {
+                    "apiVersion": "snapshot.storage.k8s.io/v1",
+                    "kind": "VolumeSnapshot",
+                    "metadata": {"name": "bench-snapshot", "labels": labels},
+                    "spec": {
+                        "volumeSnapshotClassName": _SNAPSHOT_CLASS,
+                        "source": {"persistentVolumeClaimName": "bench-source"},
+                    },
+                }
+            ]
+        )
+
+        def poll_snapshot():
+            snapshots = kubectl.items("volumesnapshots", "-l", selector)
+            return {"snapshot": any(s.get("status", {}).get("readyToUse") for s in snapshots)}
+
+        ready = wait_for("snapshot to be ready", poll_snapshot, start, args.timeout, args.interval)
+        result["snapshot"] = {"time_to_ready": round(ready["snapshot"], 2)}
+
+        print("restoring snapshot", flush=True)
+        result["snapshot_restore"] = restore(
+            "bench-restore",
+            {"name": "bench-snapshot", "kind": "VolumeSnapshot", "apiGroup": "snapshot.storage.k8s.io"},
+        )
+        kubectl.run("delete", "volumesnapshots", "-l", selector, "--wait=false")
+    else:
+        result["snapshot"] = {"skipped": "VolumeSnapshot API not installed"}
+
+    cleanup(kubectl, selector, args)
+    return result
+
+
+def storage_classes(args: argparse.Namespace) -> typing.List[dict]:
+    # Like examples/storageclass.yaml, but binding immediately: the number of volumes is not limited by the number of
+    # pods the nodes can run, and provisioning is measured without the scheduler.
+    return [
+        {
+            "apiVersion": "storage.k8s.io/v1",
+            "kind": "StorageClass",
+            "metadata": {"name": _STORAGE_CLASS},
+            "provisioner": "linstor.csi.linbit.com",
+            "allowVolumeExpansion": True,
+            "volumeBindingMode": "Immediate",
+            "parameters": {"autoPlace": str(args.replicas), "storagePool": args.storage_pool},
+        },
+        {
+            "apiVersion": "snapshot.storage.k8s.io/v1",
+            "kind": "VolumeSnapshotClass",
+            "metadata": {"name": _SNAPSHOT_CLASS},
+            "driver": "linstor.csi.linbit.com",
+            "deletionPolicy": "Delete",
+        },
+    ]
+
+
+def environment(kubectl: Kubectl, linstor_namespace: str) -> dict:
+    """Collect the versions the results belong to"""
+    images = set()
+    for p in Kubectl(kubectl.command, linstor_namespace).items("pods"):
+        for container in p["spec"].get("initContainers", []) + p["spec"]["containers"]:
+            images.add(container["image"])
+    version = json.loads(kubectl.run("version", "-o", "json"))
+    return {
+        "kubernetes": version.get("serverVersion", {}).get("gitVersion"),
+        "nodes": len(kubectl.items("nodes")),
+        "images": sorted(images),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kubectl", default="kubectl", help="kubectl command, split on spaces")
+    parser.add_argument("--namespace", default="default", help="namespace for the benchmark volumes and pods")
+    parser.add_argument("--linstor-namespace", default="linstor", help="namespace of the LINSTOR charms")
+    parser.add_argument("--sizes", default="100,500,1000", help="comma separated numbers of volumes to create")
+    parser.add_argument("--max-pods", type=int, default=150, help="maximum number of pods started per size")
+    parser.add_argument("--size", default="1Gi", help="size of each volume")
+    parser.add_argument("--replicas", type=int, default=1, help="number of replicas of each volume")
+    parser.add_argument("--storage-pool", default="thinpool", help="LINSTOR storage pool for the volumes")
+    parser.add_argument("--image", default="busybox", help="image of the benchmark pods")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between polls")
+    parser.add_argument("--timeout", type=float, default=3600, help="seconds to wait for each phase")
+    parser.add_argument("--output", required=True, help="path of the JSON result file")
+    args = parser.parse_args()
+
+    kubectl = Kubectl(args.kubectl.split(), args.namespace)
+    classes = storage_classes(args)
+    if not kubectl.has_resource("volumesnapshotclasses.snapshot.storage.k8s.io"):
+        classes = classes[:1]
+    kubectl.apply(classes)
+
+    results = {
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "environment": environment(kubectl, args.linstor_namespace),
+        "parameters": {
+            "size": args.size,
+            "replicas": args.replicas,
+            "storage_pool": args.storage_pool,
+            "max_pods": args.max_pods,
+            "poll_interval": args.interval,
+        },
+        "scale": [],
+    }
+    try:
+        for count in (int(n) for n in args.sizes.split(",")):
+            results["scale"].append(run_scale(kubectl, count, args))
+        results["data_source"] = run_snapshot_and_clone(kubectl, args)
+    except (TimeoutError, subprocess.CalledProcessError) as e:
+        results["error"] = str(e)
+        print(f"benchmark failed: {e}", file=sys.stderr)
+    finally:
+        results["finished"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    print(json.dumps(results, indent=2))
+    return 1 if "error" in results else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())